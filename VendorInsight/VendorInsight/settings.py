@@ -41,11 +41,14 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'ecommerce.instrumentation.RequestProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'ecommerce.profiling.OnDemandProfilerMiddleware',
+    'ecommerce.routers.ReplicaPinningMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -76,6 +79,9 @@ WSGI_APPLICATION = 'VendorInsight.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.1/ref/settings/#databases
 
+# Connections are kept open between requests (CONN_MAX_AGE seconds) and
+# checked before reuse, so a restarted server costs one failed ping, not an
+# error page.
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.postgresql',
@@ -84,9 +90,30 @@ DATABASES = {
         'PASSWORD': 'zxasqw123',
         'HOST': 'localhost',
         'PORT': '5432',
-    }
+        'CONN_MAX_AGE': 60,
+        'CONN_HEALTH_CHECKS': True,
+    },
+    # Streaming replica for analytics and recommender reads. Point HOST at
+    # the standby; until then it is a second connection to the primary.
+    'replica': {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': 'VendorInsight',
+        'USER': 'postgres',
+        'PASSWORD': 'zxasqw123',
+        'HOST': 'localhost',
+        'PORT': '5432',
+        # Long-running analytics reads; reuse connections longer
+        'CONN_MAX_AGE': 300,
+        'CONN_HEALTH_CHECKS': True,
+        'TEST': {'MIRROR': 'default'},
+    },
 }
 
+DATABASE_ROUTERS = ['ecommerce.routers.ReplicaRouter']
+REPLICA_DATABASE = 'replica'
+# How long after a write the user's reads stay on the primary
+REPLICA_PIN_SECONDS = 5
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
@@ -135,6 +162,16 @@ STATICFILES_DIRS = [
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Uploaded files. Django only serves them with DEBUG; in production the web
+# server serves MEDIA_ROOT at MEDIA_URL. Product image derivatives
+# (MEDIA_ROOT/product_images/derivatives/, see ecommerce/images.py) have
+# content-hashed names and should be sent with
+# "Cache-Control: public, max-age=31536000, immutable", e.g. for nginx:
+#
+#   location /uploads/product_images/derivatives/ {
+#       alias /path/to/uploads/product_images/derivatives/;
+#       add_header Cache-Control "public, max-age=31536000, immutable";
+#   }
 MEDIA_ROOT = BASE_DIR / "uploads"
 MEDIA_URL = "/uploads/"
 
@@ -143,9 +180,95 @@ LOGOUT_REDIRECT_URL = 'login'  # or your site's login page
 
 AUTH_USER_MODEL = 'ecommerce.User'
 
+AUTHENTICATION_BACKENDS = [
+    # Loads request.user with its profile in one query
+    'ecommerce.identity.ProfileBackend',
+    # Keeps sessions that logged in before ProfileBackend valid
+    'django.contrib.auth.backends.ModelBackend',
+]
+
+# A per-process LRU in front of a cache every process and node shares. The
+# shared tier is a Postgres table (run `manage.py createcachetable` once);
+# Redis or memcached drop in as e.g.
+#   'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+#   'LOCATION': 'redis://127.0.0.1:6379',
+# and LocMemCache stands in for them on a single machine.
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
-        'LOCATION': BASE_DIR / 'cache',
-    }
+        'BACKEND': 'ecommerce.cache_backends.TieredCache',
+        'OPTIONS': {
+            'SHARED': 'shared',
+            'LOCAL_MAX_ENTRIES': 2000,
+            # Longest a value changed by another process is served stale here
+            'LOCAL_TIMEOUT': 5,
+        },
+    },
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'ecommerce_cache',
+    },
 }
+
+# With Redis, memcached or LocMemCache as the shared tier, sessions are read
+# from it and written through to the database, which takes the session
+# query off every request. They use the shared tier directly: a per-process
+# copy could still show a session another worker has just logged out.
+# Against the DatabaseCache a cache read is itself a query, so sessions
+# stay on the database backend then.
+if CACHES['shared']['BACKEND'] != 'django.core.cache.backends.db.DatabaseCache':
+    SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+    SESSION_CACHE_ALIAS = 'shared'
+
+# Fraction of requests profiled by RequestProfilingMiddleware (SQL, spans,
+# Server-Timing header and a JSON log line); keep it low in production
+REQUEST_PROFILE_SAMPLE_RATE = 1.0 if DEBUG else 0.01
+REQUEST_PROFILE_SLOW_QUERIES = 5
+
+# Staff can profile a single request with ?_profile=cprofile|sample (see
+# ecommerce.profiling); at most PROFILER_MAX_PER_HOUR across all workers
+PROFILE_DIR = BASE_DIR / 'profiles'
+PROFILER_MAX_PER_HOUR = 20
+PROFILER_KEEP = 200
+PROFILER_SAMPLE_INTERVAL = 0.005
+
+# Serve home, product_detail, cart and wishlist from ecommerce.async_views.
+# Only worth it under asgi.py; under WSGI each call pays for its own event
+# loop, so turn it on where the site is served through ASGI.
+ASYNC_STOREFRONT = False
+# Threads the async views run the recommender on
+RECOMMENDER_THREADS = 4
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'ecommerce.requests': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+        'ecommerce.jobs': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+    },
+}
+
+# Product views and user interactions are buffered per process and written
+# in bulk once this many events are pending or every N seconds. While writes
+# fail, at most INTERACTION_BUFFER_MAX_SIZE interactions are kept.
+INTERACTION_FLUSH_SIZE = 500
+INTERACTION_FLUSH_INTERVAL = 5.0
+INTERACTION_BUFFER_MAX_SIZE = 20000
+
+# Background jobs (ecommerce/jobs.py), run by `manage.py run_workers`.
+# A job is retried after JOB_RETRY_BACKOFF * 2**(attempt - 1) seconds (at
+# most JOB_RETRY_BACKOFF_MAX, with jitter), and is taken over by another
+# worker when its worker stops renewing its JOB_LEASE
+JOB_WORKERS = 2
+JOB_LEASE = 300
+JOB_MAX_ATTEMPTS = 3
+JOB_RETRY_BACKOFF = 30
+JOB_RETRY_BACKOFF_MAX = 3600
+JOB_RETENTION_DAYS = 7
+
+# Month-partitioned Parquet/Arrow copy of the order lines the forecasts read
+# (see ecommerce.order_facts). Analytics jobs bring it up to date; `manage.py
+# export_order_facts` does so by hand or with --full/--since
+ORDER_FACTS_DIR = BASE_DIR / 'order_facts'
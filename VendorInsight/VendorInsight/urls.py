@@ -14,12 +14,23 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, re_path, include
 from django.conf.urls.static import static
 from django.conf import settings
+from ecommerce.images import DERIVATIVE_DIR, serve_derivative
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', include('ecommerce.urls')),
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT) \
-  + static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
+]
+
+# Like static() below, for development only: in production the web server
+# serves MEDIA_ROOT (see the notes next to MEDIA_ROOT in settings.py)
+if settings.DEBUG:
+    # Content-hashed image derivatives, served with an immutable Cache-Control
+    urlpatterns.append(
+        re_path(r'^%s%s(?P<path>.*)$' % (settings.MEDIA_URL.lstrip('/'), DERIVATIVE_DIR),
+                serve_derivative, {'document_root': settings.MEDIA_ROOT / DERIVATIVE_DIR}))
+
+urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT) \
+    + static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
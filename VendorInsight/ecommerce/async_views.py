@@ -0,0 +1,228 @@
+"""
+Async versions of the read-heavy storefront views, for workers running
+under asgi.py. urls.py serves them instead of the ones in views.py when
+settings.ASYNC_STOREFRONT is on; they render the same templates.
+
+The ORM calls of one request run on that request's own sync thread (see
+asgiref's ThreadSensitiveContext), so they still happen one at a time;
+what overlaps is the recommender, which runs on a bounded thread pool
+while the page's queries go ahead, and other requests, which are no
+longer stuck behind a worker that is waiting on either.
+"""
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib import messages
+from django.contrib.auth.views import redirect_to_login
+from django.db import close_old_connections
+from django.db.models import Q
+from django.http import Http404
+from django.shortcuts import redirect
+
+from .checkout import place_order, CheckoutError
+from .forms import ReviewForm
+from .ingestion import record_view
+from .instrumentation import render
+from .jobs import enqueue
+from .models import Product, Category, ProductReview, Cart, CartItem, Wishlist
+from .pagination import CursorPaginator
+
+# The recommender is CPU-bound; bounding the pool keeps
+# a burst of requests from starting more of them than there are cores
+_pool = ThreadPoolExecutor(max_workers=getattr(settings, 'RECOMMENDER_THREADS', 4),
+                           thread_name_prefix='recommender')
+
+
+def _run_and_close(func, *args):
+    try:
+        return func(*args)
+    finally:
+        # Pool threads outlive the request, so nothing else closes their
+        # connections
+        close_old_connections()
+
+
+async def run_in_pool(func, *args):
+    """
+    Runs `func(*args)` on the recommender pool. It gets a copy of the
+    caller's context, so read_replica(), primary pinning and the request
+    profile's spans apply inside it as they would inline.
+    """
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(
+        _pool, context.run, _run_and_close, func, *args)
+
+
+async def _all(queryset):
+    return [obj async for obj in queryset]
+
+
+async def _get_or_404(queryset, **kwargs):
+    try:
+        return await queryset.aget(**kwargs)
+    except queryset.model.DoesNotExist:
+        raise Http404(f'No {queryset.model._meta.object_name} matches the given query.')
+
+
+async def _render(request, template_name, context):
+    # Templates may still touch lazy relations, which needs a sync thread
+    return await sync_to_async(render)(request, template_name, context)
+
+
+def async_login_required(view):
+    """
+    login_required for async views. Django 4.1's decorator only wraps sync
+    views, and request.user has to be loaded off the event loop.
+    """
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        is_authenticated = await sync_to_async(lambda: request.user.is_authenticated)()
+        if not is_authenticated:
+            return redirect_to_login(request.get_full_path())
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+@async_login_required
+async def home(request):
+    products = Product.objects.with_card_data()
+
+    # Search
+    search_query = request.GET.get('search', '')
+    if search_query:
+        products = products.filter(
+            Q(name__icontains=search_query) | Q(
+                description__icontains=search_query)
+        )
+
+    # Filter
+    category_query = request.GET.get('category', '')
+    if category_query:
+        products = products.filter(categories__name=category_query)
+
+    # Sort (the trailing id keeps the cursor position unique)
+    sort_by = request.GET.get('sort_by', '')
+    if sort_by == 'price_asc':
+        ordering = ('price', 'id')
+    elif sort_by == 'price_desc':
+        ordering = ('-price', '-id')
+    else:
+        ordering = ('id',)
+
+    from .recommendation_engine import recommend_products_collaborative
+
+    # Show 9 products per page
+    paginator = CursorPaginator(products, 9, ordering)
+    categories, page, recommended_products = await asyncio.gather(
+        _all(Category.objects.all()),
+        sync_to_async(paginator.get_page)(request.GET.get('cursor')),
+        run_in_pool(recommend_products_collaborative, request.user.id, 5),
+    )
+
+    context = {
+        'products': page,
+        'categories': categories,
+        'recommended_products': recommended_products,
+    }
+    return await _render(request, 'ecommerce/home.html', context)
+
+
+@async_login_required
+async def product_detail(request, product_id):
+    product = await _get_or_404(Product.objects.with_card_data(), pk=product_id)
+
+    if request.method == 'POST':
+        review_form = ReviewForm(request.POST)
+        if await sync_to_async(review_form.is_valid)():
+            new_review = review_form.save(commit=False)
+            new_review.product = product
+            new_review.user = request.user
+            await sync_to_async(new_review.save)()
+
+            await sync_to_async(enqueue)(
+                'analyze_review_sentiment', new_review.id, priority=10,
+                dedupe_key=f'review_sentiment:{new_review.id}')
+
+            messages.success(request, 'Review added successfully!')
+            return redirect('product_detail', product_id=product.id)
+    else:
+        review_form = ReviewForm()
+
+    from .recommendation_engine import recommend_products
+    reviews, recommended_products, _ = await asyncio.gather(
+        _all(ProductReview.objects.filter(product=product).select_related('user')),
+        run_in_pool(recommend_products, product_id, None, 5),
+        # Buffered; may flush to the database, so not on the event loop
+        sync_to_async(record_view)(request.user, product),
+    )
+
+    context = {
+        'product': product,
+        'reviews': reviews,
+        'review_form': review_form,
+        'recommended_products': recommended_products,
+    }
+    return await _render(request, 'ecommerce/product_detail.html', context)
+
+
+@async_login_required
+async def cart(request):
+    cart = await Cart.objects.filter(user=request.user).afirst()
+    cart_items = CartItem.objects.filter(cart=cart).select_related('product')
+
+    if request.method == 'POST':
+        action = request.POST.get('action')
+        if action == 'place_order':
+            try:
+                await sync_to_async(place_order)(request.user)
+            except CheckoutError as e:
+                messages.error(request, str(e))
+                return redirect('cart')
+            messages.success(request, 'Order placed successfully!')
+            return redirect('home')
+        elif action == 'remove_item':
+            deleted, _ = await CartItem.objects.filter(
+                id=request.POST.get('item_id'), cart__user=request.user).adelete()
+            if not deleted:
+                raise Http404('No CartItem matches the given query.')
+            messages.success(request, 'Item removed from cart!')
+            return redirect('cart')
+        elif action == 'clear_cart':
+            await cart_items.adelete()
+            messages.success(request, 'Cart cleared!')
+            return redirect('cart')
+
+    cart_items = await _all(cart_items)
+    total_price = sum(item.product.price *
+                      item.quantity for item in cart_items)
+
+    context = {
+        'cart_items': cart_items,
+        'total_price': total_price,
+    }
+    return await _render(request, 'ecommerce/cart.html', context)
+
+
+@async_login_required
+async def wishlist(request):
+    wishlist = await Wishlist.objects.filter(user=request.user).afirst()
+
+    if request.method == 'POST':
+        product_id = request.POST.get('product_id')
+        if product_id:
+            product = await _get_or_404(Product.objects.all(), pk=product_id)
+            if wishlist:
+                await sync_to_async(wishlist.products.remove)(product)
+                messages.success(request, 'Product removed from wishlist!')
+            return redirect('wishlist')
+
+    wishlist_products = await _all(wishlist.products.with_card_data()) if wishlist else []
+
+    context = {
+        'wishlist_products': wishlist_products,
+    }
+    return await _render(request, 'ecommerce/wishlist.html', context)
@@ -0,0 +1,297 @@
+import asyncio
+import json
+import random
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import ThreadSensitiveContext, sync_to_async
+from django.db import connections
+from django.db.models import Count
+from django.test import AsyncClient, Client, override_settings
+from django.urls import reverse
+
+from . import async_views, urls, views
+from .models import User, Product, Category
+from .synthetic import USERNAME_PREFIX
+
+Route = namedtuple('Route', 'name url_name method role build')
+
+# Routes that cannot be driven repeatedly without breaking the session, or
+# that need a saved request profile
+SKIPPED_URL_NAMES = {'logout', 'profile_report'}
+
+STAFF_USERNAME = f'{USERNAME_PREFIX}bench-staff'
+
+
+def _product(fixture, rng):
+    return {'product_id': rng.choice(fixture.product_ids)}
+
+
+ROUTES = [
+    Route('register', 'register', 'get', None, lambda f, r: ({}, None)),
+    Route('login', 'login', 'get', None, lambda f, r: ({}, None)),
+    Route('home', 'home', 'get', 'customer', lambda f, r: ({}, None)),
+    Route('home_search', 'home', 'get', 'customer',
+          lambda f, r: ({}, {'search': r.choice(('Lamp', 'Chair', 'Smart', 'Cable'))})),
+    Route('home_category', 'home', 'get', 'customer',
+          lambda f, r: ({}, {'category': r.choice(f.categories)})),
+    Route('home_sorted', 'home', 'get', 'customer',
+          lambda f, r: ({}, {'sort_by': r.choice(('price_asc', 'price_desc'))})),
+    Route('product_detail', 'product_detail', 'get', 'customer',
+          lambda f, r: (_product(f, r), None)),
+    Route('add_to_cart', 'add_to_cart', 'post', 'customer',
+          lambda f, r: (_product(f, r), {'quantity': 1})),
+    Route('add_to_wishlist', 'add_to_wishlist', 'get', 'customer',
+          lambda f, r: (_product(f, r), None)),
+    Route('cart', 'cart', 'get', 'customer', lambda f, r: ({}, None)),
+    Route('checkout', 'cart', 'post', 'customer',
+          lambda f, r: ({}, {'action': 'place_order'})),
+    Route('wishlist', 'wishlist', 'get', 'customer', lambda f, r: ({}, None)),
+    Route('profile', 'profile', 'get', 'customer', lambda f, r: ({}, None)),
+    Route('order_history', 'order_history', 'get', 'customer', lambda f, r: ({}, None)),
+    Route('vendor_home', 'vendor_home', 'get', 'vendor', lambda f, r: ({}, None)),
+    Route('vendor_home_range', 'vendor_home', 'get', 'vendor',
+          lambda f, r: ({}, {'range': r.choice(('7_days', '1_month', '6_months', '5_years'))})),
+    Route('vendor_products', 'vendor_products', 'get', 'vendor', lambda f, r: ({}, None)),
+    Route('add_product', 'add_product', 'get', 'vendor', lambda f, r: ({}, None)),
+    Route('vendor_analytics', 'vendor_analytics', 'get', 'vendor', lambda f, r: ({}, None)),
+    Route('vendor_order_status', 'vendor_order_status', 'get', 'vendor',
+          lambda f, r: ({}, None)),
+    Route('cache_stats', 'cache_stats', 'get', 'staff', lambda f, r: ({}, None)),
+    Route('job_stats', 'job_stats', 'get', 'staff', lambda f, r: ({}, None)),
+]
+
+
+def uncovered_url_names():
+    """ecommerce URL names that no benchmark route drives."""
+    names = {pattern.name for pattern in urls.urlpatterns if pattern.name}
+    return sorted(names - {route.url_name for route in ROUTES} - SKIPPED_URL_NAMES)
+
+
+class Fixture:
+    """The users and ids the routes pick from, read from a seeded database."""
+
+    def __init__(self, customers):
+        self.customers = list(User.objects.filter(
+            username__startswith=f'{USERNAME_PREFIX}customer').order_by('id')[:customers])
+        # The busiest vendor makes the vendor pages do the most work
+        self.vendor = User.objects.filter(userprofile__is_vendor=True).annotate(
+            orders=Count('vendor_orders')).order_by('-orders', 'id').first()
+        self.staff, _ = User.objects.get_or_create(
+            username=STAFF_USERNAME, defaults={'is_staff': True})
+        self.product_ids = list(Product.objects.values_list('id', flat=True))
+        self.categories = list(Category.objects.values_list('name', flat=True))
+        if not self.customers or self.vendor is None or not self.product_ids:
+            raise ValueError('The database has no synthetic customers, vendors or products; '
+                             'seed it with generate_data first.')
+
+    def user_for(self, role, worker):
+        if role == 'customer':
+            return self.customers[worker % len(self.customers)]
+        if role == 'vendor':
+            return self.vendor
+        if role == 'staff':
+            return self.staff
+        return None
+
+
+def split(total, parts):
+    """`total` requests spread as evenly as possible over `parts` clients."""
+    counts = [total // parts] * parts
+    for index in range(total % parts):
+        counts[index] += 1
+    return counts
+
+
+def percentile(ordered, fraction):
+    """Nearest-rank percentile of an ascending list."""
+    if not ordered:
+        return 0.0
+    index = max(0, min(len(ordered) - 1, round(fraction * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+class RouteBenchmark:
+    """
+    Drives each route with `requests` requests spread over `concurrency`
+    threads, each with its own logged-in test Client (in-process WSGI, no
+    network). Returns per-route throughput and latency percentiles.
+    """
+
+    def __init__(self, fixture, requests=50, concurrency=4, warmup=1, seed=0, stdout=None):
+        self.fixture = fixture
+        self.requests = requests
+        self.concurrency = concurrency
+        self.warmup = warmup
+        self.seed = seed
+        self.stdout = stdout
+
+    def log(self, message):
+        if self.stdout is not None:
+            self.stdout.write(message)
+
+    def client(self, route, worker):
+        client = Client()
+        user = self.fixture.user_for(route.role, worker)
+        if user is not None:
+            client.force_login(user)
+        return client
+
+    def request(self, client, route, rng):
+        kwargs, data = route.build(self.fixture, rng)
+        path = reverse(route.url_name, kwargs=kwargs)
+        started = time.perf_counter()
+        response = getattr(client, route.method)(path, data)
+        return time.perf_counter() - started, response.status_code
+
+    def worker(self, route, worker, count):
+        rng = random.Random(f'{self.seed}:{route.name}:{worker}')
+        client = self.client(route, worker)
+        try:
+            for _ in range(self.warmup):
+                self.request(client, route, rng)
+            return [self.request(client, route, rng) for _ in range(count)]
+        finally:
+            connections.close_all()
+
+    def run_route(self, route):
+        counts = split(self.requests, self.concurrency)
+        started = time.perf_counter()
+        with ThreadPoolExecutor(self.concurrency) as pool:
+            samples = [sample for result in pool.map(
+                self.worker, [route] * self.concurrency, range(self.concurrency), counts)
+                for sample in result]
+        return summarize(samples, time.perf_counter() - started)
+
+    def routes(self):
+        return ROUTES
+
+    def run(self, names=None):
+        results = {}
+        for route in self.routes():
+            if names and route.name not in names:
+                continue
+            results[route.name] = self.run_route(route)
+            self.log(format_result(route.name, results[route.name]))
+        return results
+
+
+class StorefrontURLConf:
+    """A root URLconf serving the ecommerce URLs with the given storefront views."""
+
+    def __init__(self, storefront):
+        self.urlpatterns = urls.build_urlpatterns(storefront)
+
+
+class AsgiBenchmark(RouteBenchmark):
+    """
+    Drives the storefront's GET routes through Django's async request
+    handler, with `concurrency` clients as tasks on one event loop: once
+    with the sync views (which ASGI runs on a thread per request) and once
+    with ecommerce.async_views. Returns {'sync': results, 'async': results}.
+    """
+
+    STOREFRONTS = (('sync', views), ('async', async_views))
+    URL_NAMES = ('home', 'product_detail', 'cart', 'wishlist')
+
+    def routes(self):
+        return [route for route in ROUTES
+                if route.url_name in self.URL_NAMES and route.method == 'get']
+
+    def client(self, route, worker):
+        client = AsyncClient()
+        user = self.fixture.user_for(route.role, worker)
+        if user is not None:
+            client.force_login(user)
+        return client
+
+    async def request(self, client, route, rng):
+        kwargs, data = route.build(self.fixture, rng)
+        path = reverse(route.url_name, kwargs=kwargs)
+        started = time.perf_counter()
+        # ASGIHandler gives each request its own sync thread and closes its
+        # connections at the end; AsyncClient does neither on its own
+        async with ThreadSensitiveContext():
+            response = await getattr(client, route.method)(path, data)
+            await sync_to_async(connections.close_all)()
+        return time.perf_counter() - started, response.status_code
+
+    async def worker(self, client, route, worker, count):
+        rng = random.Random(f'{self.seed}:{route.name}:{worker}')
+        for _ in range(self.warmup):
+            await self.request(client, route, rng)
+        return [await self.request(client, route, rng) for _ in range(count)]
+
+    def run_route(self, route):
+        clients = [self.client(route, worker) for worker in range(self.concurrency)]
+
+        async def run_clients():
+            return await asyncio.gather(*(
+                self.worker(client, route, worker, count) for worker, (client, count)
+                in enumerate(zip(clients, split(self.requests, self.concurrency)))))
+
+        started = time.perf_counter()
+        samples = [sample for result in asyncio.run(run_clients()) for sample in result]
+        return summarize(samples, time.perf_counter() - started)
+
+    def run(self, names=None):
+        results = {}
+        for label, storefront in self.STOREFRONTS:
+            self.log(f'{label} views:')
+            with override_settings(ROOT_URLCONF=StorefrontURLConf(storefront)):
+                results[label] = super().run(names)
+        return results
+
+
+def summarize(samples, elapsed):
+    latencies = sorted(latency for latency, _ in samples)
+    errors = sum(1 for _, status in samples if status >= 400)
+    return {
+        'requests': len(samples),
+        'errors': errors,
+        'rps': len(samples) / elapsed if elapsed else 0.0,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p95_ms': percentile(latencies, 0.95) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+    }
+
+
+def format_result(name, result):
+    return (f"{name:<22} {result['rps']:8.1f} req/s  p50 {result['p50_ms']:8.1f}ms  "
+            f"p95 {result['p95_ms']:8.1f}ms  p99 {result['p99_ms']:8.1f}ms  "
+            f"errors {result['errors']}/{result['requests']}")
+
+
+def format_speedup(name, sync, async_):
+    ratio = async_['rps'] / sync['rps'] if sync['rps'] else 0.0
+    return (f"{name:<22} {sync['rps']:8.1f} -> {async_['rps']:8.1f} req/s  ({ratio:.2f}x)  "
+            f"p95 {sync['p95_ms']:8.1f} -> {async_['p95_ms']:8.1f}ms")
+
+
+def compare(results, baseline, tolerance):
+    """
+    Routes whose p95 latency grew, or whose throughput fell, by more than
+    `tolerance` (a fraction) against the baseline. Returns a list of
+    (route, metric, baseline value, current value).
+    """
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        if result['p95_ms'] > before['p95_ms'] * (1 + tolerance):
+            regressions.append((name, 'p95_ms', before['p95_ms'], result['p95_ms']))
+        if result['rps'] < before['rps'] * (1 - tolerance):
+            regressions.append((name, 'rps', before['rps'], result['rps']))
+    return regressions
+
+
+def load_baseline(path):
+    with open(path) as baseline_file:
+        return json.load(baseline_file)['routes']
+
+
+def save_baseline(path, results, settings):
+    with open(path, 'w') as baseline_file:
+        json.dump({'settings': settings, 'routes': results}, baseline_file, indent=2, sort_keys=True)
@@ -0,0 +1,232 @@
+import pickle
+import re
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+from django.core.cache import caches
+from django.core.cache.backends.base import BaseCache, DEFAULT_TIMEOUT
+
+_MISSING = object()
+_TRAILING_ID = re.compile(r'[\d_]+$')
+
+
+class _ProcessState:
+    def __init__(self):
+        self.local = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = defaultdict(lambda: defaultdict(float))
+        self.stats_lock = threading.Lock()
+
+
+# Django builds a backend instance per thread; like LocMemCache, the local
+# tier and counters live here so every thread of the process shares them.
+_states = {}
+
+
+def key_prefix(key):
+    """
+    The metrics bucket of a key: its first two ':' separated parts with any
+    trailing id removed, e.g. 'fragment:home_card', 'vendor_analytics'.
+    """
+    return _TRAILING_ID.sub('', ':'.join(str(key).split(':')[:2])) or str(key)
+
+
+class TieredCache(BaseCache):
+    """
+    A bounded in-process LRU in front of a shared cache backend.
+
+    Reads are served from the local tier when possible and fall through to
+    the shared backend (the CACHES alias named by OPTIONS['SHARED']), whose
+    values are then kept locally for at most LOCAL_TIMEOUT seconds; that
+    timeout bounds how stale another process's write can look here. Writes
+    go to both tiers.
+
+    Hits per tier, misses and time spent per key prefix are counted in
+    stats().
+
+        CACHES = {
+            'default': {
+                'BACKEND': 'ecommerce.cache_backends.TieredCache',
+                'OPTIONS': {'SHARED': 'shared', 'LOCAL_MAX_ENTRIES': 2000,
+                            'LOCAL_TIMEOUT': 5},
+            },
+            'shared': {...},
+        }
+    """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self._shared_alias = options.get('SHARED', 'shared')
+        self._local_max_entries = int(options.get('LOCAL_MAX_ENTRIES', 1000))
+        self._local_timeout = float(options.get('LOCAL_TIMEOUT', 5))
+        state = _states.setdefault(location or self._shared_alias, _ProcessState())
+        self._local = state.local
+        self._lock = state.lock
+        self._stats = state.stats
+        self._stats_lock = state.stats_lock
+
+    @property
+    def shared(self):
+        return caches[self._shared_alias]
+
+    # Local tier
+
+    def _local_get(self, local_key):
+        with self._lock:
+            entry = self._local.get(local_key)
+            if entry is None:
+                return _MISSING
+            expires_at, data = entry
+            if expires_at <= time.monotonic():
+                del self._local[local_key]
+                return _MISSING
+            self._local.move_to_end(local_key)
+        # Unpickling hands every caller its own copy, as other backends do
+        return pickle.loads(data)
+
+    def _local_set(self, local_key, value, timeout):
+        ttl = self._local_timeout if timeout is None else min(timeout, self._local_timeout)
+        if ttl <= 0:
+            self._local_delete(local_key)
+            return
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._local[local_key] = (time.monotonic() + ttl, data)
+            self._local.move_to_end(local_key)
+            while len(self._local) > self._local_max_entries:
+                self._local.popitem(last=False)
+
+    def _local_delete(self, local_key):
+        with self._lock:
+            self._local.pop(local_key, None)
+
+    def _local_timeout_for(self, timeout):
+        # Seconds, or None for no expiry; _local_set caps it at LOCAL_TIMEOUT
+        return self.default_timeout if timeout is DEFAULT_TIMEOUT else timeout
+
+    # Metrics
+
+    def _record(self, key, outcome, elapsed):
+        prefix = key_prefix(key)
+        with self._stats_lock:
+            bucket = self._stats[prefix]
+            bucket[outcome] += 1
+            bucket['seconds'] += elapsed
+
+    def stats(self):
+        """
+        Counters per key prefix for this process: local_hits, shared_hits,
+        misses, hit_rate and the mean read latency in milliseconds.
+        """
+        report = {}
+        with self._stats_lock:
+            buckets = sorted((prefix, dict(bucket)) for prefix, bucket in self._stats.items())
+        for prefix, bucket in buckets:
+            counts = {name: int(bucket.get(name, 0)) for name in
+                      ('local_hits', 'shared_hits', 'misses')}
+            hits = counts['local_hits'] + counts['shared_hits']
+            reads = hits + counts['misses']
+            report[prefix] = {
+                **counts,
+                'hit_rate': hits / reads if reads else 0.0,
+                'mean_ms': bucket.get('seconds', 0) / reads * 1000 if reads else 0.0,
+            }
+        return report
+
+    def reset_stats(self):
+        with self._stats_lock:
+            self._stats.clear()
+
+    # Cache API
+
+    def get(self, key, default=None, version=None):
+        started = time.perf_counter()
+        local_key = self.make_and_validate_key(key, version=version)
+        value = self._local_get(local_key)
+        if value is not _MISSING:
+            self._record(key, 'local_hits', time.perf_counter() - started)
+            return value
+        value = self.shared.get(key, _MISSING, version=version)
+        if value is _MISSING:
+            self._record(key, 'misses', time.perf_counter() - started)
+            return default
+        self._local_set(local_key, value, self._local_timeout)
+        self._record(key, 'shared_hits', time.perf_counter() - started)
+        return value
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        local_key = self.make_and_validate_key(key, version=version)
+        self.shared.set(key, value, timeout=timeout, version=version)
+        self._local_set(local_key, value, self._local_timeout_for(timeout))
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        local_key = self.make_and_validate_key(key, version=version)
+        added = self.shared.add(key, value, timeout=timeout, version=version)
+        if added:
+            self._local_set(local_key, value, self._local_timeout_for(timeout))
+        else:
+            self._local_delete(local_key)
+        return added
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return self.shared.touch(key, timeout=timeout, version=version)
+
+    def delete(self, key, version=None):
+        self._local_delete(self.make_and_validate_key(key, version=version))
+        return self.shared.delete(key, version=version)
+
+    def has_key(self, key, version=None):
+        local_key = self.make_and_validate_key(key, version=version)
+        return self._local_get(local_key) is not _MISSING or self.shared.has_key(key, version=version)
+
+    def get_many(self, keys, version=None):
+        found, missing = {}, []
+        for key in keys:
+            started = time.perf_counter()
+            value = self._local_get(self.make_and_validate_key(key, version=version))
+            if value is _MISSING:
+                missing.append(key)
+            else:
+                found[key] = value
+                self._record(key, 'local_hits', time.perf_counter() - started)
+        if missing:
+            started = time.perf_counter()
+            shared = self.shared.get_many(missing, version=version)
+            elapsed = (time.perf_counter() - started) / len(missing)
+            for key in missing:
+                if key in shared:
+                    self._local_set(self.make_key(key, version=version), shared[key],
+                                    self._local_timeout)
+                    self._record(key, 'shared_hits', elapsed)
+                else:
+                    self._record(key, 'misses', elapsed)
+            found.update(shared)
+        return found
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        failed = self.shared.set_many(data, timeout=timeout, version=version)
+        local_timeout = self._local_timeout_for(timeout)
+        for key, value in data.items():
+            if key not in failed:
+                self._local_set(self.make_and_validate_key(key, version=version),
+                                value, local_timeout)
+        return failed
+
+    def delete_many(self, keys, version=None):
+        for key in keys:
+            self._local_delete(self.make_and_validate_key(key, version=version))
+        self.shared.delete_many(keys, version=version)
+
+    def incr(self, key, delta=1, version=None):
+        self._local_delete(self.make_and_validate_key(key, version=version))
+        return self.shared.incr(key, delta, version=version)
+
+    def clear(self):
+        with self._lock:
+            self._local.clear()
+        self.shared.clear()
+
+    def close(self, **kwargs):
+        self.shared.close(**kwargs)
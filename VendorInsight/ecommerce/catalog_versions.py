@@ -0,0 +1,43 @@
+import time
+
+from django.core.cache import cache
+
+PRODUCT_VERSION_KEY = 'catalog_version:product:{}'
+CATEGORY_VERSION_KEY = 'catalog_version:categories'
+
+# Versions outlive the fragments keyed on them; a lost version only means
+# the fragments are rendered once more.
+VERSION_TIMEOUT = None
+
+
+def _new_version():
+    return time.time_ns()
+
+
+def get_product_version(product_id):
+    key = PRODUCT_VERSION_KEY.format(product_id)
+    version = cache.get(key)
+    if version is None:
+        version = _new_version()
+        cache.add(key, version, timeout=VERSION_TIMEOUT)
+        version = cache.get(key, version)
+    return version
+
+
+def bump_product_versions(product_ids):
+    version = _new_version()
+    cache.set_many({PRODUCT_VERSION_KEY.format(product_id): version
+                    for product_id in product_ids}, timeout=VERSION_TIMEOUT)
+
+
+def get_category_version():
+    version = cache.get(CATEGORY_VERSION_KEY)
+    if version is None:
+        version = _new_version()
+        cache.add(CATEGORY_VERSION_KEY, version, timeout=VERSION_TIMEOUT)
+        version = cache.get(CATEGORY_VERSION_KEY, version)
+    return version
+
+
+def bump_category_version():
+    cache.set(CATEGORY_VERSION_KEY, _new_version(), timeout=VERSION_TIMEOUT)
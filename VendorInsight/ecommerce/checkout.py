@@ -0,0 +1,73 @@
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .customer_features import refresh_orders_on_commit
+from .models import Cart, CartItem, Inventory, Order, OrderDetails
+from .vendor_orders import link_vendor_orders
+
+
+class CheckoutError(Exception):
+    pass
+
+
+class OutOfStock(CheckoutError):
+    def __init__(self, products):
+        self.products = products
+        names = ', '.join(product.name for product in products)
+        super().__init__(f'Not enough stock for: {names}')
+
+
+def place_order(user):
+    """
+    Turns the user's cart into a Pending order in a single transaction.
+
+    Stock is taken with a conditional UPDATE (current_stock >= quantity), so
+    two checkouts racing for the last unit cannot both succeed; if any line
+    cannot be covered, nothing is written and OutOfStock is raised. Order
+    lines are inserted with one bulk_create and the cart is emptied. The
+    customer's features are refreshed once the order has committed.
+    """
+    with transaction.atomic():
+        # Locking the cart row serialises double-submits of the same cart
+        cart = Cart.objects.select_for_update().filter(user=user).first()
+        items = list(CartItem.objects.filter(cart=cart).select_related('product'))
+        if not items:
+            raise CheckoutError('Your cart is empty.')
+
+        # Several products may share an Inventory row, so take stock per row
+        needed = defaultdict(int)
+        products_by_inventory = defaultdict(list)
+        for item in items:
+            needed[item.product.inventory_id] += item.quantity
+            products_by_inventory[item.product.inventory_id].append(item.product)
+
+        short = []
+        # A fixed order keeps concurrent checkouts from deadlocking
+        for inventory_id in sorted(needed):
+            updated = Inventory.objects.filter(
+                pk=inventory_id, current_stock__gte=needed[inventory_id],
+            ).update(current_stock=F('current_stock') - needed[inventory_id])
+            if not updated:
+                short.extend(products_by_inventory[inventory_id])
+        if short:
+            # Leaving the atomic block with an exception undoes the rows
+            # already decremented
+            raise OutOfStock(short)
+
+        order = Order.objects.create(
+            user=user,
+            total_amount=sum(item.product.price * item.quantity for item in items),
+            order_date=timezone.now(),
+            status='Pending')
+        OrderDetails.objects.bulk_create([
+            OrderDetails(order=order, product=item.product,
+                         quantity=item.quantity, price=item.product.price)
+            for item in items
+        ])
+        link_vendor_orders([order.id])
+        refresh_orders_on_commit([order.id])
+        CartItem.objects.filter(cart=cart).delete()
+    return order
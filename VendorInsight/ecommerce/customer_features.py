@@ -0,0 +1,124 @@
+import threading
+
+from django.db import connection, transaction
+from django.db.models import OuterRef, Subquery
+from django.utils import timezone
+
+from .models import (Order, OrderDetails, Product, CustomerFeatures, CustomerCategoryCount,
+                     VendorOrder)
+
+# Orders in this status do not count towards a customer's features
+EXCLUDED_STATUS = 'Canceled'
+
+
+def _in(column, ids):
+    ids = list(ids)
+    return f"{column} IN ({', '.join(['%s'] * len(ids))})", ids
+
+
+def refresh(customer_ids=None, vendor_ids=None):
+    """
+    Recomputes CustomerFeatures and CustomerCategoryCount for the given
+    customers with the given vendors (every customer or vendor when None)
+    with one INSERT ... SELECT ... GROUP BY each, so no order row passes
+    through Python. Pairs left without orders lose their rows.
+    """
+    if (customer_ids is not None and not customer_ids) or (vendor_ids is not None and not vendor_ids):
+        return
+    qn = connection.ops.quote_name
+    features = CustomerFeatures.objects.all()
+    counts = CustomerCategoryCount.objects.all()
+    conditions, params = ['o.status <> %s'], [EXCLUDED_STATUS]
+    if customer_ids is not None:
+        features = features.filter(customer_id__in=customer_ids)
+        counts = counts.filter(customer_id__in=customer_ids)
+        condition, ids = _in('o.user_id', customer_ids)
+        conditions.append(condition)
+        params += ids
+    if vendor_ids is not None:
+        features = features.filter(vendor_id__in=vendor_ids)
+        counts = counts.filter(vendor_id__in=vendor_ids)
+        condition, ids = _in('p.user_id', vendor_ids)
+        conditions.append(condition)
+        params += ids
+    lines = f"""
+        FROM {qn(OrderDetails._meta.db_table)} d
+        JOIN {qn(Order._meta.db_table)} o ON o.id = d.order_id
+        JOIN {qn(Product._meta.db_table)} p ON p.id = d.product_id
+    """
+    where = ' AND '.join(conditions)
+    now = connection.ops.adapt_datetimefield_value(timezone.now())
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        features.delete()
+        counts.delete()
+        cursor.execute(f"""
+            INSERT INTO {qn(CustomerFeatures._meta.db_table)}
+                (vendor_id, customer_id, order_count, quantity, total_spent,
+                 first_order_date, last_order_date, updated_at)
+            SELECT p.user_id, o.user_id, COUNT(DISTINCT o.id), SUM(d.quantity),
+                   SUM(d.price * d.quantity), MIN(o.order_date), MAX(o.order_date), %s
+            {lines}
+            WHERE {where}
+            GROUP BY p.user_id, o.user_id
+        """, [now] + params)
+        cursor.execute(f"""
+            INSERT INTO {qn(CustomerCategoryCount._meta.db_table)}
+                (vendor_id, customer_id, category_id, line_count)
+            SELECT p.user_id, o.user_id, pc.category_id, COUNT(*)
+            {lines}
+            JOIN {qn(Product.categories.through._meta.db_table)} pc ON pc.product_id = p.id
+            WHERE {where}
+            GROUP BY p.user_id, o.user_id, pc.category_id
+        """, params)
+        # Ties go to the lowest category id, so rebuilds are deterministic
+        features.update(top_category=Subquery(
+            CustomerCategoryCount.objects.filter(
+                vendor=OuterRef('vendor'), customer=OuterRef('customer'),
+            ).order_by('-line_count', 'category_id').values('category_id')[:1]))
+
+
+def refresh_orders(order_ids):
+    """Refreshes every (vendor, customer) pair with a line in the given orders."""
+    pairs = set(VendorOrder.objects.filter(order_id__in=order_ids).values_list(
+        'vendor_id', 'order__user_id'))
+    if pairs:
+        refresh(customer_ids={customer for _, customer in pairs},
+                vendor_ids={vendor for vendor, _ in pairs})
+
+
+_batches = threading.local()
+
+
+def _on_commit_batched(name, ids, func):
+    """
+    Calls func(ids) once the current transaction commits (at once outside
+    one). Calls with the same `name` in one transaction share a single call
+    with the union of their ids, so deleting or saving many rows refreshes
+    once rather than once per row.
+    """
+    if not connection.in_atomic_block:
+        func(set(ids))
+        return
+    batch, callback = getattr(_batches, name, (None, None))
+    # A rolled-back transaction discards its callbacks; start a new batch then
+    if callback is None or not any(entry[1] is callback for entry in connection.run_on_commit):
+        batch = set()
+
+        def callback():
+            setattr(_batches, name, (None, None))
+            func(batch)
+
+        setattr(_batches, name, (batch, callback))
+        transaction.on_commit(callback)
+    batch.update(ids)
+
+
+def refresh_orders_on_commit(order_ids):
+    """refresh_orders() once the current transaction commits (at once outside one)."""
+    _on_commit_batched('orders', order_ids, refresh_orders)
+
+
+def refresh_customers_on_commit(customer_ids):
+    """refresh() of the given customers once the current transaction commits."""
+    _on_commit_batched('customers', customer_ids, lambda ids: refresh(customer_ids=ids))
@@ -0,0 +1,85 @@
+import numpy as np
+import pandas as pd
+from pmdarima import auto_arima
+from xgboost import XGBRegressor
+
+from .instrumentation import span
+from .models import Category
+from .order_facts import category_sales, product_sales
+
+
+@span('forecasting')
+def forecast_analytics(products):
+    """Category sales (ARIMA) and per-product stock (XGBoost) forecasts."""
+    # Sales prediction using ARIMA, from the exported order facts (see
+    # order_facts.py) when there are any
+    sales = category_sales()
+    sales_by_category = dict(tuple(sales.groupby('category_id')))
+    category_sales_predictions = {}
+
+    for category in Category.objects.all():
+        sales_data = sales_by_category.get(category.id)
+        if sales_data is None:
+            continue
+        sales_data = sales_data.assign(order_date=pd.to_datetime(sales_data['order_date']))
+        ts_data = sales_data.groupby(pd.Grouper(key='order_date', freq='D'))[
+            'sales'].sum()
+
+        ts_data_log = np.log(ts_data.astype(float) + 1)
+        model = auto_arima(ts_data_log, seasonal=True,
+                           m=12, suppress_warnings=True)
+
+        last_date = ts_data.index[-1]
+        future_dates_sales = pd.date_range(
+            start=last_date + pd.Timedelta(days=1), periods=30, freq='D')
+        future_predictions_sales = np.exp(
+            model.predict(n_periods=len(future_dates_sales)))
+
+        category_sales_predictions[category.name] = {
+            'dates': future_dates_sales.strftime('%Y-%m-%d').tolist(),
+            'predictions': future_predictions_sales.tolist()
+        }
+
+    # Inventory prediction using XGBoost
+    products = list(products.select_related('inventory'))
+    lines_by_product = dict(tuple(product_sales([product.id for product in products]).groupby(
+        'product_id')))
+    inventory_data = []
+    for product in products:
+        daily_sales = lines_by_product.get(product.id)
+        if daily_sales is None:
+            continue
+        daily_sales = daily_sales.assign(order_date=pd.to_datetime(daily_sales['order_date']))
+        daily_sales['day_of_week'] = daily_sales['order_date'].dt.dayofweek
+        daily_sales['month'] = daily_sales['order_date'].dt.month
+
+        X = daily_sales[['day_of_week', 'month']]
+        y = daily_sales['quantity']
+
+        xgb_model = XGBRegressor(objective='reg:squarederror',
+                                 n_estimators=100, learning_rate=0.1, random_state=42)
+        xgb_model.fit(X, y)
+
+        future_dates = pd.date_range(start=daily_sales['order_date'].max(
+        ) + pd.Timedelta(days=1), periods=7, freq='D')
+        future_data = pd.DataFrame({
+            'day_of_week': future_dates.dayofweek,
+            'month': future_dates.month
+        })
+        future_predictions = xgb_model.predict(future_data)
+        future_predictions = [
+            int(np.ceil(prediction)) + 1 for prediction in future_predictions]
+
+        inventory_data.append({
+            'product_id': product.id,
+            'product_name': product.name,
+            'current_stock': product.inventory.current_stock,
+            'safety_stock_level': product.inventory.safety_stock_level,
+            'reorder_point': product.inventory.reorder_point,
+            'future_predictions': future_predictions,
+        })
+
+    return {
+        'inventory_data': inventory_data,
+        'category_sales_predictions': category_sales_predictions,
+    }
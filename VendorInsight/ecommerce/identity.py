@@ -0,0 +1,35 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+
+from .models import UserProfile
+
+
+class ProfileBackend(ModelBackend):
+    """
+    ModelBackend that loads the session's user together with its profile in
+    one query. request.user keeps it for the rest of the request, so the
+    navbar, vendor_required and the profile page read the profile without
+    querying again.
+    """
+
+    def get_user(self, user_id):
+        UserModel = get_user_model()
+        try:
+            user = UserModel._default_manager.select_related('userprofile').get(pk=user_id)
+        except UserModel.DoesNotExist:
+            return None
+        return user if self.user_can_authenticate(user) else None
+
+
+def is_vendor(user):
+    """
+    Whether `user` has a vendor profile. request.user comes with its
+    profile loaded (see ProfileBackend); any other instance loads it with
+    one query and keeps it.
+    """
+    if not user.is_authenticated:
+        return False
+    try:
+        return user.userprofile.is_vendor
+    except UserProfile.DoesNotExist:
+        return False
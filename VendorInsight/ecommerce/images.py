@@ -0,0 +1,98 @@
+import hashlib
+import logging
+import posixpath
+from io import BytesIO
+
+from PIL import Image, ImageOps
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.views.static import serve
+
+logger = logging.getLogger(__name__)
+
+# Bounding box (px) of each derivative; images are never upscaled
+DERIVATIVE_SIZES = {
+    'card': 400,
+    'detail': 1200,
+}
+DERIVATIVE_DIR = 'product_images/derivatives/'
+
+# Derivative names embed a hash of their content, so a URL never changes
+# meaning and browsers may keep it for a year without revalidating.
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+def _encode(image, fmt):
+    buffer = BytesIO()
+    if fmt == 'WEBP':
+        image.save(buffer, 'WEBP', quality=80, method=4)
+    elif fmt == 'PNG':
+        image.save(buffer, 'PNG', optimize=True)
+    else:
+        image.convert('RGB').save(buffer, 'JPEG', quality=85,
+                                  optimize=True, progressive=True)
+    return buffer.getvalue()
+
+
+def _save_hashed(stem, label, ext, data):
+    digest = hashlib.sha256(data).hexdigest()[:12]
+    name = f'{DERIVATIVE_DIR}{stem}.{label}.{digest}.{ext}'
+    # Same content, same name: an existing file is already correct
+    if not default_storage.exists(name):
+        default_storage.save(name, ContentFile(data))
+    return name
+
+
+def build_derivatives(product_image):
+    """
+    Render every size in DERIVATIVE_SIZES as WebP plus a fallback (PNG for
+    images with transparency, JPEG otherwise) and return a mapping like
+    {'card': {'width': 400, 'webp': <name>, 'fallback': <name>}, ...}.
+    """
+    with product_image.image.open('rb') as source:
+        original = Image.open(source)
+        original.load()
+    original = ImageOps.exif_transpose(original)
+    has_alpha = original.mode in ('RGBA', 'LA') or 'transparency' in original.info
+    fallback_format, fallback_ext = ('PNG', 'png') if has_alpha else ('JPEG', 'jpg')
+    stem = posixpath.splitext(posixpath.basename(product_image.image.name))[0]
+
+    derivatives = {}
+    for label, size in DERIVATIVE_SIZES.items():
+        resized = original.copy()
+        resized.thumbnail((size, size), Image.LANCZOS)
+        if resized.mode not in ('RGB', 'RGBA'):
+            resized = resized.convert('RGBA' if has_alpha else 'RGB')
+        derivatives[label] = {
+            'width': resized.width,
+            'webp': _save_hashed(stem, label, 'webp', _encode(resized, 'WEBP')),
+            'fallback': _save_hashed(stem, label, fallback_ext,
+                                     _encode(resized, fallback_format)),
+        }
+    return derivatives
+
+
+def generate_derivatives(product_image):
+    """
+    Build and store derivatives for a ProductImage. Failures are logged and
+    leave the image without derivatives; templates then use the original.
+    """
+    from .models import ProductImage
+
+    try:
+        derivatives = build_derivatives(product_image)
+    except Exception:
+        logger.exception('Could not build derivatives for %s',
+                         product_image.image.name)
+        return False
+    product_image.derivatives = derivatives
+    # update() keeps this out of the post_save handler that called us
+    ProductImage.objects.filter(pk=product_image.pk).update(
+        derivatives=derivatives)
+    return True
+
+
+def serve_derivative(request, path, document_root=None):
+    response = serve(request, path, document_root=document_root)
+    response['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    return response
@@ -0,0 +1,805 @@
+import csv
+import hashlib
+import io
+import multiprocessing
+import os
+import time
+from datetime import timedelta, date, datetime
+from decimal import Decimal
+from itertools import islice
+
+from django.contrib.auth.hashers import make_password
+from django.core.files import File
+from django.db import connection, connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .catalog_versions import bump_category_version
+from .models import (User, UserProfile, Product, Inventory, Discount, Category, ProductImage,
+                     Order, OrderDetails, VendorOrder, ImportChunk, ImportedRow)
+
+VENDOR_USERNAME = 'nishant'
+CUSTOMER_PASSWORD = 'password'
+PLACEHOLDER_IMAGE = 'test.png'
+CENT = Decimal('0.01')
+
+# A delta import identifies rows by ROW_KEY_COLUMN and detects changes from
+# the columns an order and its line are built from
+ROW_KEY_COLUMN = 'Row ID'
+FINGERPRINT_COLUMNS = ('Order ID', 'Order Date', 'Customer ID', 'Product Name', 'Sub-Category',
+                       'Sales', 'Quantity', 'Average Price')
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def fingerprint(row):
+    raw = '\x1f'.join(row[column] for column in FINGERPRINT_COLUMNS)
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def read_rows(path):
+    with open(path, 'r', newline='') as file:
+        yield from csv.DictReader(file)
+
+
+class ScanResult:
+    """Everything the load pass needs that is not per-order."""
+
+    def __init__(self):
+        self.rows = 0
+        self.max_order_date = None
+        self.customers = {}
+        self.categories = set()
+        self.products = {}
+        self.product_views = {}
+        self.product_categories = set()
+
+
+class BulkImporter:
+    """
+    Two-pass loader for the order export (Testing.csv layout).
+
+    The scan pass reads the file once and builds dedupe maps for customers,
+    categories and products. The load pass then creates each kind of row
+    with bulk_create in batches, looking up existing rows once per batch
+    rather than once per CSV row, and streams the orders and their lines.
+    All imported customers share one precomputed password hash, so no
+    PBKDF2 work is done per user.
+    """
+
+    # Lock existing products (in id order) before adding to their views, so
+    # concurrent importers cannot deadlock on each other's updates
+    lock_products = False
+
+    def __init__(self, path, batch_size=5000, stdout=None, password_hash=None):
+        self.path = path
+        self.batch_size = batch_size
+        self.stdout = stdout
+        self.password_hash = password_hash or make_password(CUSTOMER_PASSWORD)
+        self._placeholder = None
+
+    def log(self, message):
+        if self.stdout is not None:
+            self.stdout.write(message)
+
+    # Scan
+
+    def scan(self, rows=None):
+        scan = ScanResult()
+        for row in rows if rows is not None else read_rows(self.path):
+            scan.rows += 1
+            order_date = datetime.strptime(row['Order Date'], '%Y-%m-%d')
+            if scan.max_order_date is None or order_date > scan.max_order_date:
+                scan.max_order_date = order_date
+            scan.customers.setdefault(row['Customer ID'], row)
+            scan.categories.add(row['Sub-Category'])
+            scan.products.setdefault(row['Product Name'], row)
+            scan.product_views[row['Product Name']] = scan.product_views.get(
+                row['Product Name'], 0) + int(float(row['Quantity']))
+            scan.product_categories.add((row['Product Name'], row['Sub-Category']))
+        return scan
+
+    # Reference data
+
+    def ensure_vendor(self):
+        vendor_user, created = User.objects.get_or_create(
+            username=VENDOR_USERNAME,
+            defaults={
+                'email': 'nishant@example.com',
+                'first_name': 'Nishant',
+                'last_name': 'Vendor',
+                'phone_number': '1234567890',
+                'address': 'Vendor City, Vendor State, Vendor Country',
+                'date_joined': timezone.now() - timedelta(days=1500)
+            }
+        )
+        if created:
+            vendor_user.set_password('nishant')
+            vendor_user.save()
+
+        UserProfile.objects.get_or_create(
+            user=vendor_user,
+            defaults={
+                'is_vendor': True,
+                'gender': 'M',
+                'date_of_birth': '1990-01-01'
+            }
+        )
+        return vendor_user
+
+    def load_customers(self, customers):
+        """Creates missing customers and profiles; returns {Customer ID: user id}."""
+        user_ids = {}
+        for batch in batched(customers.items(), self.batch_size):
+            usernames = [customer_id for customer_id, _ in batch]
+            existing = dict(User.objects.filter(
+                username__in=usernames).values_list('username', 'id'))
+            joined = timezone.now() - timedelta(days=1500)
+            new_users = []
+            for customer_id, row in batch:
+                if customer_id in existing:
+                    continue
+                name = row['Customer Name'].split()
+                new_users.append(User(
+                    username=customer_id,
+                    password=self.password_hash,
+                    email=f"{customer_id}@example.com",
+                    first_name=name[0],
+                    last_name=name[1] if len(name) > 1 else '',
+                    phone_number='1234567890',
+                    address=f"{row['City']}, {row['State']}, {row['Country']}",
+                    date_joined=joined,
+                ))
+            User.objects.bulk_create(new_users, batch_size=self.batch_size)
+            user_ids.update(existing)
+            user_ids.update(User.objects.filter(
+                username__in=[user.username for user in new_users]).values_list('username', 'id'))
+
+            profiled = set(UserProfile.objects.filter(
+                user_id__in=[user_ids[u] for u in usernames]).values_list('user_id', flat=True))
+            profiles = []
+            for customer_id, row in batch:
+                if user_ids[customer_id] in profiled:
+                    continue
+                age = int(float(row['corrected_age']))
+                profiles.append(UserProfile(
+                    user_id=user_ids[customer_id],
+                    is_vendor=False,
+                    gender=row['corrected_gender'][0],
+                    date_of_birth=date(date.today().year - age, 1, 1),
+                ))
+            UserProfile.objects.bulk_create(profiles, batch_size=self.batch_size)
+        return user_ids
+
+    def load_categories(self, names):
+        existing = {}
+        for name, category_id in Category.objects.filter(
+                name__in=names).order_by('-id').values_list('name', 'id'):
+            existing[name] = category_id
+        missing = [Category(name=name, description=f"This is the {name} category.")
+                   for name in sorted(names) if name not in existing]
+        if missing:
+            Category.objects.bulk_create(missing, batch_size=self.batch_size)
+            bump_category_version()
+            existing.update(Category.objects.filter(
+                name__in=[c.name for c in missing]).values_list('name', 'id'))
+        return existing
+
+    def load_products(self, scan, vendor, category_ids):
+        """
+        Creates missing products (each with its own inventory and discount),
+        adds the imported quantities to the views of existing ones, links
+        categories and gives image-less products the placeholder image.
+        Returns {product name: product id}.
+        """
+        product_ids = {}
+        now = timezone.now()
+        for batch in batched(scan.products.items(), self.batch_size):
+            names = [name for name, _ in batch]
+            existing = {}
+            for name, product_id in Product.objects.filter(
+                    name__in=names).order_by('-id').values_list('name', 'id'):
+                existing[name] = product_id
+
+            new_rows = [(name, row) for name, row in batch if name not in existing]
+            inventories = Inventory.objects.bulk_create([
+                Inventory(current_stock=int(float(row['corrected_stock'])),
+                          safety_stock_level=int(float(row['corrected_stock']) * 0.2),
+                          reorder_point=int(float(row['corrected_stock']) * 0.1))
+                for _, row in new_rows])
+            discounts = Discount.objects.bulk_create([
+                Discount(discount_type=Discount.DiscountType.FIXED, discount_value=10,
+                         start_date=now, end_date=now + timedelta(days=1))
+                for _ in new_rows])
+            products = Product.objects.bulk_create([
+                Product(name=name,
+                        description=f"This is the description for {name} of {row['Sub-Category']} category.",
+                        price=float(row['Average Price']),
+                        user=vendor, inventory=inventory, discount=discount,
+                        total_views=scan.product_views[name])
+                for (name, row), inventory, discount in zip(new_rows, inventories, discounts)])
+            product_ids.update(existing)
+            product_ids.update((product.name, product.id) for product in products)
+
+            # Existing products: one UPDATE per distinct view increment
+            by_increment = {}
+            for name in existing:
+                by_increment.setdefault(scan.product_views[name], []).append(existing[name])
+            if self.lock_products and existing:
+                list(Product.objects.select_for_update().filter(
+                    id__in=existing.values()).order_by('id').values_list('id', flat=True))
+            for views, ids in by_increment.items():
+                Product.objects.filter(id__in=ids).update(total_views=F('total_views') + views)
+
+        Through = Product.categories.through
+        Through.objects.bulk_create([
+            Through(product_id=product_ids[name], category_id=category_ids[category])
+            for name, category in scan.product_categories
+        ], batch_size=self.batch_size, ignore_conflicts=True)
+
+        self.attach_placeholder_images(product_ids.values())
+        return product_ids
+
+    def attach_placeholder_images(self, product_ids):
+        with_images = set(ProductImage.objects.filter(
+            product_id__in=product_ids).values_list('product_id', flat=True))
+        missing = [product_id for product_id in product_ids if product_id not in with_images]
+        if not missing:
+            return
+        # Store the placeholder once (this also builds its derivatives) and
+        # point every other product at the same file.
+        if self._placeholder is None:
+            with open(PLACEHOLDER_IMAGE, 'rb') as image_file:
+                first = ProductImage.objects.create(
+                    image=File(image_file, name=PLACEHOLDER_IMAGE), description='test',
+                    product_id=missing.pop(0))
+            self._placeholder = (first.image.name, first.derivatives)
+        name, derivatives = self._placeholder
+        ProductImage.objects.bulk_create([
+            ProductImage(image=name, description='test', product_id=product_id,
+                         derivatives=derivatives)
+            for product_id in missing
+        ], batch_size=self.batch_size)
+
+    # Orders
+
+    def build_order(self, row, user_ids, time_diff):
+        return Order(
+            order_date=timezone.make_aware(
+                datetime.strptime(row['Order Date'], '%Y-%m-%d') + time_diff),
+            total_amount=float(row['Sales']),
+            status='Completed',
+            user_id=user_ids[row['Customer ID']],
+        )
+
+    def build_line(self, row, order, product_ids):
+        return OrderDetails(
+            quantity=int(float(row['Quantity'])),
+            price=float(row['Average Price']),
+            order=order,
+            product_id=product_ids[row['Product Name']],
+        )
+
+    def load_orders(self, rows, vendor, user_ids, product_ids, time_diff):
+        """Creates one order and one line per CSV row; returns the row count."""
+        count = 0
+        for batch in batched(rows, self.batch_size):
+            with transaction.atomic():
+                orders = Order.objects.bulk_create(
+                    [self.build_order(row, user_ids, time_diff) for row in batch])
+                OrderDetails.objects.bulk_create([
+                    self.build_line(row, order, product_ids)
+                    for row, order in zip(batch, orders)])
+                # Every imported product belongs to the one vendor
+                VendorOrder.objects.bulk_create([
+                    VendorOrder(vendor=vendor, order=order, status=order.status,
+                                order_date=order.order_date, total_amount=order.total_amount)
+                    for order in orders], ignore_conflicts=True)
+            count += len(batch)
+        return count
+
+    def run(self):
+        started = time.perf_counter()
+        scan = self.scan()
+        if not scan.rows:
+            return 0
+        # Shift the export so its newest order lands on today
+        time_diff = datetime.now().date() - scan.max_order_date.date()
+        self.log(f'Scanned {scan.rows} rows: {len(scan.customers)} customers, '
+                 f'{len(scan.products)} products, {len(scan.categories)} categories.')
+
+        with transaction.atomic():
+            vendor = self.ensure_vendor()
+            user_ids = self.load_customers(scan.customers)
+            category_ids = self.load_categories(scan.categories)
+            product_ids = self.load_products(scan, vendor, category_ids)
+
+        count = self.load_orders(read_rows(self.path), vendor, user_ids, product_ids, time_diff)
+        elapsed = time.perf_counter() - started
+        self.log(f'Loaded {count} orders in {elapsed:.1f}s '
+                 f'({count / elapsed if elapsed else count:.0f} rows/sec).')
+        return count
+
+
+class CopyOrdersMixin:
+    """
+    Loads orders and their lines through PostgreSQL COPY.
+
+    Each batch is streamed into a temporary staging table whose order_id
+    column defaults to the Order id sequence, then merged with set-based
+    INSERT ... SELECT statements (ON CONFLICT DO NOTHING for the vendor-order
+    links). On other databases load_orders falls back to bulk_create.
+    """
+
+    def copy_supported(self):
+        return connection.vendor == 'postgresql'
+
+    def load_orders(self, rows, vendor, user_ids, product_ids, time_diff):
+        if not self.copy_supported():
+            return super().load_orders(rows, vendor, user_ids, product_ids, time_diff)
+        count = 0
+        for batch in batched(rows, self.batch_size):
+            with transaction.atomic():
+                self.copy_batch(batch, vendor, user_ids, product_ids, time_diff)
+            count += len(batch)
+        return count
+
+    def copy_batch(self, batch, vendor, user_ids, product_ids, time_diff):
+        qn = connection.ops.quote_name
+        order_table = qn(Order._meta.db_table)
+        line_table = qn(OrderDetails._meta.db_table)
+        link_table = qn(VendorOrder._meta.db_table)
+
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row_no, row in enumerate(batch):
+            order = self.build_order(row, user_ids, time_diff)
+            line = self.build_line(row, order, product_ids)
+            writer.writerow([row_no, order.order_date.isoformat(), order.total_amount,
+                             order.status, order.user_id, line.product_id,
+                             line.quantity, line.price])
+        buffer.seek(0)
+
+        with connection.cursor() as cursor:
+            cursor.execute(f"""
+                CREATE TEMP TABLE import_order_stage (
+                    row_no integer,
+                    order_date timestamptz,
+                    total_amount numeric(10, 2),
+                    status varchar(50),
+                    user_id bigint,
+                    product_id bigint,
+                    quantity integer,
+                    price numeric(10, 2),
+                    order_id bigint DEFAULT nextval(pg_get_serial_sequence('{Order._meta.db_table}', 'id'))
+                )""")
+            columns = 'row_no, order_date, total_amount, status, user_id, product_id, quantity, price'
+            copy_sql = f'COPY import_order_stage ({columns}) FROM STDIN WITH (FORMAT csv)'
+            if hasattr(cursor.cursor, 'copy_expert'):
+                # psycopg2
+                cursor.cursor.copy_expert(copy_sql, buffer)
+            else:
+                # psycopg 3
+                with cursor.cursor.copy(copy_sql) as copy:
+                    copy.write(buffer.getvalue())
+
+            cursor.execute(f"""
+                INSERT INTO {order_table} (id, order_date, total_amount, status, user_id)
+                SELECT order_id, order_date, total_amount, status, user_id
+                FROM import_order_stage ORDER BY row_no
+                ON CONFLICT (id) DO NOTHING""")
+            cursor.execute(f"""
+                INSERT INTO {line_table} (quantity, price, order_id, product_id)
+                SELECT quantity, price, order_id, product_id
+                FROM import_order_stage ORDER BY row_no""")
+            # Every imported product belongs to the one vendor
+            cursor.execute(f"""
+                INSERT INTO {link_table} (vendor_id, order_id, status, order_date, total_amount)
+                SELECT %s, order_id, status, order_date, total_amount
+                FROM import_order_stage
+                ON CONFLICT (vendor_id, order_id) DO NOTHING""", [vendor.pk])
+            cursor.execute('DROP TABLE import_order_stage')
+
+
+class CopyImporter(CopyOrdersMixin, BulkImporter):
+    pass
+
+
+def benchmark_order_loading(importer_classes, path, sample_size, batch_size, stdout):
+    """
+    Times loading the first `sample_size` rows with each importer class and
+    rolls every run back. Reference rows are created first (and rolled back
+    too) so only the order/line loading is measured.
+    """
+    rows = list(islice(read_rows(path), sample_size))
+    if not rows:
+        return {}
+    results = {}
+    for label, importer_class in importer_classes.items():
+        importer = importer_class(path, batch_size=batch_size)
+        try:
+            with transaction.atomic():
+                scan = importer.scan(rows)
+                vendor = importer.ensure_vendor()
+                user_ids = importer.load_customers(scan.customers)
+                category_ids = importer.load_categories(scan.categories)
+                product_ids = importer.load_products(scan, vendor, category_ids)
+                time_diff = datetime.now().date() - scan.max_order_date.date()
+                started = time.perf_counter()
+                importer.load_orders(rows, vendor, user_ids, product_ids, time_diff)
+                results[label] = time.perf_counter() - started
+                raise _Rollback
+        except _Rollback:
+            pass
+    for label, elapsed in results.items():
+        stdout.write(f'  {label:<12} {len(rows)} rows in {elapsed:.2f}s '
+                     f'({len(rows) / elapsed if elapsed else len(rows):.0f} rows/sec)')
+    return results
+
+
+class _Rollback(Exception):
+    pass
+
+
+class AlreadyImported(Exception):
+    """The file's rows are already in the database, outside the delta import's ledger."""
+
+
+class DeltaImporter(BulkImporter):
+    """
+    Idempotent variant of the bulk loader for refreshing from updated exports.
+
+    Every loaded row is recorded in the ImportedRow ledger with the order it
+    became and a fingerprint of its source columns. A re-import skips rows
+    whose fingerprint is unchanged, updates the order, line and vendor-order
+    link of changed rows in place (moving their quantity between product
+    views) and inserts only new rows, so product views are never counted
+    twice. The whole delta is applied in one transaction.
+    """
+
+    def __init__(self, path, ledger='orders', **kwargs):
+        super().__init__(path, **kwargs)
+        self.ledger = ledger
+
+    def classify(self):
+        """
+        Splits the file against the ledger. Returns (new, changed, skipped,
+        time_diff) where new holds (row, ledger entry id or None) pairs,
+        changed holds (row, ledger entry id, order id) triples, skipped is a
+        count and time_diff is the shift to apply to the file's order dates.
+        """
+        new, changed, skipped = [], [], 0
+        max_order_date, anchor = None, None
+        for batch in batched(read_rows(self.path), self.batch_size):
+            entries = {
+                row_key: (entry_id, digest, order_id)
+                for entry_id, row_key, digest, order_id in ImportedRow.objects.filter(
+                    ledger=self.ledger, row_key__in=[row[ROW_KEY_COLUMN] for row in batch]
+                ).values_list('id', 'row_key', 'fingerprint', 'order_id')
+            }
+            for row in batch:
+                order_date = datetime.strptime(row['Order Date'], '%Y-%m-%d')
+                if max_order_date is None or order_date > max_order_date:
+                    max_order_date = order_date
+                entry = entries.get(row[ROW_KEY_COLUMN])
+                if entry is None:
+                    new.append((row, None))
+                elif entry[1] == fingerprint(row):
+                    skipped += 1
+                    if anchor is None and entry[2] is not None:
+                        anchor = (order_date, entry[2])
+                elif entry[2] is None:
+                    # Changed, but its order was deleted: load it afresh
+                    new.append((row, entry[0]))
+                else:
+                    changed.append((row, entry[0], entry[2]))
+        return new, changed, skipped, self.date_shift(anchor, max_order_date)
+
+    def date_shift(self, anchor, max_order_date):
+        """
+        The shift the ledger's rows were loaded with, read back from the
+        order of an unchanged row (`anchor`, its source date and order id),
+        so rows loaded today line up with rows loaded earlier. A new ledger
+        shifts the newest order of the whole file onto today.
+        """
+        if anchor is not None:
+            source_date, order_id = anchor
+            order_date = Order.objects.filter(pk=order_id).values_list(
+                'order_date', flat=True).first()
+            if order_date is not None:
+                return timezone.localtime(order_date).date() - source_date.date()
+        if max_order_date is None:
+            return timedelta(0)
+        return datetime.now().date() - max_order_date.date()
+
+    def loaded_without_ledger(self, sample_size=100):
+        """
+        How many of the file's first `sample_size` rows already exist as
+        orders (same customer, product, quantity and amount), as they do
+        after a plain import, which keeps no ledger.
+        """
+        rows = list(islice(read_rows(self.path), sample_size))
+        wanted = {(row['Customer ID'], row['Product Name'], int(float(row['Quantity'])),
+                   Decimal(row['Sales']).quantize(CENT)) for row in rows}
+        found = set(OrderDetails.objects.filter(
+            order__user__username__in={key[0] for key in wanted},
+            product__name__in={key[1] for key in wanted},
+        ).values_list('order__user__username', 'product__name', 'quantity',
+                      'order__total_amount'))
+        return len(wanted & found)
+
+    def take_back_views(self, lines):
+        """Removes the quantities of the lines about to be replaced from product views."""
+        by_product = {}
+        for line in lines:
+            by_product[line.product_id] = by_product.get(line.product_id, 0) + line.quantity
+        by_decrement = {}
+        for product_id, quantity in by_product.items():
+            by_decrement.setdefault(quantity, []).append(product_id)
+        for quantity, ids in by_decrement.items():
+            Product.objects.filter(id__in=ids).update(total_views=F('total_views') - quantity)
+
+    def insert_rows(self, new, vendor, user_ids, product_ids, time_diff):
+        now = timezone.now()
+        for batch in batched(new, self.batch_size):
+            orders = Order.objects.bulk_create(
+                [self.build_order(row, user_ids, time_diff) for row, _ in batch])
+            OrderDetails.objects.bulk_create([
+                self.build_line(row, order, product_ids)
+                for (row, _), order in zip(batch, orders)])
+            VendorOrder.objects.bulk_create([
+                VendorOrder(vendor=vendor, order=order, status=order.status,
+                            order_date=order.order_date, total_amount=order.total_amount)
+                for order in orders], ignore_conflicts=True)
+            ImportedRow.objects.bulk_create([
+                ImportedRow(ledger=self.ledger, row_key=row[ROW_KEY_COLUMN],
+                            fingerprint=fingerprint(row), order=order, imported_at=now)
+                for (row, entry_id), order in zip(batch, orders) if entry_id is None])
+            ImportedRow.objects.bulk_update([
+                ImportedRow(id=entry_id, fingerprint=fingerprint(row), order=order, imported_at=now)
+                for (row, entry_id), order in zip(batch, orders) if entry_id is not None
+            ], ['fingerprint', 'order', 'imported_at'])
+
+    def update_rows(self, changed, lines, user_ids, product_ids, time_diff):
+        now = timezone.now()
+        for batch in batched(changed, self.batch_size):
+            orders, details, entries = [], [], []
+            for row, entry_id, order_id in batch:
+                # Keep whatever status the order has moved to since
+                order = self.build_order(row, user_ids, time_diff)
+                order.id = order_id
+                orders.append(order)
+                line = self.build_line(row, order, product_ids)
+                line.id = lines[order_id].id
+                details.append(line)
+                entries.append(ImportedRow(id=entry_id, fingerprint=fingerprint(row),
+                                           imported_at=now))
+            Order.objects.bulk_update(orders, ['order_date', 'total_amount', 'user'])
+            OrderDetails.objects.bulk_update(details, ['quantity', 'price', 'product'])
+            by_order = {order.id: order for order in orders}
+            links = list(VendorOrder.objects.filter(order_id__in=by_order))
+            for link in links:
+                link.order_date = by_order[link.order_id].order_date
+                link.total_amount = by_order[link.order_id].total_amount
+            VendorOrder.objects.bulk_update(links, ['order_date', 'total_amount'])
+            ImportedRow.objects.bulk_update(entries, ['fingerprint', 'imported_at'])
+
+    def run(self):
+        started = time.perf_counter()
+        if not ImportedRow.objects.filter(ledger=self.ledger).exists():
+            loaded = self.loaded_without_ledger()
+            if loaded:
+                raise AlreadyImported(
+                    f'Ledger "{self.ledger}" is empty, but {loaded} of the first rows of '
+                    f'{self.path} are already orders. They were loaded by a plain import, '
+                    f'which keeps no ledger, so a delta import would add them again.')
+        new, changed, skipped, time_diff = self.classify()
+        if new or changed:
+            rows = [row for row, _ in new] + [row for row, _, _ in changed]
+            scan = self.scan(rows)
+            with transaction.atomic():
+                # Imported orders have a single line each
+                lines = {line.order_id: line for line in OrderDetails.objects.filter(
+                    order_id__in=[order_id for _, _, order_id in changed])}
+                self.take_back_views(lines.values())
+                vendor = self.ensure_vendor()
+                user_ids = self.load_customers(scan.customers)
+                category_ids = self.load_categories(scan.categories)
+                product_ids = self.load_products(scan, vendor, category_ids)
+                self.insert_rows(new, vendor, user_ids, product_ids, time_diff)
+                self.update_rows(changed, lines, user_ids, product_ids, time_diff)
+
+        elapsed = time.perf_counter() - started
+        self.log(f'Delta import into ledger "{self.ledger}": {len(new)} inserted, '
+                 f'{len(changed)} updated, {skipped} skipped in {elapsed:.1f}s.')
+        return len(new), len(changed), skipped
+
+
+class Chunk:
+    def __init__(self, index, byte_start, byte_end, rows):
+        self.index = index
+        self.byte_start = byte_start
+        self.byte_end = byte_end
+        self.rows = rows
+
+
+def plan_chunks(path, chunk_size):
+    """
+    Splits the file into chunks of `chunk_size` records by byte offset, and
+    finds the newest order date, in one pass with constant memory. Records
+    may span lines inside quoted fields, so a chunk only ends on a line where
+    the quotes balance.
+    """
+    chunks = []
+    max_order_date = None
+    with open(path, 'rb') as file:
+        header = file.readline()
+        fieldnames = next(csv.reader([header.decode()]))
+        date_column = fieldnames.index('Order Date')
+        offset = start = len(header)
+        rows, record, in_quotes = 0, [], False
+        for line in file:
+            offset += len(line)
+            record.append(line)
+            if line.count(b'"') % 2:
+                in_quotes = not in_quotes
+            if in_quotes:
+                continue
+            values = next(csv.reader([b''.join(record).decode()]), None)
+            record = []
+            if not values:
+                continue
+            order_date = values[date_column]
+            if max_order_date is None or order_date > max_order_date:
+                max_order_date = order_date
+            rows += 1
+            if rows == chunk_size:
+                chunks.append(Chunk(len(chunks), start, offset, rows))
+                start, rows = offset, 0
+        if rows:
+            chunks.append(Chunk(len(chunks), start, offset, rows))
+    # ISO dates compare correctly as strings
+    if max_order_date is not None:
+        max_order_date = datetime.strptime(max_order_date, '%Y-%m-%d')
+    return fieldnames, chunks, max_order_date
+
+
+def read_chunk(path, fieldnames, chunk):
+    with open(path, 'rb') as file:
+        file.seek(chunk.byte_start)
+        data = file.read(chunk.byte_end - chunk.byte_start)
+    return list(csv.DictReader(io.StringIO(data.decode(), newline=''), fieldnames=fieldnames))
+
+
+def source_key(path, chunk_size):
+    """Identifies a file version and chunking, so checkpoints never apply to another."""
+    stat = os.stat(path)
+    raw = f'{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}:{chunk_size}'
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+class StreamingImporter(BulkImporter):
+    """
+    Chunked, resumable variant of the bulk loader.
+
+    The file is cut into fixed-size chunks by byte offset; each chunk is read
+    on its own and loaded (customers, categories, products, orders, lines
+    and the ImportChunk checkpoint) in a single transaction, so memory is
+    bounded by the chunk size and a crash loses at most the chunk in flight.
+    Re-running the same file resumes after the last committed chunks.
+
+    With workers > 1 a serial pass first creates the reference rows
+    (customers, categories, products) so that the chunks, which then only
+    insert orders and add to existing product views, can be loaded in any
+    order by a process pool.
+    """
+
+    lock_products = True
+
+    def __init__(self, path, chunk_size=50000, workers=1, **kwargs):
+        super().__init__(path, **kwargs)
+        self.chunk_size = chunk_size
+        self.workers = workers
+
+    def reference_scan(self, rows):
+        # Views are added by the chunk loads; the reference pass must not count them
+        scan = self.scan(rows)
+        scan.product_views = dict.fromkeys(scan.product_views, 0)
+        return scan
+
+    def load_chunk(self, source, fieldnames, chunk, time_diff):
+        rows = read_chunk(self.path, fieldnames, chunk)
+        scan = self.scan(rows)
+        with transaction.atomic():
+            if ImportChunk.objects.filter(source=source, chunk_index=chunk.index).exists():
+                return 0
+            vendor = self.ensure_vendor()
+            user_ids = self.load_customers(scan.customers)
+            category_ids = self.load_categories(scan.categories)
+            product_ids = self.load_products(scan, vendor, category_ids)
+            self.load_orders(rows, vendor, user_ids, product_ids, time_diff)
+            ImportChunk.objects.create(
+                source=source, chunk_index=chunk.index, byte_start=chunk.byte_start,
+                byte_end=chunk.byte_end, rows=chunk.rows)
+        return chunk.rows
+
+    def load_references(self, fieldnames, chunks):
+        for chunk in chunks:
+            scan = self.reference_scan(read_chunk(self.path, fieldnames, chunk))
+            with transaction.atomic():
+                vendor = self.ensure_vendor()
+                self.load_customers(scan.customers)
+                category_ids = self.load_categories(scan.categories)
+                self.load_products(scan, vendor, category_ids)
+
+    def run(self, restart=False):
+        started = time.perf_counter()
+        fieldnames, chunks, max_order_date = plan_chunks(self.path, self.chunk_size)
+        if not chunks:
+            return 0
+        time_diff = datetime.now().date() - max_order_date.date()
+        source = source_key(self.path, self.chunk_size)
+        if restart:
+            ImportChunk.objects.filter(source=source).delete()
+
+        done = set(ImportChunk.objects.filter(source=source).values_list('chunk_index', flat=True))
+        pending = [chunk for chunk in chunks if chunk.index not in done]
+        self.log(f'{len(chunks)} chunks of up to {self.chunk_size} rows, '
+                 f'{len(done)} already loaded, {len(pending)} to go.')
+
+        workers = self.workers
+        if workers > 1 and connection.vendor == 'sqlite':
+            # SQLite has a single writer; parallel chunks would only fail with "database is locked"
+            self.log('SQLite allows one writer at a time; loading chunks serially.')
+            workers = 1
+
+        count = 0
+        if workers > 1 and len(pending) > 1:
+            self.load_references(fieldnames, pending)
+            # Children must open their own connections
+            connections.close_all()
+            options = {'path': self.path, 'batch_size': self.batch_size,
+                       'chunk_size': self.chunk_size, 'password_hash': self.password_hash,
+                       'importer_class': type(self)}
+            with multiprocessing.Pool(workers, initializer=_init_worker) as pool:
+                jobs = [(options, source, fieldnames, chunk, time_diff) for chunk in pending]
+                for loaded in pool.imap_unordered(_load_chunk_job, jobs):
+                    count += loaded
+                    self.log_progress(count, started)
+        else:
+            for chunk in pending:
+                count += self.load_chunk(source, fieldnames, chunk, time_diff)
+                self.log_progress(count, started)
+
+        elapsed = time.perf_counter() - started
+        self.log(f'Loaded {count} orders in {elapsed:.1f}s '
+                 f'({count / elapsed if elapsed else count:.0f} rows/sec).')
+        return count
+
+    def log_progress(self, count, started):
+        elapsed = time.perf_counter() - started
+        self.log(f'  {count} rows ({count / elapsed if elapsed else count:.0f} rows/sec)')
+
+
+class StreamingCopyImporter(CopyOrdersMixin, StreamingImporter):
+    pass
+
+
+def _init_worker():
+    import django
+    django.setup()
+
+
+def _load_chunk_job(job):
+    options, source, fieldnames, chunk, time_diff = job
+    importer = options['importer_class'](options['path'], chunk_size=options['chunk_size'],
+                                         batch_size=options['batch_size'],
+                                         password_hash=options['password_hash'])
+    try:
+        return importer.load_chunk(source, fieldnames, chunk, time_diff)
+    finally:
+        connections.close_all()
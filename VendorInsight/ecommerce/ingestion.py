@@ -0,0 +1,176 @@
+import atexit
+import logging
+import threading
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Product, User, UserInteraction
+
+logger = logging.getLogger(__name__)
+
+
+class InteractionBuffer:
+    """
+    Per-process buffer for product views and user interactions.
+
+    Request handlers only append to memory; the buffer is written out with one
+    bulk_create for the interactions and one UPDATE ... SET total_views =
+    total_views + n per distinct increment, so a hot product is touched once
+    per flush instead of once per page view. Flushes happen when the buffer
+    reaches `flush_size`, every `flush_interval` seconds from a background
+    thread, and at interpreter exit (or close()). Events of a failed flush
+    are put back for the next one; while the database stays unavailable
+    only the newest `max_size` interactions are kept. Events of products
+    and users deleted in the meantime are dropped.
+    """
+
+    def __init__(self, flush_size=500, flush_interval=5.0, max_size=20000):
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._views = Counter()
+        self._interactions = []
+        self._flusher = None
+        self._closed = threading.Event()
+        # Set after every timed flush, for callers that wait on one
+        self.flushed = threading.Event()
+
+    def record_view(self, product_id):
+        with self._lock:
+            self._views[product_id] += 1
+            pending = self._pending()
+        self._after_record(pending)
+
+    def record_interaction(self, user_id, product_id, interaction_type):
+        with self._lock:
+            self._interactions.append(UserInteraction(
+                user_id=user_id, product_id=product_id,
+                interaction_type=interaction_type, timestamp=timezone.now()))
+            pending = self._pending()
+        self._after_record(pending)
+
+    def _pending(self):
+        return sum(self._views.values()) + len(self._interactions)
+
+    def _after_record(self, pending):
+        if pending >= self.flush_size:
+            self.flush()
+        else:
+            self._ensure_flusher()
+
+    def _ensure_flusher(self):
+        if self._closed.is_set() or (self._flusher is not None and self._flusher.is_alive()):
+            return
+        with self._lock:
+            if self._closed.is_set() or (self._flusher is not None and self._flusher.is_alive()):
+                return
+            self._flusher = threading.Thread(
+                target=self._run_flusher, name='interaction-flusher', daemon=True)
+            self._flusher.start()
+
+    def _run_flusher(self):
+        while not self._closed.wait(self.flush_interval):
+            try:
+                self.flush()
+            finally:
+                # This thread owns its own connections; do not leave them open
+                # between flushes.
+                connections.close_all()
+            self.flushed.set()
+
+    def close(self):
+        """
+        Stops the timed flushes and writes what is pending. Events recorded
+        afterwards are only written once `flush_size` of them are pending or
+        on an explicit flush().
+        """
+        self._closed.set()
+        flusher = self._flusher
+        if flusher is not None and flusher is not threading.current_thread():
+            flusher.join()
+        return self.flush()
+
+    def _drain(self):
+        with self._lock:
+            views, self._views = self._views, Counter()
+            interactions, self._interactions = self._interactions, []
+        return views, interactions
+
+    def _restore(self, views, interactions):
+        """Puts drained events back ahead of those recorded since, up to max_size interactions."""
+        for interaction in interactions:
+            # Set when an earlier batch of the rolled-back insert went through
+            interaction.pk = None
+        with self._lock:
+            self._views.update(views)
+            self._interactions[:0] = interactions
+            dropped = max(len(self._interactions) - self.max_size, 0)
+            del self._interactions[:dropped]
+        if dropped:
+            logger.warning('Interaction buffer full; dropped the %d oldest interactions', dropped)
+
+    def _drop_orphans(self, views, interactions):
+        """Removes the events of products and users that no longer exist."""
+        products = set(Product.objects.filter(
+            id__in=views.keys() | {interaction.product_id for interaction in interactions}
+        ).values_list('id', flat=True))
+        users = set(User.objects.filter(
+            id__in={interaction.user_id for interaction in interactions}
+        ).values_list('id', flat=True))
+        orphans = [product_id for product_id in views if product_id not in products]
+        dropped_views = sum(views.pop(product_id) for product_id in orphans)
+        kept = [interaction for interaction in interactions
+                if interaction.product_id in products and interaction.user_id in users]
+        if dropped_views or len(kept) < len(interactions):
+            logger.warning('Dropped %d interactions and %d product views of deleted products or users',
+                           len(interactions) - len(kept), dropped_views)
+        return views, kept
+
+    def flush(self):
+        """
+        Write buffered events to the database. Returns the number of
+        interactions inserted and products updated.
+        """
+        views, interactions = self._drain()
+        if not views and not interactions:
+            return 0, 0
+
+        try:
+            views, interactions = self._drop_orphans(views, interactions)
+            # Products with the same increment share one UPDATE
+            by_increment = defaultdict(list)
+            for product_id, count in views.items():
+                by_increment[count].append(product_id)
+            with transaction.atomic():
+                UserInteraction.objects.bulk_create(interactions, batch_size=1000)
+                for count, product_ids in by_increment.items():
+                    Product.objects.filter(id__in=product_ids).update(
+                        total_views=F('total_views') + count)
+        except Exception:
+            logger.exception('Could not write %d interactions and %d product views; '
+                             'kept for the next flush', len(interactions), sum(views.values()))
+            self._restore(views, interactions)
+            return 0, 0
+        return len(interactions), len(views)
+
+
+interaction_buffer = InteractionBuffer(
+    flush_size=getattr(settings, 'INTERACTION_FLUSH_SIZE', 500),
+    flush_interval=getattr(settings, 'INTERACTION_FLUSH_INTERVAL', 5.0),
+    max_size=getattr(settings, 'INTERACTION_BUFFER_MAX_SIZE', 20000),
+)
+atexit.register(interaction_buffer.close)
+
+
+def record_view(user, product):
+    interaction_buffer.record_view(product.id)
+    interaction_buffer.record_interaction(user.id, product.id, 'view')
+
+
+def record_interaction(user, product, interaction_type):
+    interaction_buffer.record_interaction(user.id, product.id, interaction_type)
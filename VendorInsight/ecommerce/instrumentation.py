@@ -0,0 +1,221 @@
+import hashlib
+import json
+import logging
+import random
+import re
+import resource
+import time
+from contextlib import ContextDecorator, ExitStack
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+from django.shortcuts import render as _render
+
+logger = logging.getLogger('ecommerce.requests')
+
+_profile = ContextVar('request_profile', default=None)
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+# A parenthesised list of placeholders, of any length including one
+_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+_WHITESPACE = re.compile(r'\s+')
+
+
+def fingerprint_sql(sql):
+    """
+    Normalizes a statement so executions that differ only in literals or
+    IN-list length group together, e.g. the N queries of an N+1 pattern.
+    """
+    sql = _STRING.sub('?', sql)
+    sql = _NUMBER.sub('?', sql)
+    sql = sql.replace('%s', '?')
+    sql = _LIST.sub('(...)', sql)
+    return _WHITESPACE.sub(' ', sql).strip()
+
+
+def current_rss():
+    """Resident set size of this process in bytes (peak RSS where /proc is missing)."""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        # ru_maxrss is kilobytes on Linux, bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if peak > 1 << 32 else peak * 1024
+
+
+class RequestProfile:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.query_count = 0
+        self.sql_time = 0.0
+        self.queries = {}
+        self.spans = {}
+        self.active = set()
+
+    def record_query(self, sql, elapsed):
+        self.query_count += 1
+        self.sql_time += elapsed
+        fingerprint = fingerprint_sql(sql)
+        entry = self.queries.setdefault(fingerprint, [0, 0.0])
+        entry[0] += 1
+        entry[1] += elapsed
+
+    def slowest_queries(self, limit):
+        ranked = sorted(self.queries.items(), key=lambda item: item[1][1], reverse=True)
+        return [{
+            'id': hashlib.md5(sql.encode(), usedforsecurity=False).hexdigest()[:12],
+            'sql': sql[:500],
+            'count': count,
+            'ms': round(elapsed * 1000, 2),
+        } for sql, (count, elapsed) in ranked[:limit]]
+
+
+class span(ContextDecorator):
+    """
+    Adds the time spent inside it to the named span of the current request
+    profile. A no-op when the request is not sampled. Nested spans of the
+    same name are counted once.
+
+        @span('recommender')
+        def recommend_products(...): ...
+
+        with span('sentiment'):
+            prediction = classifier(text)
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        profile = _profile.get()
+        self._profile = profile if profile is not None and self.name not in profile.active else None
+        if self._profile is not None:
+            self._profile.active.add(self.name)
+            self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._profile is not None:
+            elapsed = time.perf_counter() - self._started
+            self._profile.active.discard(self.name)
+            self._profile.spans[self.name] = self._profile.spans.get(self.name, 0.0) + elapsed
+        return False
+
+    def _recreate_cm(self):
+        return type(self)(self.name)
+
+
+@span('template')
+def render(*args, **kwargs):
+    """django.shortcuts.render, timed as the 'template' span."""
+    return _render(*args, **kwargs)
+
+
+class RequestProfilingMiddleware:
+    """
+    Profiles a sample of requests (settings.REQUEST_PROFILE_SAMPLE_RATE):
+    query count, SQL time and the slowest statements by fingerprint on every
+    database alias, the named spans, total time and RSS. Each sampled
+    response gets a Server-Timing header, and one JSON line is logged to the
+    'ecommerce.requests' logger. Unsampled requests only pay for one random()
+    call. Put it first in MIDDLEWARE so the totals cover the other
+    middleware too.
+
+    Under ASGI the SQL counts cover the request's own sync thread; queries
+    made on the async views' recommender pool only show up in its span.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def sampled(self):
+        rate = getattr(settings, 'REQUEST_PROFILE_SAMPLE_RATE', 0)
+        return rate and random.random() < rate
+
+    def install(self, stack, profile):
+        def record(execute, sql, params, many, context):
+            started = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                profile.record_query(sql, time.perf_counter() - started)
+
+        for alias in settings.DATABASES:
+            stack.enter_context(connections[alias].execute_wrapper(record))
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self.sampled():
+            return self.get_response(request)
+
+        profile = RequestProfile()
+        token = _profile.set(profile)
+        try:
+            with ExitStack() as stack:
+                self.install(stack, profile)
+                response = self.get_response(request)
+        finally:
+            _profile.reset(token)
+        return self.finish(request, response, profile)
+
+    async def __acall__(self, request):
+        if not self.sampled():
+            return await self.get_response(request)
+
+        profile = RequestProfile()
+        token = _profile.set(profile)
+        try:
+            # Connections are per thread; the async ORM runs this request's
+            # queries on its sync thread, so the wrappers go on that one
+            stack = ExitStack()
+            await sync_to_async(self.install)(stack, profile)
+            try:
+                response = await self.get_response(request)
+            finally:
+                await sync_to_async(stack.close)()
+        finally:
+            _profile.reset(token)
+        return self.finish(request, response, profile)
+
+    def finish(self, request, response, profile):
+        total = time.perf_counter() - profile.started
+        response['Server-Timing'] = self.server_timing(profile, total)
+        self.log(request, response, profile, total)
+        return response
+
+    def server_timing(self, profile, total):
+        metrics = [f'sql;dur={profile.sql_time * 1000:.1f};desc="{profile.query_count} queries"']
+        metrics += [f'{name};dur={elapsed * 1000:.1f}'
+                    for name, elapsed in sorted(profile.spans.items())]
+        metrics.append(f'total;dur={total * 1000:.1f}')
+        return ', '.join(metrics)
+
+    def log(self, request, response, profile, total):
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'view': getattr(getattr(request, 'resolver_match', None), 'view_name', None),
+            'status': response.status_code,
+            'ms': round(total * 1000, 2),
+            'queries': profile.query_count,
+            'sql_ms': round(profile.sql_time * 1000, 2),
+            'spans_ms': {name: round(elapsed * 1000, 2)
+                         for name, elapsed in sorted(profile.spans.items())},
+            'slow_queries': profile.slowest_queries(
+                getattr(settings, 'REQUEST_PROFILE_SLOW_QUERIES', 5)),
+            'rss_mb': round(current_rss() / (1 << 20), 1),
+        }
+        fragments = getattr(request, 'fragment_cache_stats', None)
+        if fragments:
+            record['fragment_cache'] = fragments
+        logger.info(json.dumps(record, default=str))
@@ -0,0 +1,342 @@
+"""
+A job queue kept in the Job table, for work too slow to do inside a
+request (sentiment analysis, forecasts, segmentation). Views enqueue a
+registered task by name and return at once; `manage.py run_workers` runs
+the queue on a pool of processes.
+
+- Workers claim the highest-priority ready job with SELECT ... FOR UPDATE
+  SKIP LOCKED, so they never wait on each other or run a job twice.
+- A claimed job carries a lease, renewed while it runs. A job whose lease
+  runs out (its worker was killed) is queued again or, out of attempts,
+  marked failed.
+- A failing job is retried after an exponential backoff with jitter.
+- A dedupe key keeps one queued or running job per key, so a page that
+  is reloaded while its job is pending does not queue it again.
+"""
+import contextvars
+import importlib
+import json
+import logging
+import multiprocessing
+import os
+import random
+import signal
+import socket
+import threading
+import time
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, connection, connections, transaction
+from django.db.models import Avg, Count, F, Max, Min
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger('ecommerce.jobs')
+
+ACTIVE = (Job.Status.QUEUED, Job.Status.RUNNING)
+
+TASKS = {}
+
+
+def task(func):
+    """Registers `func` as a job task under its name. Its arguments must be JSON-serializable."""
+    TASKS[func.__name__] = func
+    return func
+
+
+def load_tasks():
+    # Task modules register themselves on import and are cheap to import;
+    # the heavy libraries they use are only loaded when a task runs
+    for module in getattr(settings, 'JOB_TASK_MODULES', ['ecommerce.tasks']):
+        importlib.import_module(module)
+
+
+def enqueue(name, *args, priority=0, dedupe_key=None, delay=0, max_attempts=None):
+    """
+    Queues the task `name` with `args` and returns its Job. When a queued
+    or running job already has `dedupe_key`, that job is returned instead.
+    """
+    load_tasks()
+    if name not in TASKS:
+        raise ValueError(f'Unknown task {name!r}')
+    if dedupe_key is not None:
+        existing = Job.objects.filter(dedupe_key=dedupe_key, status__in=ACTIVE).first()
+        if existing is not None:
+            return existing
+    try:
+        with transaction.atomic():
+            return Job.objects.create(
+                task=name, args=list(args), priority=priority, dedupe_key=dedupe_key,
+                run_after=timezone.now() + timedelta(seconds=delay),
+                max_attempts=max_attempts or getattr(settings, 'JOB_MAX_ATTEMPTS', 3))
+    except IntegrityError:
+        # Another request queued the same key between the check and the insert
+        existing = Job.objects.filter(dedupe_key=dedupe_key, status__in=ACTIVE).first()
+        if existing is None:
+            raise
+        return existing
+
+
+def backoff(attempts):
+    """Seconds to wait before retrying a job that has failed `attempts` times."""
+    base = getattr(settings, 'JOB_RETRY_BACKOFF', 30)
+    delay = min(base * 2 ** (attempts - 1), getattr(settings, 'JOB_RETRY_BACKOFF_MAX', 3600))
+    # Jitter keeps jobs that failed together from retrying together
+    return delay * random.uniform(0.5, 1.0)
+
+
+def claim(worker, lease):
+    """Takes the next ready job for `worker` under a lease of `lease` seconds, or None."""
+    while True:
+        now = timezone.now()
+        with transaction.atomic():
+            job = (Job.objects.select_for_update(skip_locked=True)
+                   .filter(status=Job.Status.QUEUED, run_after__lte=now)
+                   .order_by('-priority', 'run_after', 'id').first())
+            if job is None:
+                return None
+            # SQLite has no row locks; the status check makes the claim
+            # exclusive there as well
+            claimed = Job.objects.filter(pk=job.pk, status=Job.Status.QUEUED).update(
+                status=Job.Status.RUNNING, attempts=F('attempts') + 1, worker=worker,
+                started_at=now, lease_expires=now + timedelta(seconds=lease))
+        if claimed:
+            job.refresh_from_db()
+            return job
+
+
+def renew_lease(job, lease):
+    """Extends the lease of a running job. False if the job is no longer this worker's."""
+    return bool(Job.objects.filter(pk=job.pk, status=Job.Status.RUNNING, worker=job.worker).update(
+        lease_expires=timezone.now() + timedelta(seconds=lease)))
+
+
+def complete(job, runtime):
+    now = timezone.now()
+    Job.objects.filter(pk=job.pk, status=Job.Status.RUNNING, worker=job.worker).update(
+        status=Job.Status.SUCCEEDED, finished_at=now, runtime=runtime, lease_expires=None,
+        last_error='')
+
+
+def fail(job, error, runtime):
+    """Queues `job` for a retry after a backoff, or marks it failed when it is out of attempts."""
+    now = timezone.now()
+    changes = {'finished_at': now, 'runtime': runtime, 'lease_expires': None, 'last_error': error}
+    if job.attempts < job.max_attempts:
+        changes.update(status=Job.Status.QUEUED,
+                       run_after=now + timedelta(seconds=backoff(job.attempts)))
+    else:
+        changes.update(status=Job.Status.FAILED)
+    Job.objects.filter(pk=job.pk, status=Job.Status.RUNNING, worker=job.worker).update(**changes)
+    return changes['status']
+
+
+def recover_expired():
+    """Requeues (or fails, when out of attempts) running jobs whose lease has expired."""
+    now = timezone.now()
+    expired = Job.objects.filter(status=Job.Status.RUNNING, lease_expires__lt=now)
+    failed = expired.filter(attempts__gte=F('max_attempts')).update(
+        status=Job.Status.FAILED, finished_at=now, lease_expires=None,
+        last_error='Lease expired; the worker stopped before finishing.')
+    requeued = expired.update(
+        status=Job.Status.QUEUED, lease_expires=None,
+        run_after=now + timedelta(seconds=getattr(settings, 'JOB_RETRY_BACKOFF', 30)),
+        last_error='Lease expired; the worker stopped before finishing.')
+    return requeued, failed
+
+
+def prune(days):
+    """Deletes jobs that finished (either way) more than `days` days ago."""
+    deleted, _ = Job.objects.filter(
+        status__in=(Job.Status.SUCCEEDED, Job.Status.FAILED),
+        finished_at__lt=timezone.now() - timedelta(days=days)).delete()
+    return deleted
+
+
+def queue_stats(window=3600):
+    """
+    Queue depth per task and status, how long the oldest ready job has
+    waited, and the count and runtimes of jobs finished in the last
+    `window` seconds per task.
+    """
+    now = timezone.now()
+    depth = {}
+    for row in Job.objects.filter(status__in=ACTIVE).values('task', 'status').annotate(
+            count=Count('id')).order_by():
+        depth.setdefault(row['task'], {})[row['status']] = row['count']
+    oldest = Job.objects.filter(status=Job.Status.QUEUED, run_after__lte=now).aggregate(
+        oldest=Min('run_after'))['oldest']
+    finished = {}
+    for row in Job.objects.filter(finished_at__gte=now - timedelta(seconds=window)).values(
+            'task', 'status').annotate(count=Count('id'), mean=Avg('runtime'),
+                                       max=Max('runtime')).order_by():
+        finished.setdefault(row['task'], {})[row['status']] = {
+            'count': row['count'],
+            'mean_runtime': round(row['mean'] or 0.0, 3),
+            'max_runtime': round(row['max'] or 0.0, 3),
+        }
+    return {
+        'queued': sum(counts.get(Job.Status.QUEUED, 0) for counts in depth.values()),
+        'running': sum(counts.get(Job.Status.RUNNING, 0) for counts in depth.values()),
+        'depth': depth,
+        'oldest_wait': round((now - oldest).total_seconds(), 1) if oldest else 0.0,
+        'finished': finished,
+        'window': window,
+    }
+
+
+class Heartbeat:
+    """Renews a running job's lease from a background thread until the job ends."""
+
+    def __init__(self, job, lease):
+        self.job = job
+        self.lease = lease
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f'job-{job.pk}-heartbeat',
+                                        daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        return False
+
+    def _run(self):
+        try:
+            while not self._stop.wait(self.lease / 3):
+                if not renew_lease(self.job, self.lease):
+                    logger.warning('Job %s lost its lease', self.job.pk)
+                    return
+        finally:
+            connections.close_all()
+
+
+class Worker:
+    """
+    Claims and runs jobs until `stop` (a threading or multiprocessing
+    Event) is set or, with `burst`, until no job is ready. Every job is
+    logged with its runtime; with `stats_interval`, queue_stats() is logged
+    that often as well.
+    """
+
+    def __init__(self, name=None, lease=300, poll=1.0, burst=False, stop=None,
+                 stats_interval=None):
+        self.name = name or f'{socket.gethostname()}:{os.getpid()}'
+        self.lease = lease
+        self.poll = poll
+        self.burst = burst
+        self.stop = stop or threading.Event()
+        self.stats_interval = stats_interval
+        self.processed = 0
+
+    def run(self):
+        load_tasks()
+        recovered_at = reported_at = time.monotonic() - self.lease
+        while not self.stop.is_set():
+            if time.monotonic() - recovered_at > self.lease / 3:
+                recover_expired()
+                recovered_at = time.monotonic()
+            if self.stats_interval and time.monotonic() - reported_at >= self.stats_interval:
+                logger.info(json.dumps({'queue': queue_stats(), 'worker': self.name}))
+                reported_at = time.monotonic()
+            job = claim(self.name, self.lease)
+            if job is None:
+                if self.burst:
+                    break
+                self.stop.wait(self.poll)
+            else:
+                self.execute(job)
+            # Drops connections that broke or outlived CONN_MAX_AGE, but not
+            # the one a caller's transaction (a test, a shell) is still using
+            if not connection.in_atomic_block:
+                close_old_connections()
+        return self.processed
+
+    def execute(self, job):
+        func = TASKS.get(job.task)
+        started = time.perf_counter()
+        with Heartbeat(job, self.lease):
+            try:
+                if func is None:
+                    raise LookupError(f'Unknown task {job.task!r}')
+                # A fresh context, so the claim's write does not pin the
+                # task's reads to the primary (see routers.py)
+                contextvars.Context().run(func, *job.args)
+            except Exception:
+                runtime = time.perf_counter() - started
+                status = fail(job, traceback.format_exc(), runtime)
+            else:
+                runtime = time.perf_counter() - started
+                complete(job, runtime)
+                status = Job.Status.SUCCEEDED
+        self.processed += 1
+        logger.info(json.dumps({
+            'job': job.pk,
+            'task': job.task,
+            'status': status,
+            'attempt': job.attempts,
+            'runtime': round(runtime, 3),
+            'waited': round((job.started_at - job.created_at).total_seconds(), 3),
+            'worker': self.name,
+        }))
+        return status
+
+
+def run_workers(processes, lease=300, poll=1.0, burst=False, stats_interval=60, stdout=None):
+    """
+    Runs the queue on `processes` worker processes until SIGTERM or Ctrl-C
+    (or, with `burst`, until it is empty). A stopping worker finishes its
+    current job first. Returns the number of jobs run.
+    """
+    load_tasks()
+    if processes > 1 and connection.vendor == 'sqlite':
+        # SQLite has a single writer; extra workers would only fail with "database is locked"
+        if stdout is not None:
+            stdout.write('SQLite allows one writer at a time; running one worker.')
+        processes = 1
+    options = [{'lease': lease, 'poll': poll, 'burst': burst,
+                'stats_interval': stats_interval if index == 0 else None}
+               for index in range(processes)]
+
+    stop = threading.Event() if processes == 1 else multiprocessing.Event()
+    handlers = {signum: signal.signal(signum, lambda *_: stop.set())
+                for signum in (signal.SIGINT, signal.SIGTERM)}
+    try:
+        if processes == 1:
+            return Worker(stop=stop, **options[0]).run()
+        connections.close_all()
+        with multiprocessing.Pool(processes, initializer=_init_worker, initargs=(stop,)) as pool:
+            result = pool.map_async(_run_worker, options)
+            while not result.ready():
+                result.wait(1)
+            return sum(result.get())
+    finally:
+        for signum, handler in handlers.items():
+            signal.signal(signum, handler)
+
+
+_stop = None
+
+
+def _init_worker(stop):
+    global _stop
+    import django
+    django.setup()
+    # Ctrl-C reaches every process in the group; the parent sets `stop`
+    # instead, so a worker gets to finish its job
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    _stop = stop
+
+
+def _run_worker(options):
+    try:
+        return Worker(stop=_stop, **options).run()
+    finally:
+        connections.close_all()
@@ -0,0 +1,107 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import setup_databases, setup_test_environment, teardown_databases, \
+    teardown_test_environment
+
+from ...benchmarks import (ROUTES, AsgiBenchmark, Fixture, RouteBenchmark, compare,
+                           format_speedup, load_baseline, save_baseline, uncovered_url_names)
+from ...synthetic import SCALES, SyntheticDataGenerator
+
+
+class Command(BaseCommand):
+    help = 'Load-tests every ecommerce route in-process and reports latency percentiles'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=50,
+                            help='Timed requests per route')
+        parser.add_argument('--concurrency', type=int, default=4,
+                            help='Concurrent clients per route')
+        parser.add_argument('--warmup', type=int, default=1,
+                            help='Untimed requests per client before timing')
+        parser.add_argument('--routes', nargs='*', choices=[route.name for route in ROUTES],
+                            help='Only these routes (default: all)')
+        parser.add_argument('--scale', choices=list(SCALES), default='S',
+                            help='Synthetic dataset to seed the benchmark database with')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--existing-db', action='store_true',
+                            help='Run against the configured database as it is, without '
+                                 'creating and seeding a throwaway test database')
+        parser.add_argument('--keepdb', action='store_true',
+                            help='Keep and reuse the seeded test database between runs')
+        parser.add_argument('--baseline', default=os.path.join(settings.BASE_DIR, 'benchmarks',
+                                                                'routes_baseline.json'),
+                            help='Baseline JSON to compare against')
+        parser.add_argument('--save-baseline', action='store_true',
+                            help='Write these results as the new baseline')
+        parser.add_argument('--tolerance', type=float, default=0.2,
+                            help='Allowed p95/throughput change against the baseline (0.2 = 20%%)')
+        parser.add_argument('--profile', action='store_true',
+                            help='Keep request profiling on (it is switched off by default)')
+        parser.add_argument('--asgi', action='store_true',
+                            help='Compare the sync and async storefront views under ASGI '
+                                 'instead (no baseline is read or written)')
+
+    def handle(self, *args, **options):
+        for name in uncovered_url_names():
+            self.stdout.write(self.style.WARNING(f'No benchmark route drives URL "{name}".'))
+
+        # Measure the app, not the profiler
+        if not options['profile']:
+            settings.REQUEST_PROFILE_SAMPLE_RATE = 0
+
+        old_config = None
+        if not options['existing_db']:
+            setup_test_environment()
+            old_config = setup_databases(verbosity=options['verbosity'], interactive=False,
+                                         keepdb=options['keepdb'])
+        try:
+            if not options['existing_db']:
+                try:
+                    Fixture(options['concurrency'])
+                except ValueError:
+                    SyntheticDataGenerator(options['scale'], seed=options['seed'],
+                                           stdout=self.stdout).run()
+            results = self.benchmark(options)
+        finally:
+            if old_config is not None:
+                teardown_databases(old_config, verbosity=options['verbosity'],
+                                   keepdb=options['keepdb'])
+                teardown_test_environment()
+
+        if options['asgi']:
+            self.stdout.write('Async speedup (throughput and p95, sync -> async):')
+            for name, result in results['sync'].items():
+                self.stdout.write(format_speedup(name, result, results['async'][name]))
+            return
+        self.report(results, options)
+
+    def benchmark(self, options):
+        fixture = Fixture(options['concurrency'])
+        self.stdout.write(f"{options['requests']} requests per route, "
+                          f"{options['concurrency']} concurrent clients:")
+        benchmark_class = AsgiBenchmark if options['asgi'] else RouteBenchmark
+        return benchmark_class(
+            fixture, requests=options['requests'], concurrency=options['concurrency'],
+            warmup=options['warmup'], seed=options['seed'], stdout=self.stdout,
+        ).run(options['routes'])
+
+    def report(self, results, options):
+        baseline_path = options['baseline']
+        if options['save_baseline']:
+            os.makedirs(os.path.dirname(baseline_path), exist_ok=True)
+            save_baseline(baseline_path, results, {
+                key: options[key] for key in ('requests', 'concurrency', 'scale', 'seed')})
+            self.stdout.write(self.style.SUCCESS(f'Saved baseline to {baseline_path}.'))
+            return
+        if not os.path.exists(baseline_path):
+            return
+
+        regressions = compare(results, load_baseline(baseline_path), options['tolerance'])
+        for name, metric, before, after in regressions:
+            self.stdout.write(self.style.ERROR(
+                f'{name}: {metric} {before:.1f} -> {after:.1f}'))
+        if regressions:
+            raise CommandError(f'{len(regressions)} regression(s) against {baseline_path}.')
+        self.stdout.write(self.style.SUCCESS(f'No regressions against {baseline_path}.'))
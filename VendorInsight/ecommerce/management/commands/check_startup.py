@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from ...startup import measure_startup
+
+
+class Command(BaseCommand):
+    help = 'Measures importing ecommerce.urls in a fresh process and enforces a time/RSS budget'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-seconds', type=float, default=2.0,
+                            help='Import time budget in seconds (default: 2.0)')
+        parser.add_argument('--max-rss-mb', type=float, default=150.0,
+                            help='RSS budget after the import in MB (default: 150)')
+        parser.add_argument('--top', type=int, default=10,
+                            help='Slowest top-level imports to list')
+
+    def handle(self, *args, **options):
+        report = measure_startup()
+        rss_mb = report['rss'] / (1 << 20)
+        self.stdout.write(f"Imported ecommerce.urls in {report['seconds']:.2f}s, "
+                          f"RSS {rss_mb:.0f} MB.")
+        for name, seconds in report['slowest'][:options['top']]:
+            self.stdout.write(f'  {seconds * 1000:8.1f}ms  {name}')
+
+        problems = []
+        if report['heavy']:
+            problems.append(f"loaded {', '.join(report['heavy'])} at startup")
+        if report['seconds'] > options['max_seconds']:
+            problems.append(f"took {report['seconds']:.2f}s (budget {options['max_seconds']}s)")
+        if rss_mb > options['max_rss_mb']:
+            problems.append(f"used {rss_mb:.0f} MB (budget {options['max_rss_mb']:.0f} MB)")
+        if problems:
+            raise CommandError('Startup over budget: ' + '; '.join(problems) + '.')
+        self.stdout.write(self.style.SUCCESS('Startup within budget.'))
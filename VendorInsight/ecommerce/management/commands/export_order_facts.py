@@ -0,0 +1,32 @@
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = ('Exports the order lines as month-partitioned Parquet or Arrow files for the '
+            'forecasts, rewriting only the months that changed')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', default=None,
+                            help='Output directory (default: settings.ORDER_FACTS_DIR)')
+        parser.add_argument('--format', choices=['parquet', 'arrow'], default='parquet',
+                            help='parquet (compressed) or arrow (uncompressed IPC, zero-copy '
+                                 'reads); changing it rewrites every month')
+        parser.add_argument('--full', action='store_true',
+                            help='Rewrite every month')
+        parser.add_argument('--since', type=date.fromisoformat, default=None,
+                            help='Also rewrite every month from the one holding YYYY-MM-DD on')
+
+    def handle(self, *args, **options):
+        # pyarrow and pandas are only needed here and by the forecasts
+        from ...order_facts import export, facts_dir
+
+        started = time.perf_counter()
+        written, removed, unchanged = export(
+            options['dir'], file_format=options['format'], full=options['full'],
+            since=options['since'], stdout=self.stdout)
+        self.stdout.write(self.style.SUCCESS(
+            f"{options['dir'] or facts_dir()}: {written} months written, {removed} removed, "
+            f"{unchanged} unchanged in {time.perf_counter() - started:.2f}s."))
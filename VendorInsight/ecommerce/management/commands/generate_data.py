@@ -0,0 +1,43 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ...customer_features import refresh
+from ...models import User
+from ...synthetic import SCALES, USERNAME_PREFIX, SyntheticDataGenerator, flush_synthetic_data
+
+
+class Command(BaseCommand):
+    help = 'Generates a reproducible synthetic dataset for load and performance testing'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', choices=list(SCALES), default='S',
+                            help='Dataset size (default: S)')
+        parser.add_argument('--seed', type=int, default=42,
+                            help='Random seed; the same seed gives the same data')
+        parser.add_argument('--days', type=int, default=730,
+                            help='Days of order and interaction history')
+        parser.add_argument('--end-date', type=date.fromisoformat, default=None,
+                            help='Last day of history, YYYY-MM-DD (default: today)')
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help='Rows per bulk insert')
+        parser.add_argument('--flush', action='store_true',
+                            help='Delete previously generated data first')
+
+    def handle(self, *args, **options):
+        if options['flush']:
+            self.stdout.write('Deleting previously generated data...')
+            flush_synthetic_data()
+        elif User.objects.filter(username__startswith=USERNAME_PREFIX).exists():
+            # Generated usernames repeat across runs; checked here rather than
+            # failing halfway through, with earlier batches already committed
+            raise CommandError('A generated dataset already exists; pass --flush to replace it.')
+
+        generator = SyntheticDataGenerator(
+            options['scale'], seed=options['seed'], days=options['days'],
+            end_date=options['end_date'], batch_size=options['batch_size'], stdout=self.stdout)
+        generator.run()
+        # bulk_create bypasses the signals that keep customer features current
+        refresh()
+
+        self.stdout.write(self.style.SUCCESS(f"Generated the {options['scale']} dataset."))
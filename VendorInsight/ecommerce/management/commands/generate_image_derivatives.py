@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from ...catalog_versions import bump_product_versions
+from ...images import generate_derivatives
+from ...models import ProductImage
+
+
+class Command(BaseCommand):
+    help = 'Builds card/detail/WebP derivatives for existing product images'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='Rebuild images that already have derivatives')
+
+    def handle(self, *args, **options):
+        images = ProductImage.objects.order_by('id')
+        if not options['all']:
+            images = images.filter(derivatives={})
+
+        built = failed = 0
+        product_ids = set()
+        for product_image in images.iterator(chunk_size=200):
+            if generate_derivatives(product_image):
+                built += 1
+                product_ids.add(product_image.product_id)
+            else:
+                failed += 1
+
+        # Derivatives are saved with update(), so refresh the cached cards here
+        bump_product_versions(product_ids)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Built derivatives for {built} images ({failed} failed).'))
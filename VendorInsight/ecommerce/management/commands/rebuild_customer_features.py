@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from ...customer_features import refresh
+from ...models import CustomerFeatures
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the per-vendor customer features from the order history'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--vendor', type=int, action='append', dest='vendors',
+                            help='Only this vendor id (repeatable)')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        refresh(vendor_ids=options['vendors'])
+        rows = CustomerFeatures.objects.all()
+        if options['vendors']:
+            rows = rows.filter(vendor_id__in=options['vendors'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt {rows.count()} customer feature rows in {time.perf_counter() - started:.2f}s.'))
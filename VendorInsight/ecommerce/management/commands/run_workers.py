@@ -0,0 +1,29 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from ...jobs import prune, run_workers
+
+
+class Command(BaseCommand):
+    help = 'Runs queued background jobs (sentiment, forecasts, segments) on a pool of processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=getattr(settings, 'JOB_WORKERS', 2),
+                            help='Worker processes (default: settings.JOB_WORKERS)')
+        parser.add_argument('--lease', type=int, default=getattr(settings, 'JOB_LEASE', 300),
+                            help='Seconds a job stays claimed without a heartbeat')
+        parser.add_argument('--poll', type=float, default=1.0,
+                            help='Seconds an idle worker waits before looking for jobs again')
+        parser.add_argument('--burst', action='store_true',
+                            help='Exit once no job is ready instead of waiting for more')
+        parser.add_argument('--stats-interval', type=int, default=60,
+                            help='Seconds between queue depth and runtime reports (0 for none)')
+
+    def handle(self, *args, **options):
+        pruned = prune(getattr(settings, 'JOB_RETENTION_DAYS', 7))
+        if pruned:
+            self.stdout.write(f'Deleted {pruned} finished jobs.')
+        processed = run_workers(options['processes'], lease=options['lease'],
+                                poll=options['poll'], burst=options['burst'],
+                                stats_interval=options['stats_interval'], stdout=self.stdout)
+        self.stdout.write(self.style.SUCCESS(f'Ran {processed} jobs.'))
@@ -0,0 +1,50 @@
+# Generated by Django 4.2.30 on 2026-10-19 15:15
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_vendor_orders(apps, schema_editor):
+    OrderDetails = apps.get_model('ecommerce', 'OrderDetails')
+    VendorOrder = apps.get_model('ecommerce', 'VendorOrder')
+    pairs = OrderDetails.objects.values_list(
+        'product__user_id', 'order_id', 'order__status', 'order__order_date',
+        'order__total_amount').distinct().order_by()
+    batch = []
+    for vendor_id, order_id, status, order_date, total_amount in pairs.iterator():
+        batch.append(VendorOrder(vendor_id=vendor_id, order_id=order_id, status=status,
+                                 order_date=order_date, total_amount=total_amount))
+        if len(batch) >= 5000:
+            VendorOrder.objects.bulk_create(batch, ignore_conflicts=True)
+            batch = []
+    VendorOrder.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecommerce', '0006_productimage_derivatives'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VendorOrder',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(max_length=50)),
+                ('order_date', models.DateTimeField()),
+                ('total_amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='ecommerce.order')),
+                ('vendor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='vendor_orders', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['vendor', 'status', '-order_date', '-order'], name='vendororder_board_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='vendororder',
+            constraint=models.UniqueConstraint(fields=('vendor', 'order'), name='unique_vendor_order'),
+        ),
+        migrations.RunPython(backfill_vendor_orders, migrations.RunPython.noop),
+    ]
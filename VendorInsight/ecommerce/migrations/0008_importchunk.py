@@ -0,0 +1,30 @@
+# Generated by Django 4.2.30 on 2026-10-19 15:17
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecommerce', '0007_vendororder'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(max_length=64)),
+                ('chunk_index', models.PositiveIntegerField()),
+                ('byte_start', models.BigIntegerField()),
+                ('byte_end', models.BigIntegerField()),
+                ('rows', models.PositiveIntegerField()),
+                ('completed_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='importchunk',
+            constraint=models.UniqueConstraint(fields=('source', 'chunk_index'), name='unique_import_chunk'),
+        ),
+    ]
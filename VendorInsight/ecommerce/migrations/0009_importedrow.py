@@ -0,0 +1,30 @@
+# Generated by Django 4.2.30 on 2026-10-19 15:21
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecommerce', '0008_importchunk'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportedRow',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ledger', models.CharField(max_length=64)),
+                ('row_key', models.CharField(max_length=64)),
+                ('fingerprint', models.CharField(max_length=64)),
+                ('imported_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('order', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to='ecommerce.order')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='importedrow',
+            constraint=models.UniqueConstraint(fields=('ledger', 'row_key'), name='unique_imported_row'),
+        ),
+    ]
@@ -0,0 +1,70 @@
+# Generated by Django 4.2.30 on 2026-10-19 15:38
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecommerce', '0009_importedrow'),
+    ]
+
+    # The composite indexes go in first, so each foreign key stays covered
+    # while its single-column index is dropped
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', '-order_date', '-id'], name='order_user_history_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['order_date'], name='order_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('status', 'Pending')), fields=['-order_date'], name='order_pending_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='orderdetails',
+            index=models.Index(fields=['product', 'order'], name='orderdetails_product_order_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productreview',
+            index=models.Index(fields=['product', 'sentiment'], name='productreview_sentiment_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userinteraction',
+            index=models.Index(fields=['user', '-timestamp'], name='interaction_user_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userinteraction',
+            index=models.Index(fields=['product', 'interaction_type', '-timestamp'], name='interaction_product_type_idx'),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='orderdetails',
+            name='product',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='ecommerce.product'),
+        ),
+        migrations.AlterField(
+            model_name='productreview',
+            name='product',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='ecommerce.product'),
+        ),
+        migrations.AlterField(
+            model_name='userinteraction',
+            name='product',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='ecommerce.product'),
+        ),
+        migrations.AlterField(
+            model_name='userinteraction',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+    ]
@@ -0,0 +1,20 @@
+from django.db import migrations
+
+
+def backfill_customer_features(apps, schema_editor):
+    # refresh() is two INSERT ... SELECTs over the order tables, so the
+    # backfill runs in the database however many orders there are
+    from ecommerce.customer_features import refresh
+
+    refresh()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecommerce', '0012_customer_features'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_customer_features, migrations.RunPython.noop),
+    ]
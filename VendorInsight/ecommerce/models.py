@@ -3,6 +3,8 @@ from django.core.validators import MinValueValidator, MaxValueValidator
 from django.conf import settings
 from django.utils.translation import gettext_lazy as _
 from django.contrib.auth.models import AbstractUser
+from django.utils import timezone
+from django.core.files.storage import default_storage
 # Create your models here.
 
 
@@ -26,6 +28,19 @@ class UserProfile(models.Model):
         return self.user.username
 
 
+class ProductQuerySet(models.QuerySet):
+    def with_card_data(self):
+        """
+        Loads everything a product card renders in a fixed number of queries:
+        inventory and discount are joined, and the images are prefetched in
+        upload order so `primary_image` needs no query of its own.
+        """
+        return self.select_related('inventory', 'discount').prefetch_related(
+            models.Prefetch('productimage_set',
+                            queryset=ProductImage.objects.order_by('id'),
+                            to_attr='card_images'))
+
+
 class Product(models.Model):
     name = models.CharField(max_length=100)
     description = models.TextField()
@@ -38,6 +53,14 @@ class Product(models.Model):
     categories = models.ManyToManyField('Category', related_name='products')
     total_views = models.PositiveIntegerField(default=0)
 
+    objects = ProductQuerySet.as_manager()
+
+    @property
+    def primary_image(self):
+        if hasattr(self, 'card_images'):
+            return self.card_images[0] if self.card_images else None
+        return self.productimage_set.order_by('id').first()
+
     def average_sentiment(self):
         sentiments = {'sadness': -2, 'anger': -1, 'fear': -1,
                       'joy': 2, 'love': 3, 'surprise': 1, 'neutral': 0}
@@ -57,6 +80,21 @@ class ProductImage(models.Model):
     description = models.TextField(blank=True)
     upload_date = models.DateTimeField(auto_now_add=True)
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    # Resized WebP/fallback renditions, see ecommerce.images
+    derivatives = models.JSONField(default=dict, blank=True)
+
+    def derivative_url(self, label, fmt='fallback'):
+        derivative = self.derivatives.get(label)
+        if not derivative:
+            return self.image.url
+        return default_storage.url(derivative[fmt])
+
+    def srcset(self, fmt='fallback'):
+        # Small originals produce equal-width renditions; list each width once
+        by_width = {derivative['width']: derivative[fmt]
+                    for derivative in self.derivatives.values()}
+        return ', '.join(f'{default_storage.url(name)} {width}w'
+                         for width, name in sorted(by_width.items()))
 
     def __str__(self):
         return self.image_url
@@ -98,16 +136,61 @@ class ProductReview(models.Model):
     review_date = models.DateTimeField(auto_now_add=True)
     user = models.ForeignKey(settings.AUTH_USER_MODEL,
                              on_delete=models.CASCADE)
-    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    # Covered by productreview_sentiment_idx
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, db_index=False)
     sentiment = models.CharField(max_length=20, blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            # A product's reviews, and the per-sentiment counts of the
+            # vendor analytics page straight from the index
+            models.Index(fields=['product', 'sentiment'], name='productreview_sentiment_idx'),
+        ]
+
+
+class OrderQuerySet(models.QuerySet):
+    def with_lines(self):
+        """
+        Annotates `item_count` (units) and `lines_total` per order and
+        prefetches the lines with their products, so rendering a page of
+        orders with their items is two queries however many orders or
+        lines there are. The annotations are correlated subqueries, so they
+        are only evaluated for the rows of the page.
+        """
+        lines = OrderDetails.objects.filter(order=models.OuterRef('pk')).order_by(
+        ).values('order')
+        return self.annotate(
+            item_count=models.Subquery(
+                lines.annotate(total=models.Sum('quantity')).values('total')),
+            lines_total=models.Subquery(
+                lines.annotate(total=models.Sum(
+                    models.F('price') * models.F('quantity'))).values('total'),
+                output_field=models.DecimalField(max_digits=12, decimal_places=2)),
+        ).prefetch_related(models.Prefetch(
+            'orderdetails_set',
+            queryset=OrderDetails.objects.select_related('product').order_by('id')))
+
 
 class Order(models.Model):
     order_date = models.DateTimeField()
     total_amount = models.DecimalField(max_digits=10, decimal_places=2)
     status = models.CharField(max_length=50)
+    # Covered by order_user_history_idx
     user = models.ForeignKey(settings.AUTH_USER_MODEL,
-                             on_delete=models.CASCADE)
+                             on_delete=models.CASCADE, db_index=False)
+
+    objects = OrderQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Order history pages in (-order_date, -id) cursor order
+            models.Index(fields=['user', '-order_date', '-id'], name='order_user_history_idx'),
+            # Date ranges of the sales reports
+            models.Index(fields=['order_date'], name='order_date_idx'),
+            # Only the few orders still waiting to be fulfilled
+            models.Index(fields=['-order_date'], name='order_pending_idx',
+                         condition=models.Q(status='Pending')),
+        ]
 
     def __str__(self):
         return f'{self.order_date}'
@@ -117,7 +200,90 @@ class OrderDetails(models.Model):
     quantity = models.PositiveIntegerField()
     price = models.DecimalField(max_digits=10, decimal_places=2)
     order = models.ForeignKey(Order, on_delete=models.CASCADE)
-    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    # Covered by orderdetails_product_order_idx
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, db_index=False)
+
+    class Meta:
+        indexes = [
+            # A product's (or vendor's) lines joined to their orders for the
+            # date filters of the sales and forecast pages
+            models.Index(fields=['product', 'order'], name='orderdetails_product_order_idx'),
+        ]
+
+
+class VendorOrder(models.Model):
+    """
+    One row per (vendor, order) the vendor has a line in, with the order
+    fields the vendor order board lists copied in. The board then reads one
+    index range per status instead of a DISTINCT join through OrderDetails
+    and Product. Kept in sync by ecommerce.vendor_orders.
+    """
+    vendor = models.ForeignKey(settings.AUTH_USER_MODEL,
+                               on_delete=models.CASCADE, related_name='vendor_orders')
+    order = models.ForeignKey(Order, on_delete=models.CASCADE)
+    status = models.CharField(max_length=50)
+    order_date = models.DateTimeField()
+    total_amount = models.DecimalField(max_digits=10, decimal_places=2)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['vendor', 'order'],
+                                    name='unique_vendor_order'),
+        ]
+        indexes = [
+            models.Index(fields=['vendor', 'status', '-order_date', '-order'],
+                         name='vendororder_board_idx'),
+        ]
+
+
+class CustomerFeatures(models.Model):
+    """
+    One customer's orders with one vendor, aggregated into fixed-width
+    features that vendor-side segmentation reads instead of re-aggregating
+    order history. Canceled orders are left out. Kept up to date by
+    ecommerce.customer_features as orders are placed or change status;
+    `manage.py rebuild_customer_features` recomputes the whole table.
+    """
+    # Covered by unique_customer_features
+    vendor = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE,
+                               related_name='customer_features', db_index=False)
+    customer = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE,
+                                 related_name='+')
+    order_count = models.PositiveIntegerField()
+    quantity = models.PositiveIntegerField()
+    total_spent = models.DecimalField(max_digits=12, decimal_places=2)
+    first_order_date = models.DateTimeField()
+    last_order_date = models.DateTimeField()
+    # The category of most of the customer's lines with the vendor
+    top_category = models.ForeignKey(Category, null=True, blank=True,
+                                     on_delete=models.SET_NULL, related_name='+')
+    updated_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['vendor', 'customer'],
+                                    name='unique_customer_features'),
+        ]
+
+
+class CustomerCategoryCount(models.Model):
+    """
+    Order lines per category of one customer with one vendor, from which
+    CustomerFeatures.top_category is picked.
+    """
+    # Covered by unique_customer_category_count
+    vendor = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE,
+                               related_name='+', db_index=False)
+    customer = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE,
+                                 related_name='+')
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='+')
+    line_count = models.PositiveIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['vendor', 'customer', 'category'],
+                                    name='unique_customer_category_count'),
+        ]
 
 
 class Wishlist(models.Model):
@@ -140,9 +306,114 @@ class CartItem(models.Model):
 
 
 class UserInteraction(models.Model):
+    # Both covered by the composite indexes below; this table takes the most
+    # inserts, so it carries no more indexes than it needs
     user = models.ForeignKey(settings.AUTH_USER_MODEL,
-                             on_delete=models.CASCADE)
-    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+                             on_delete=models.CASCADE, db_index=False)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, db_index=False)
     interaction_type = models.CharField(max_length=20, choices=[(
         'view', 'View'), ('purchase', 'Purchase'), ('wishlist', 'Wishlist')])
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Set when the event happens rather than when the buffer is flushed
+    timestamp = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # A user's recent activity
+            models.Index(fields=['user', '-timestamp'], name='interaction_user_recent_idx'),
+            # A product's views, wishlists or purchases over a time window
+            models.Index(fields=['product', 'interaction_type', '-timestamp'],
+                         name='interaction_product_type_idx'),
+        ]
+
+
+class ImportChunk(models.Model):
+    """
+    A committed chunk of a streaming import_data run. Written in the same
+    transaction as the chunk's rows, so a chunk is either fully loaded and
+    recorded or neither, and a resumed run skips exactly the recorded ones.
+    """
+    source = models.CharField(max_length=64)
+    chunk_index = models.PositiveIntegerField()
+    byte_start = models.BigIntegerField()
+    byte_end = models.BigIntegerField()
+    rows = models.PositiveIntegerField()
+    completed_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['source', 'chunk_index'],
+                                    name='unique_import_chunk'),
+        ]
+
+
+class ImportedRow(models.Model):
+    """
+    Ledger entry of a delta import: the order a source row was loaded as and
+    a fingerprint of the columns it was loaded from, so a later import of an
+    updated export can tell new, changed and unchanged rows apart.
+    """
+    ledger = models.CharField(max_length=64)
+    row_key = models.CharField(max_length=64)
+    fingerprint = models.CharField(max_length=64)
+    # Null once the order has been deleted; the row is then only re-imported
+    # if its source data changes
+    order = models.ForeignKey(Order, null=True, on_delete=models.SET_NULL)
+    imported_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['ledger', 'row_key'],
+                                    name='unique_imported_row'),
+        ]
+
+
+class Job(models.Model):
+    """
+    A unit of background work for `manage.py run_workers` (see
+    ecommerce.jobs). Workers take the highest-priority ready job under a
+    lease, so a job whose worker died is picked up again once the lease
+    expires, and failed jobs are retried with backoff up to max_attempts.
+    """
+    class Status(models.TextChoices):
+        QUEUED = 'queued', _('Queued')
+        RUNNING = 'running', _('Running')
+        SUCCEEDED = 'succeeded', _('Succeeded')
+        FAILED = 'failed', _('Failed')
+
+    task = models.CharField(max_length=100)
+    args = models.JSONField(default=list, blank=True)
+    # Higher runs first
+    priority = models.SmallIntegerField(default=0)
+    # At most one queued or running job per key
+    dedupe_key = models.CharField(max_length=200, null=True, blank=True)
+    status = models.CharField(max_length=20, choices=Status.choices, default=Status.QUEUED)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=3)
+    run_after = models.DateTimeField(default=timezone.now)
+    lease_expires = models.DateTimeField(null=True, blank=True)
+    worker = models.CharField(max_length=100, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    # Seconds the last attempt took
+    runtime = models.FloatField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['dedupe_key'],
+                                    condition=models.Q(status__in=['queued', 'running']),
+                                    name='unique_active_job'),
+        ]
+        indexes = [
+            # The next job to claim
+            models.Index(fields=['-priority', 'run_after', 'id'],
+                         condition=models.Q(status='queued'), name='job_ready_idx'),
+            # Leases to recover
+            models.Index(fields=['lease_expires'],
+                         condition=models.Q(status='running'), name='job_lease_idx'),
+            models.Index(fields=['finished_at'], name='job_finished_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.task}{tuple(self.args)} [{self.status}]'
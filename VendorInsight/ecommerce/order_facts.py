@@ -0,0 +1,215 @@
+"""
+A columnar copy of the order lines for the analytics code: one row per
+line with its order date, order, customer, vendor, product, categories,
+quantity and price, written by `manage.py export_order_facts` as one file
+per UTC month under ORDER_FACTS_DIR (month=YYYY-MM/part.parquet, or
+part.arrow for the Arrow IPC format). Months rather than days keep the
+files few and large enough for reads not to be dominated by per-file
+overhead.
+
+Exports are incremental, and every refresh_vendor_analytics job runs one
+before forecasting, so the files are as current as the analytics. A
+month's file is rewritten only when the month's line count, last line id,
+quantity or status counts changed since the last export. Changes those
+numbers do not show (a product moved to another category) need --since or
+--full. Readers memory-map the files and read only the columns and rows
+they need. Until a first export exists, they fall back to the database.
+"""
+import contextlib
+import json
+import os
+import shutil
+from datetime import datetime, timezone as dt_timezone
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.feather as feather
+import pyarrow.fs as pafs
+import pyarrow.parquet as pq
+from django.conf import settings
+from django.db.models import Count, Max, Q, Sum
+from django.db.models.functions import TruncMonth
+
+from .models import OrderDetails, Product
+
+MANIFEST = '_manifest.json'
+FORMATS = {'parquet': 'part.parquet', 'arrow': 'part.arrow'}
+
+SCHEMA = pa.schema([
+    ('line_id', pa.int64()),
+    ('order_id', pa.int64()),
+    ('order_date', pa.timestamp('us', tz='UTC')),
+    ('status', pa.dictionary(pa.int8(), pa.string())),
+    ('customer_id', pa.int64()),
+    ('vendor_id', pa.int64()),
+    ('product_id', pa.int64()),
+    ('category_ids', pa.list_(pa.int64())),
+    ('quantity', pa.int32()),
+    ('price', pa.float64()),
+])
+
+
+def facts_dir():
+    return str(getattr(settings, 'ORDER_FACTS_DIR', os.path.join(settings.BASE_DIR, 'order_facts')))
+
+
+def load_manifest(directory):
+    try:
+        with open(os.path.join(directory, MANIFEST)) as manifest_file:
+            return json.load(manifest_file)
+    except FileNotFoundError:
+        return None
+
+
+def month_fingerprints():
+    """{'YYYY-MM': [lines, last line id, quantity, completed, canceled]} per UTC month."""
+    rows = OrderDetails.objects.annotate(
+        month=TruncMonth('order__order_date', tzinfo=dt_timezone.utc),
+    ).values('month').annotate(
+        lines=Count('id'), last_line=Max('id'), quantity=Sum('quantity'),
+        completed=Count('id', filter=Q(order__status='Completed')),
+        canceled=Count('id', filter=Q(order__status='Canceled')),
+    ).order_by('month')
+    return {row['month'].strftime('%Y-%m'): [row['lines'], row['last_line'], row['quantity'],
+                                     row['completed'], row['canceled']] for row in rows}
+
+
+def month_table(month, categories):
+    """The facts of one UTC month ('YYYY-MM') as an Arrow table. `categories` caches product -> category ids."""
+    start = datetime.strptime(month, '%Y-%m').replace(tzinfo=dt_timezone.utc)
+    end = start.replace(year=start.year + start.month // 12, month=start.month % 12 + 1)
+    lines = list(OrderDetails.objects.filter(
+        order__order_date__gte=start, order__order_date__lt=end,
+    ).order_by('id').values_list(
+        'id', 'order_id', 'order__order_date', 'order__status', 'order__user_id',
+        'product__user_id', 'product_id', 'quantity', 'price'))
+
+    missing = {line[6] for line in lines} - categories.keys()
+    for product_id in missing:
+        categories[product_id] = []
+    for product_id, category_id in Product.categories.through.objects.filter(
+            product_id__in=missing).order_by('category_id').values_list('product_id', 'category_id'):
+        categories[product_id].append(category_id)
+
+    columns = list(zip(*lines)) or [()] * 9
+    return pa.table({
+        'line_id': columns[0],
+        'order_id': columns[1],
+        'order_date': columns[2],
+        'status': pa.array(columns[3], pa.string()).dictionary_encode(),
+        'customer_id': columns[4],
+        'vendor_id': columns[5],
+        'product_id': columns[6],
+        'category_ids': [categories[product_id] for product_id in columns[6]],
+        'quantity': columns[7],
+        'price': [float(price) for price in columns[8]],
+    }, schema=SCHEMA)
+
+
+def write_table(table, path, file_format):
+    # Written next to the target and renamed over it, so readers never see
+    # a partial file (the dot keeps readers from picking the temporary up).
+    # Named per process, as workers refreshing analytics may export at once.
+    temporary = os.path.join(os.path.dirname(path), f'.{os.path.basename(path)}.{os.getpid()}.tmp')
+    if file_format == 'parquet':
+        pq.write_table(table, temporary, compression='zstd')
+    else:
+        # Uncompressed, so memory-mapped reads need no decoding
+        feather.write_feather(table, temporary, compression='uncompressed')
+    os.replace(temporary, path)
+
+
+def export(directory=None, file_format=None, full=False, since=None, stdout=None):
+    """
+    Writes the months whose fingerprint changed since the last export
+    (every month with `full`, and every month from the one holding `since`
+    on), removes the months that no longer have lines, and records the
+    fingerprints in the manifest. Switching format rewrites everything;
+    without `file_format` the last export's (or Parquet) is kept.
+    Returns (written, removed, unchanged) month counts.
+    """
+    directory = directory or facts_dir()
+    os.makedirs(directory, exist_ok=True)
+    manifest = load_manifest(directory)
+    file_format = file_format or (manifest or {}).get('format', 'parquet')
+    if manifest is None or manifest.get('format') != file_format:
+        full = True
+    previous = {} if full else manifest['months']
+    current = month_fingerprints()
+
+    written = 0
+    categories = {}
+    for month, fingerprint in current.items():
+        if previous.get(month) == fingerprint and not (since and month >= since.strftime('%Y-%m')):
+            continue
+        partition = os.path.join(directory, f'month={month}')
+        os.makedirs(partition, exist_ok=True)
+        for name in FORMATS.values():
+            if name != FORMATS[file_format]:
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(os.path.join(partition, name))
+        write_table(month_table(month, categories),
+                    os.path.join(partition, FORMATS[file_format]), file_format)
+        written += 1
+        if stdout is not None:
+            stdout.write(f'  {month}: {fingerprint[0]} lines')
+
+    removed = 0
+    for entry in os.scandir(directory):
+        if entry.is_dir() and entry.name.startswith('month=') and entry.name[6:] not in current:
+            shutil.rmtree(entry.path, ignore_errors=True)
+            removed += 1
+
+    temporary = os.path.join(directory, f'{MANIFEST}.{os.getpid()}.tmp')
+    with open(temporary, 'w') as manifest_file:
+        json.dump({'format': file_format, 'months': current,
+                   'exported_at': datetime.now(dt_timezone.utc).isoformat()}, manifest_file)
+    os.replace(temporary, os.path.join(directory, MANIFEST))
+    return written, removed, len(current) - written
+
+
+def read_facts(columns, filter=None, directory=None):
+    """
+    The given columns of the exported facts matching `filter` (a
+    pyarrow.dataset expression) as an Arrow table, read through memory
+    maps. None when nothing has been exported yet.
+    """
+    directory = directory or facts_dir()
+    manifest = load_manifest(directory)
+    if manifest is None:
+        return None
+    dataset = ds.dataset(
+        directory, schema=SCHEMA, partitioning='hive',
+        format='parquet' if manifest['format'] == 'parquet' else 'ipc',
+        filesystem=pafs.LocalFileSystem(use_mmap=True),
+        exclude_invalid_files=False, ignore_prefixes=['_', '.'])
+    return dataset.to_table(columns=columns, filter=filter)
+
+
+def category_sales():
+    """One row per (order line, category) with order_date, category_id and sales."""
+    table = read_facts(['order_date', 'category_ids', 'price', 'quantity'])
+    if table is None:
+        frame = pd.DataFrame(list(OrderDetails.objects.values_list(
+            'order__order_date', 'product__categories', 'price', 'quantity')),
+            columns=['order_date', 'category_id', 'price', 'quantity'])
+        frame['price'] = frame['price'].astype(float)
+    else:
+        frame = table.to_pandas().explode('category_ids').rename(
+            columns={'category_ids': 'category_id'})
+    frame = frame.dropna(subset=['category_id']).astype({'category_id': 'int64'})
+    frame['sales'] = frame['price'] * frame['quantity']
+    return frame[['order_date', 'category_id', 'sales']]
+
+
+def product_sales(product_ids):
+    """One row per order line of the given products with product_id, order_date and quantity."""
+    product_ids = list(product_ids)
+    table = read_facts(['product_id', 'order_date', 'quantity'],
+                       filter=ds.field('product_id').isin(product_ids))
+    if table is None:
+        return pd.DataFrame(list(OrderDetails.objects.filter(
+            product_id__in=product_ids).values_list('product_id', 'order__order_date', 'quantity')),
+            columns=['product_id', 'order_date', 'quantity'])
+    return table.to_pandas()
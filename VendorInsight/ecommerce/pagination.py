@@ -0,0 +1,228 @@
+import base64
+import binascii
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.exceptions import ValidationError
+from django.db.models import Q, QuerySet
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+class CursorPage:
+    """
+    One page of a CursorPaginator. Iterates like a Paginator page, but exposes
+    opaque next/previous tokens instead of page numbers.
+    """
+
+    def __init__(self, object_list, paginator, next_token, previous_token):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.next_token = next_token
+        self.previous_token = previous_token
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_token is not None
+
+    def has_previous(self):
+        return self.previous_token is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class CursorPaginator:
+    """
+    Keyset paginator over a stable ordering, e.g. ('price', 'id') or
+    ('-order_date', '-id'). The last field must be unique so every row has a
+    distinct position. Each page is fetched with a WHERE on the sort key and a
+    LIMIT, so deep pages cost the same as the first one.
+
+    Works on querysets and on plain lists of objects or dicts (the latter is
+    used for the cached analytics rows).
+    """
+
+    def __init__(self, object_list, per_page, ordering, count_cap=1000):
+        self.object_list = object_list
+        self.per_page = int(per_page)
+        self.ordering = tuple(ordering)
+        self.count_cap = count_cap
+        self.fields = [f.lstrip('-') for f in self.ordering]
+        self.descending = [f.startswith('-') for f in self.ordering]
+        self._count = None
+
+    # Tokens
+
+    def encode_cursor(self, values, direction):
+        payload = {'o': list(self.ordering), 'd': direction, 'k': values}
+        raw = json.dumps(payload, cls=DjangoJSONEncoder,
+                         separators=(',', ':')).encode()
+        return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+    def decode_cursor(self, token):
+        try:
+            padded = token + '=' * (-len(token) % 4)
+            payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+            ordering, direction, values = payload['o'], payload['d'], payload['k']
+        except (binascii.Error, ValueError, TypeError, KeyError):
+            raise InvalidCursor(token)
+        # A token minted for another sort order would point at a meaningless position.
+        if not isinstance(ordering, list) or tuple(ordering) != self.ordering \
+                or direction not in ('n', 'p') or not isinstance(values, list) \
+                or len(values) != len(self.fields) or None in values:
+            raise InvalidCursor(token)
+        if isinstance(self.object_list, QuerySet):
+            opts = self.object_list.model._meta
+            try:
+                values = [opts.get_field(name).to_python(value)
+                          for name, value in zip(self.fields, values)]
+            except (ValidationError, TypeError, ValueError):
+                raise InvalidCursor(token)
+        elif self.object_list:
+            # The key must at least compare with the rows' keys. Only the
+            # TypeError matters here: comparing incomparable types raises it
+            row_key = self._key(self.object_list[0])
+            try:
+                _ = [row_value < value for row_value, value in zip(row_key, values)]
+            except TypeError:
+                raise InvalidCursor(token)
+        return direction, values
+
+    def _key(self, obj):
+        if isinstance(obj, dict):
+            return [obj[name] for name in self.fields]
+        return [getattr(obj, name) for name in self.fields]
+
+    # Filtering
+
+    def _position_q(self, values, forward):
+        """
+        Build (a > x) OR (a = x AND b > y) ... for the given key, flipping the
+        comparison per field for descending fields and for backwards paging.
+        """
+        q = Q()
+        for i, name in enumerate(self.fields):
+            use_lt = self.descending[i] == forward
+            clause = Q(**{f'{name}__{"lt" if use_lt else "gt"}': values[i]})
+            for j in range(i):
+                clause &= Q(**{self.fields[j]: values[j]})
+            q |= clause
+        return q
+
+    def _is_past(self, key, values, forward):
+        for i, (a, b) in enumerate(zip(key, values)):
+            if a == b:
+                continue
+            use_lt = self.descending[i] == forward
+            return (a > b) != use_lt
+        return False
+
+    def _fetch(self, values, forward):
+        if isinstance(self.object_list, QuerySet):
+            return list(self._page_queryset(values, forward))
+
+        rows = sorted(self.object_list, key=self.sort_key, reverse=not forward)
+        if values is not None:
+            rows = [row for row in rows
+                    if self._is_past(self._key(row), values, forward)]
+        return rows[:self.per_page + 1]
+
+    def _page_queryset(self, values, forward):
+        ordering = self.ordering if forward else tuple(
+            f[1:] if f.startswith('-') else '-' + f for f in self.ordering)
+        qs = self.object_list.order_by(*ordering)
+        if values is not None:
+            qs = qs.filter(self._position_q(values, forward))
+        return qs[:self.per_page + 1]
+
+    def sort_key(self, obj):
+        return tuple(_Reversed(v) if desc else v
+                     for v, desc in zip(self._key(obj), self.descending))
+
+    # Public API
+
+    def _parse_token(self, token):
+        if token:
+            try:
+                return self.decode_cursor(token)
+            except InvalidCursor:
+                pass
+        return 'n', None
+
+    def get_page(self, token=None):
+        """
+        Return the page addressed by `token`. A missing or invalid token
+        returns the first page, mirroring Paginator.get_page.
+        """
+        direction, values = self._parse_token(token)
+        forward = direction == 'n'
+        return self.build_page(self._fetch(values, forward), (forward, values))
+
+    def page_queryset(self, token=None):
+        """
+        The unevaluated LIMITed queryset for `token` plus the state to pass to
+        build_page. Lets callers combine several pages into one statement.
+        Rows handed back to build_page must be in the queryset's order.
+        """
+        direction, values = self._parse_token(token)
+        forward = direction == 'n'
+        return self._page_queryset(values, forward), (forward, values)
+
+    def build_page(self, rows, state):
+        forward, values = state
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if not forward:
+            rows.reverse()
+
+        next_token = previous_token = None
+        if rows:
+            first, last = self._key(rows[0]), self._key(rows[-1])
+            if (has_more if forward else values is not None):
+                next_token = self.encode_cursor(last, 'n')
+            if (values is not None if forward else has_more):
+                previous_token = self.encode_cursor(first, 'p')
+        return CursorPage(rows, self, next_token, previous_token)
+
+    @property
+    def count(self):
+        """
+        Row count capped at `count_cap`. The capped COUNT runs over a LIMITed
+        subquery, so it stays cheap on large tables; use `count_is_capped` to
+        render e.g. "1000+".
+        """
+        if self._count is None:
+            if isinstance(self.object_list, QuerySet):
+                self._count = self.object_list.order_by()[
+                    :self.count_cap + 1].count()
+            else:
+                self._count = len(self.object_list)
+        return min(self._count, self.count_cap)
+
+    @property
+    def count_is_capped(self):
+        return self.count == self.count_cap and self._count > self.count_cap
+
+
+class _Reversed:
+    """Sort wrapper that inverts comparisons, for descending keys in lists."""
+
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+    def __lt__(self, other):
+        return self.value > other.value
@@ -0,0 +1,268 @@
+import cProfile
+import io
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.urls import reverse
+
+PROFILE_PARAM = '_profile'
+PROFILE_HEADER = 'HTTP_X_PROFILE'
+MODES = ('cprofile', 'sample')
+
+
+def profile_dir():
+    return str(getattr(settings, 'PROFILE_DIR', os.path.join(settings.BASE_DIR, 'profiles')))
+
+
+def profile_path(profile_id, extension):
+    # Ids are uuid4 hex strings, so they cannot point outside the directory
+    return os.path.join(profile_dir(), f'{uuid.UUID(profile_id).hex}.{extension}')
+
+
+def requested_mode(request):
+    """'cprofile' or 'sample' when the request asks to be profiled, else None."""
+    value = request.GET.get(PROFILE_PARAM) or request.META.get(PROFILE_HEADER)
+    if not value:
+        return None
+    return value if value in MODES else 'cprofile'
+
+
+def take_slot():
+    """
+    Counts one profile against the global PROFILER_MAX_PER_HOUR budget,
+    shared by every worker through the cache. False once it is spent.
+    """
+    key = f'profiler:slots:{int(time.time() // 3600)}'
+    cache.add(key, 0, timeout=3600)
+    try:
+        return cache.incr(key) <= getattr(settings, 'PROFILER_MAX_PER_HOUR', 20)
+    except ValueError:
+        # The window expired between add() and incr()
+        return False
+
+
+class StackSampler:
+    """
+    Records the Python stacks of the given threads (every other thread when
+    None) every `interval` seconds from a background thread. Unlike
+    cProfile it adds no cost to the profiled code, so the timings stay
+    realistic. Samples are kept in the "folded" format flamegraph.pl and
+    speedscope read: one line per distinct stack with its count.
+    """
+
+    def __init__(self, thread_ids=None, interval=0.005):
+        self.thread_ids = thread_ids
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        return False
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id or (self.thread_ids is not None
+                                           and thread_id not in self.thread_ids):
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{code.co_name} ({code.co_filename}:{code.co_firstlineno})')
+                    frame = frame.f_back
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def folded(self):
+        return ''.join(f'{stack} {count}\n' for stack, count in self.stacks.most_common())
+
+
+def top_sampled(folded, limit):
+    """Functions by the share of samples they were on the stack in, and at the top of."""
+    total, inclusive, own = 0, Counter(), Counter()
+    for line in folded.splitlines():
+        stack, _, count = line.rpartition(' ')
+        frames, count = stack.split(';'), int(count)
+        total += count
+        own[frames[-1]] += count
+        for name in set(frames):
+            inclusive[name] += count
+    if not total:
+        return 'No samples; the request was shorter than the sampling interval.\n'
+    lines = [f'{total} samples', f'{"cumulative":>12} {"self":>8}  function']
+    for name, count in inclusive.most_common(limit):
+        lines.append(f'{count / total:11.1%} {own[name] / total:8.1%}  {name}')
+    return '\n'.join(lines) + '\n'
+
+
+def top_profiled(path, limit, sort='cumulative'):
+    out = io.StringIO()
+    pstats.Stats(path, stream=out).sort_stats(sort).print_stats(limit)
+    return out.getvalue()
+
+
+def save_profile(profile_id, result, meta):
+    """
+    Writes the profile (<id>.prof for cProfile, <id>.folded for samples) and
+    its <id>.json metadata, then drops the oldest profiles beyond
+    PROFILER_KEEP.
+    """
+    os.makedirs(profile_dir(), exist_ok=True)
+    if isinstance(result, cProfile.Profile):
+        result.dump_stats(profile_path(profile_id, 'prof'))
+    else:
+        with open(profile_path(profile_id, 'folded'), 'w') as folded_file:
+            folded_file.write(result.folded())
+    with open(profile_path(profile_id, 'json'), 'w') as meta_file:
+        json.dump(meta, meta_file)
+    prune(getattr(settings, 'PROFILER_KEEP', 200))
+
+
+def prune(keep):
+    directory = profile_dir()
+    metas = sorted((entry for entry in os.scandir(directory) if entry.name.endswith('.json')),
+                   key=lambda entry: entry.stat().st_mtime, reverse=True)
+    for entry in metas[keep:]:
+        profile_id = entry.name[:-len('.json')]
+        for extension in ('json', 'prof', 'folded'):
+            try:
+                os.remove(os.path.join(directory, f'{profile_id}.{extension}'))
+            except FileNotFoundError:
+                pass
+
+
+def load_profile(profile_id):
+    """The metadata of a saved profile, or None."""
+    try:
+        with open(profile_path(profile_id, 'json')) as meta_file:
+            return json.load(meta_file)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def report(profile_id, limit=30):
+    """Top `limit` functions of a saved profile as text, or None."""
+    meta = load_profile(profile_id)
+    if meta is None:
+        return None
+    header = (f"{meta['method']} {meta['path']} -> {meta['status']} in {meta['ms']}ms "
+              f"({meta['mode']}, {meta['user']}, {meta['created']})\n\n")
+    if meta['mode'] == 'cprofile':
+        return header + top_profiled(profile_path(profile_id, 'prof'), limit)
+    with open(profile_path(profile_id, 'folded')) as folded_file:
+        return header + top_sampled(folded_file.read(), limit)
+
+
+class OnDemandProfilerMiddleware:
+    """
+    Profiles a single request when a staff user asks for it with
+    ?_profile=cprofile (or 1) or ?_profile=sample, or the same values in an
+    X-Profile header:
+
+    - cprofile runs the request under cProfile. It gives exact call counts,
+      but every function call costs more, so times are inflated.
+    - sample records the stack every PROFILER_SAMPLE_INTERVAL seconds, at
+      almost no cost to the request.
+
+    The profile is saved under PROFILE_DIR with a unique id. The response
+    carries X-Profile-Id and X-Profile-Url headers, which point at the
+    profile_report view (top functions, or the raw .prof / folded file for
+    snakeviz or a flamegraph). PROFILER_MAX_PER_HOUR caps profiles across
+    all workers; requests over it are served unprofiled with
+    "X-Profile: rate-limited".
+
+    Under ASGI, cProfile only sees the event loop thread, where other
+    requests' coroutines also run. There, sampling covers every thread
+    instead.
+
+    Goes after AuthenticationMiddleware. Requests without the switch only
+    pay for one lookup in request.GET and one in request.META.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        mode = requested_mode(request)
+        if mode is None or not request.user.is_staff:
+            return self.get_response(request)
+        if not take_slot():
+            return self.rate_limited(self.get_response(request))
+
+        started = time.perf_counter()
+        if mode == 'cprofile':
+            result = cProfile.Profile()
+            response = result.runcall(self.get_response, request)
+        else:
+            with self.sampler({threading.get_ident()}) as result:
+                response = self.get_response(request)
+        return self.finish(request, response, mode, result, started)
+
+    async def __acall__(self, request):
+        mode = requested_mode(request)
+        if mode is None or not await sync_to_async(lambda: request.user.is_staff)():
+            return await self.get_response(request)
+        if not await sync_to_async(take_slot)():
+            return self.rate_limited(await self.get_response(request))
+
+        started = time.perf_counter()
+        if mode == 'cprofile':
+            result = cProfile.Profile()
+            result.enable()
+            try:
+                response = await self.get_response(request)
+            finally:
+                result.disable()
+        else:
+            # The work may happen on the request's sync thread or the
+            # recommender pool as well as on the event loop
+            with self.sampler(None) as result:
+                response = await self.get_response(request)
+        return await sync_to_async(self.finish, thread_sensitive=False)(
+            request, response, mode, result, started)
+
+    def sampler(self, thread_ids):
+        return StackSampler(thread_ids, getattr(settings, 'PROFILER_SAMPLE_INTERVAL', 0.005))
+
+    def rate_limited(self, response):
+        response['X-Profile'] = 'rate-limited'
+        return response
+
+    def finish(self, request, response, mode, result, started):
+        profile_id = uuid.uuid4().hex
+        save_profile(profile_id, result, {
+            'id': profile_id,
+            'mode': mode,
+            'method': request.method,
+            'path': request.get_full_path(),
+            'view': getattr(getattr(request, 'resolver_match', None), 'view_name', None),
+            'status': response.status_code,
+            'ms': round((time.perf_counter() - started) * 1000, 2),
+            'user': request.user.get_username(),
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        })
+        response['X-Profile-Id'] = profile_id
+        response['X-Profile-Url'] = reverse('profile_report', args=[profile_id])
+        return response
@@ -1,11 +1,20 @@
+import logging
+
 from sklearn.metrics.pairwise import cosine_similarity
 from sklearn.feature_extraction.text import TfidfVectorizer
 from .models import Product, UserInteraction, User
+from .routers import read_replica
+from .instrumentation import span
 import numpy as np
 
+logger = logging.getLogger(__name__)
+
 
+@read_replica()
 def get_product_features():
-    products = Product.objects.all()
+    # Categories and reviews are prefetched so building the corpus is two
+    # extra queries instead of two per product
+    products = Product.objects.prefetch_related('categories', 'productreview_set')
     features = []
     for product in products:
         # Combine textual data and normalize price
@@ -14,23 +23,29 @@ def get_product_features():
     return features, [product.id for product in products]
 
 
+@read_replica()
 def get_user_product_matrix():
-    users = User.objects.all()
-    products = Product.objects.all()
-
-    user_product_matrix = np.zeros((users.count(), products.count()))
-
-    for i, user in enumerate(users):
-        user_interactions = UserInteraction.objects.filter(user=user)
-        for interaction in user_interactions:
-            product_index = list(products).index(interaction.product)
-            interaction_weight = {'view': 1, 'wishlist': 2,
-                                  'purchase': 3}[interaction.interaction_type]
-            user_product_matrix[i, product_index] = interaction_weight
+    users = list(User.objects.all())
+    products = list(Product.objects.all())
+    user_index = {user.id: i for i, user in enumerate(users)}
+    product_index = {product.id: j for j, product in enumerate(products)}
+
+    user_product_matrix = np.zeros((len(users), len(products)))
+
+    # One pass over the interaction ids instead of a query per user and a
+    # product lookup per interaction
+    interactions = UserInteraction.objects.order_by('id').values_list(
+        'user_id', 'product_id', 'interaction_type')
+    for user_id, product_id, interaction_type in interactions.iterator():
+        interaction_weight = {'view': 1, 'wishlist': 2,
+                              'purchase': 3}[interaction_type]
+        user_product_matrix[user_index[user_id],
+                            product_index[product_id]] = interaction_weight
 
     return user_product_matrix, users, products
 
 
+@span('recommender')
 def recommend_products_content_based(product_id, num_recommendations=5):
     features, product_ids = get_product_features()
     vectorizer = TfidfVectorizer(stop_words='english')
@@ -44,38 +59,42 @@ def recommend_products_content_based(product_id, num_recommendations=5):
     # Exclude the product itself
     recommended_product_ids = [product_ids[i]
                                for i in related_product_indices if i != product_idx]
-    return Product.objects.filter(id__in=recommended_product_ids)
+    return Product.objects.filter(id__in=recommended_product_ids).with_card_data()
 
 
+@span('recommender')
 def recommend_products_collaborative(user_id, num_recommendations=5):
     user_product_matrix, users, products = get_user_product_matrix()
-    user_index = list(users).index(User.objects.get(id=user_id))
+    user_index = [user.id for user in users].index(user_id)
 
-    print("User index:", user_index)
-    print("User interactions:", user_product_matrix[user_index])
+    logger.debug('User index: %s, interactions: %s', user_index, user_product_matrix[user_index])
 
     if user_product_matrix[user_index].sum() == 0:
-        print("User has no interactions")
+        logger.debug('User %s has no interactions', user_id)
         return []
 
     user_similarities = cosine_similarity(user_product_matrix)
     similar_users_indices = user_similarities[user_index].argsort()[
         ::-1][1:num_recommendations+1]
 
-    print("Similar user indices:", similar_users_indices)
+    logger.debug('Similar user indices: %s', similar_users_indices)
 
     similar_users_product_scores = user_product_matrix[similar_users_indices].sum(
         axis=0)
     top_product_indices = similar_users_product_scores.argsort()[
         ::-1][:num_recommendations]
 
-    print("Top product indices:", top_product_indices)
+    logger.debug('Top product indices: %s', top_product_indices)
 
-    collaborative_recommendations = [products[i]
-                                     for i in top_product_indices.tolist()]
+    # Reload just the recommended products with their card data
+    top_product_ids = [products[i].id for i in top_product_indices.tolist()]
+    cards = Product.objects.with_card_data().in_bulk(top_product_ids)
+    collaborative_recommendations = [cards[product_id]
+                                     for product_id in top_product_ids]
     return collaborative_recommendations
 
 
+@span('recommender')
 def recommend_products(product_id, user_id=None, num_recommendations=5):
     content_based_recommendations = recommend_products_content_based(
         product_id, num_recommendations)
@@ -0,0 +1,129 @@
+from contextlib import ContextDecorator
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+# True inside read_replica(); reads may then go to the replica
+_replica_reads = ContextVar('replica_reads', default=False)
+# [True] once the current request (or one shortly before it) has written, so
+# its reads stay on the primary until the replica has caught up. A mutable
+# cell rather than a bool, so a write made in a copied context (a task of
+# asyncio.gather, a thread pool) still pins the whole request.
+_pinned = ContextVar('pinned_to_primary', default=None)
+
+PIN_COOKIE = 'pin_primary'
+
+
+def replica_alias():
+    """The configured replica alias, or None when there is no replica."""
+    alias = getattr(settings, 'REPLICA_DATABASE', None)
+    return alias if alias in settings.DATABASES else None
+
+
+def pin_to_primary():
+    pin = _pinned.get()
+    if pin is None:
+        _pinned.set([True])
+    else:
+        pin[0] = True
+
+
+def is_pinned():
+    pin = _pinned.get()
+    return pin is not None and pin[0]
+
+
+class read_replica(ContextDecorator):
+    """
+    Sends the reads made inside it to the replica, as a context manager or
+    a decorator:
+
+        @read_replica()
+        def get_user_product_matrix(): ...
+
+        with read_replica():
+            rows = list(OrderDetails.objects.filter(...))
+
+    Reads still use the primary when the request has written (see
+    ReplicaPinningMiddleware) or a transaction is open on the primary.
+    """
+
+    def __enter__(self):
+        self._token = _replica_reads.set(True)
+        return self
+
+    def __exit__(self, *exc_info):
+        _replica_reads.reset(self._token)
+        return False
+
+    def _recreate_cm(self):
+        # A fresh instance per call, so the decorated function is reentrant
+        # and safe to call from several threads at once
+        return type(self)()
+
+
+class ReplicaRouter:
+    """
+    Routes reads made inside read_replica() to settings.REPLICA_DATABASE and
+    everything else to the primary. Any write pins the rest of the request
+    to the primary (read-your-writes). Migrations only run on the primary;
+    the replica gets its schema through replication (or TEST['MIRROR']).
+    """
+
+    def db_for_read(self, model, **hints):
+        alias = replica_alias()
+        if (alias is None or not _replica_reads.get() or is_pinned()
+                or connections[DEFAULT_DB_ALIAS].in_atomic_block):
+            return DEFAULT_DB_ALIAS
+        return alias
+
+    def db_for_write(self, model, **hints):
+        pin_to_primary()
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both aliases hold the same data
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db != replica_alias()
+
+
+class ReplicaPinningMiddleware:
+    """
+    Starts every request unpinned, unless a recent response set the pin
+    cookie, and sets that cookie for REPLICA_PIN_SECONDS after a request
+    that wrote, so the next page the user loads still reads their writes
+    while the replica catches up.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = _pinned.set([PIN_COOKIE in request.COOKIES])
+        try:
+            return self.set_pin_cookie(request, self.get_response(request))
+        finally:
+            _pinned.reset(token)
+
+    async def __acall__(self, request):
+        token = _pinned.set([PIN_COOKIE in request.COOKIES])
+        try:
+            return self.set_pin_cookie(request, await self.get_response(request))
+        finally:
+            _pinned.reset(token)
+
+    def set_pin_cookie(self, request, response):
+        if is_pinned() and PIN_COOKIE not in request.COOKIES:
+            response.set_cookie(PIN_COOKIE, '1', httponly=True, samesite='Lax',
+                                max_age=getattr(settings, 'REPLICA_PIN_SECONDS', 5))
+        return response
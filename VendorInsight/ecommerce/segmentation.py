@@ -0,0 +1,73 @@
+import pandas as pd
+from django.utils import timezone
+from sklearn.cluster import KMeans
+from sklearn.compose import ColumnTransformer
+from sklearn.decomposition import PCA
+from sklearn.preprocessing import StandardScaler, OneHotEncoder
+
+from .models import CustomerFeatures
+
+SEGMENTS = 4
+
+
+def segment_customers(vendor):
+    """
+    K-means segments of the vendor's customers with a PCA projection for
+    plotting. Returns the points, the cluster labels and per-cluster
+    averages as plain lists, ready for the template; all three are empty
+    while the vendor has fewer customers than SEGMENTS.
+    """
+    # One row per customer from the feature table (see customer_features.py)
+    # rather than re-aggregating their order history
+    rows = CustomerFeatures.objects.filter(
+        vendor=vendor, customer__userprofile__isnull=False,
+    ).values_list('customer_id', 'customer__userprofile__date_of_birth',
+                  'customer__userprofile__gender', 'total_spent', 'order_count',
+                  'top_category__name')
+
+    today = timezone.now().date()
+    customer_data = [{
+        'user_id': customer_id,
+        'age': (today - date_of_birth).days // 365,
+        'total_order_amount': total_spent,
+        'order_frequency': order_count,
+        'gender': gender,
+        'most_ordered_category': top_category,
+    } for customer_id, date_of_birth, gender, total_spent, order_count, top_category in rows]
+    if len(customer_data) < SEGMENTS:
+        return {'data': [], 'clusters': [], 'cluster_averages': []}
+
+    features_df = pd.DataFrame(customer_data)
+    preprocessor = ColumnTransformer(
+        transformers=[
+            ('num', StandardScaler(), [
+             'age', 'total_order_amount', 'order_frequency']),
+            ('cat', OneHotEncoder(), ['gender', 'most_ordered_category'])
+        ],
+        # Always a dense matrix; the output is only sparse for some data
+        sparse_threshold=0)
+    X_processed = preprocessor.fit_transform(features_df)
+
+    kmeans = KMeans(n_clusters=SEGMENTS, random_state=42)
+    clusters = kmeans.fit_predict(X_processed)
+    features_df['cluster'] = clusters
+
+    # Perform PCA for 2D visualization
+    pca = PCA(n_components=3)
+    X_pca = pca.fit_transform(X_processed)
+    features_df['pca_x'] = X_pca[:, 0]
+    features_df['pca_y'] = X_pca[:, 1]
+
+    cluster_averages = features_df.groupby('cluster').agg({
+        'age': 'mean',
+        'total_order_amount': 'mean',
+        'order_frequency': 'mean',
+        'gender': lambda x: x.mode()[0],
+        'most_ordered_category': lambda x: x.mode()[0]
+    }).reset_index()
+
+    return {
+        'data': features_df[['pca_x', 'pca_y', 'cluster']].to_dict(orient='records'),
+        'clusters': features_df['cluster'].unique().tolist(),
+        'cluster_averages': cluster_averages.to_dict(orient='records'),
+    }
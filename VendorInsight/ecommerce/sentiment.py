@@ -0,0 +1,25 @@
+from functools import lru_cache
+
+from .instrumentation import span
+
+EMOTION_MODEL = 'bhadresh-savani/distilbert-base-uncased-emotion'
+
+
+@lru_cache(maxsize=None)
+def get_classifier():
+    """
+    The emotion classifier, loaded on first use. transformers (and torch)
+    are only imported here, so processes that never classify a review do
+    not pay for them.
+    """
+    from transformers import pipeline
+    return pipeline("text-classification", model=EMOTION_MODEL, return_all_scores=False)
+
+
+def analyze_and_update_review_sentiment(review):
+    # Perform sentiment analysis
+    with span('sentiment'):
+        prediction = get_classifier()(review.comment)
+    # Assuming the highest score sentiment is what we want
+    review.sentiment = prediction[0]['label']
+    review.save()
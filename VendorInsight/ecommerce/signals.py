@@ -0,0 +1,79 @@
+from django.db.models.signals import post_save, post_delete, pre_delete, m2m_changed
+from django.dispatch import receiver
+
+from .catalog_versions import bump_product_versions, bump_category_version
+from .customer_features import refresh_customers_on_commit, refresh_orders_on_commit
+from .images import generate_derivatives
+from .models import Product, ProductImage, Discount, Category, Order, OrderDetails
+from .vendor_orders import link_vendor_orders, sync_vendor_orders
+
+# Fields that never appear in a rendered product card
+UNRENDERED_PRODUCT_FIELDS = {'total_views'}
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def product_changed(sender, instance, update_fields=None, **kwargs):
+    if update_fields and set(update_fields) <= UNRENDERED_PRODUCT_FIELDS:
+        return
+    bump_product_versions([instance.pk])
+
+
+@receiver(m2m_changed, sender=Product.categories.through)
+def product_categories_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if reverse:
+        bump_product_versions(pk_set or [])
+    else:
+        bump_product_versions([instance.pk])
+
+
+@receiver(post_save, sender=ProductImage)
+def product_image_saved(sender, instance, **kwargs):
+    # Derivatives first, so the re-rendered card already points at them
+    if not instance.derivatives:
+        generate_derivatives(instance)
+    bump_product_versions([instance.product_id])
+
+
+@receiver(post_delete, sender=ProductImage)
+def product_image_deleted(sender, instance, **kwargs):
+    bump_product_versions([instance.product_id])
+
+
+# pre_delete: by post_delete the products' discount has already been nulled
+@receiver(post_save, sender=Discount)
+@receiver(pre_delete, sender=Discount)
+def discount_changed(sender, instance, **kwargs):
+    product_ids = Product.objects.filter(
+        discount_id=instance.pk).values_list('id', flat=True)
+    bump_product_versions(list(product_ids))
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def category_changed(sender, instance, **kwargs):
+    bump_category_version()
+
+
+# bulk_create and update() skip these; callers using them (checkout, the
+# bulk status actions) maintain VendorOrder and CustomerFeatures themselves,
+# and bulk loaders rebuild CustomerFeatures when they finish
+@receiver(post_save, sender=OrderDetails)
+def order_line_saved(sender, instance, created, **kwargs):
+    if created:
+        link_vendor_orders([instance.order_id])
+    refresh_orders_on_commit([instance.order_id])
+
+
+@receiver(post_save, sender=Order)
+def order_saved(sender, instance, created, **kwargs):
+    if not created:
+        sync_vendor_orders(instance)
+        refresh_orders_on_commit([instance.pk])
+
+
+@receiver(post_delete, sender=Order)
+def order_deleted(sender, instance, **kwargs):
+    refresh_customers_on_commit([instance.user_id])
@@ -0,0 +1,57 @@
+import json
+import os
+import subprocess
+import sys
+
+from django.conf import settings
+
+# Modules a web worker should not load until a page needs them
+HEAVY_MODULES = ('pandas', 'numpy', 'scipy', 'sklearn', 'pmdarima', 'xgboost',
+                 'pyarrow', 'transformers', 'torch')
+
+_PROBE = '''
+import json, sys, time
+started = time.perf_counter()
+import django
+django.setup()
+import ecommerce.urls
+elapsed = time.perf_counter() - started
+from ecommerce.instrumentation import current_rss
+print(json.dumps({"seconds": elapsed, "rss": current_rss(),
+                  "heavy": sorted(m for m in %r if m in sys.modules)}))
+''' % (HEAVY_MODULES,)
+
+
+def parse_importtime(stderr):
+    """
+    Top-level entries of `python -X importtime` output as (module,
+    cumulative seconds), slowest first. Nested imports are already included
+    in their parent's cumulative time.
+    """
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative_us, name = line[len('import time:'):].split('|')
+        # Each nesting level indents the name by two more spaces
+        if name[1:].startswith(' '):
+            continue
+        entries.append((name.strip(), int(cumulative_us) / 1e6))
+    return sorted(entries, key=lambda entry: entry[1], reverse=True)
+
+
+def measure_startup():
+    """
+    Imports ecommerce.urls (after django.setup()) in a fresh interpreter
+    under `-X importtime` and returns the wall time, the resulting RSS, the
+    heavy modules that got imported and the slowest top-level imports.
+    """
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get(
+        'DJANGO_SETTINGS_MODULE', settings.SETTINGS_MODULE))
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', _PROBE],
+                            capture_output=True, text=True, env=env, cwd=settings.BASE_DIR)
+    if result.returncode:
+        raise RuntimeError(f'Importing ecommerce.urls failed:\n{result.stderr[-2000:]}')
+    report = json.loads(result.stdout.strip().splitlines()[-1])
+    report['slowest'] = parse_importtime(result.stderr)
+    return report
@@ -0,0 +1,333 @@
+import bisect
+import math
+import random
+import time
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from itertools import accumulate
+
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from django.utils import timezone
+
+from .catalog_versions import bump_category_version
+from .models import (User, UserProfile, Product, Inventory, Discount, Category, ProductReview,
+                     UserInteraction, Order, OrderDetails, VendorOrder)
+
+# Every generated user starts with this, so a dataset can be found and flushed
+USERNAME_PREFIX = 'synth-'
+PASSWORD = 'password'
+
+Scale = namedtuple('Scale', 'vendors customers products orders interactions reviews')
+
+SCALES = {
+    # Small enough to seed inside a test
+    'XS': Scale(vendors=3, customers=60, products=50,
+                orders=400, interactions=2_000, reviews=200),
+    'S': Scale(vendors=10, customers=2_000, products=1_000,
+               orders=20_000, interactions=100_000, reviews=10_000),
+    'M': Scale(vendors=100, customers=50_000, products=20_000,
+               orders=500_000, interactions=2_000_000, reviews=200_000),
+    'L': Scale(vendors=1_000, customers=250_000, products=100_000,
+               orders=2_000_000, interactions=10_000_000, reviews=1_000_000),
+    'XL': Scale(vendors=5_000, customers=1_000_000, products=500_000,
+                orders=10_000_000, interactions=50_000_000, reviews=5_000_000),
+}
+
+CATEGORIES = [
+    'Accessories', 'Appliances', 'Art', 'Binders', 'Bookcases', 'Chairs', 'Copiers',
+    'Envelopes', 'Fasteners', 'Furnishings', 'Labels', 'Machines', 'Paper', 'Phones',
+    'Storage', 'Supplies', 'Tables', 'Cameras', 'Audio', 'Lighting', 'Kitchen', 'Garden',
+    'Toys', 'Sports', 'Books', 'Clothing', 'Shoes', 'Beauty', 'Health', 'Pets',
+]
+ADJECTIVES = ['Compact', 'Deluxe', 'Classic', 'Portable', 'Wireless', 'Heavy Duty', 'Eco',
+              'Premium', 'Smart', 'Ergonomic', 'Vintage', 'Modular']
+NOUNS = ['Organizer', 'Stand', 'Lamp', 'Speaker', 'Notebook', 'Chair', 'Shelf', 'Cable',
+         'Bottle', 'Backpack', 'Kettle', 'Camera', 'Keyboard', 'Headset', 'Planter', 'Mat']
+FIRST_NAMES = ['Alex', 'Sam', 'Maria', 'John', 'Priya', 'Chen', 'Fatima', 'Luca', 'Emma',
+               'Noah', 'Aisha', 'Hiro', 'Olga', 'Diego', 'Sara', 'Tom']
+LAST_NAMES = ['Smith', 'Garcia', 'Kim', 'Patel', 'Rossi', 'Novak', 'Silva', 'Khan', 'Muller',
+              'Sato', 'Brown', 'Ivanova', 'Lopez', 'Nguyen', 'Cohen', 'Adams']
+REVIEW_TEXT = {
+    1: ('Broke after a week, very disappointed.', 'anger'),
+    2: ('Not what I expected, a bit sad about it.', 'sadness'),
+    3: ('It is okay and does the job.', 'neutral'),
+    4: ('Pleasantly surprised by the quality.', 'surprise'),
+    5: ('Absolutely love it, would buy again!', 'love'),
+}
+# Most interactions are views; purchases are the rarest
+INTERACTION_TYPES = ['view', 'wishlist', 'purchase']
+INTERACTION_WEIGHTS = [85, 10, 5]
+
+
+class WeightedSampler:
+    """Draws indexes 0..n-1 with the given weights in O(log n) per draw."""
+
+    def __init__(self, rng, weights):
+        self.rng = rng
+        self.cum_weights = list(accumulate(weights))
+        self.total = self.cum_weights[-1]
+
+    def draw(self):
+        return bisect.bisect(self.cum_weights, self.rng.random() * self.total)
+
+    def share(self, index):
+        previous = self.cum_weights[index - 1] if index else 0
+        return (self.cum_weights[index] - previous) / self.total
+
+
+def power_law(rng, n, exponent):
+    """Zipf-like weights 1/rank^exponent, with ranks shuffled over the indexes."""
+    ranks = list(range(1, n + 1))
+    rng.shuffle(ranks)
+    return [1 / rank ** exponent for rank in ranks]
+
+
+def seasonal_day_weights(days, end):
+    """
+    Relative order volume for each of the `days` days up to `end`: a yearly
+    cycle peaking in late November/December, busier weekends and slow
+    growth over the period.
+    """
+    weights = []
+    for offset in range(days):
+        day = end - timedelta(days=days - 1 - offset)
+        yearly = 1 + 0.35 * math.cos(2 * math.pi * (day.timetuple().tm_yday - 340) / 365)
+        if day.month == 11 and day.day >= 24 or day.month == 12 and day.day <= 20:
+            yearly *= 1.6
+        weekly = 1.2 if day.weekday() >= 5 else 1.0
+        growth = 0.6 + 0.4 * offset / max(days - 1, 1)
+        weights.append(yearly * weekly * growth)
+    return weights
+
+
+def batched_range(total, size):
+    for start in range(0, total, size):
+        yield start, min(size, total - start)
+
+
+class SyntheticDataGenerator:
+    """
+    Generates a reproducible dataset of the given scale with bulk inserts.
+
+    The same seed, scale and end date always produce the same rows. Product
+    popularity and vendor catalogue sizes follow power laws, customer
+    activity is skewed, and order and interaction dates follow
+    seasonal_day_weights over the last `days` days. Nothing is kept in
+    memory per order or interaction, so the XL scale needs memory only per
+    product and customer.
+    """
+
+    def __init__(self, scale, seed=42, days=730, end_date=None, batch_size=5000, stdout=None):
+        self.scale = SCALES[scale]
+        self.rng = random.Random(seed)
+        self.days = days
+        self.batch_size = batch_size
+        self.stdout = stdout
+        # Dates are relative to end_date, so pin it to reproduce a dataset exactly
+        end_date = end_date or timezone.localdate()
+        self.end = timezone.make_aware(datetime.combine(end_date, datetime.max.time()))
+
+    def log(self, message):
+        if self.stdout is not None:
+            self.stdout.write(message)
+
+    def timed(self, label, count, started):
+        elapsed = time.perf_counter() - started
+        self.log(f'  {count} {label} in {elapsed:.1f}s '
+                 f'({count / elapsed if elapsed else count:.0f} rows/sec)')
+
+    def random_moment(self, days):
+        day = self.end.date() - timedelta(days=self.days - 1 - days.draw())
+        moment = datetime.combine(day, datetime.min.time()) + timedelta(
+            seconds=self.rng.randrange(86400))
+        return timezone.make_aware(moment)
+
+    # Reference data
+
+    def create_categories(self):
+        existing = dict(Category.objects.filter(name__in=CATEGORIES).values_list('name', 'id'))
+        missing = [Category(name=name, description=f'This is the {name} category.')
+                   for name in CATEGORIES if name not in existing]
+        if missing:
+            Category.objects.bulk_create(missing)
+            bump_category_version()
+            existing.update(Category.objects.filter(
+                name__in=[c.name for c in missing]).values_list('name', 'id'))
+        return [existing[name] for name in CATEGORIES]
+
+    def create_users(self, kind, count, is_vendor):
+        started = time.perf_counter()
+        password = make_password(PASSWORD)
+        joined_window = self.days * 2
+        ids = []
+        for start, size in batched_range(count, self.batch_size):
+            users, profiles = [], []
+            for i in range(start, start + size):
+                first, last = self.rng.choice(FIRST_NAMES), self.rng.choice(LAST_NAMES)
+                username = f'{USERNAME_PREFIX}{kind}{i:07d}'
+                users.append(User(
+                    username=username, password=password, email=f'{username}@example.com',
+                    first_name=first, last_name=last, phone_number='1234567890',
+                    address=f'{self.rng.randrange(1, 999)} Main Street',
+                    date_joined=self.end - timedelta(days=self.rng.randrange(self.days, joined_window))))
+                profiles.append((self.rng.choice('MFO'),
+                                 date(self.end.year - self.rng.randint(18, 75), 1, 1)))
+            with transaction.atomic():
+                users = User.objects.bulk_create(users)
+                UserProfile.objects.bulk_create([
+                    UserProfile(user=user, is_vendor=is_vendor, gender=gender,
+                                date_of_birth=date_of_birth)
+                    for user, (gender, date_of_birth) in zip(users, profiles)])
+            ids.extend(user.id for user in users)
+        self.timed(f'{kind}s', count, started)
+        return ids
+
+    def create_products(self, vendor_ids, category_ids, popularity):
+        """Returns (product ids, their prices, their vendor ids), index-aligned."""
+        started = time.perf_counter()
+        # A few vendors own most of the catalogue
+        vendors = WeightedSampler(self.rng, power_law(self.rng, len(vendor_ids), 1.1))
+        expected_views = self.scale.interactions * INTERACTION_WEIGHTS[0] / sum(INTERACTION_WEIGHTS)
+        Through = Product.categories.through
+        product_ids, prices, owners = [], [], []
+        for start, size in batched_range(self.scale.products, self.batch_size):
+            rows = []
+            for i in range(start, start + size):
+                price = Decimal(round(min(self.rng.lognormvariate(3.3, 0.9), 9999), 2)).quantize(
+                    Decimal('0.01'))
+                stock = self.rng.randint(0, 500)
+                discounted = self.rng.random() < 0.3
+                rows.append((
+                    f'{self.rng.choice(ADJECTIVES)} {self.rng.choice(NOUNS)} {i}',
+                    price, stock, discounted, vendor_ids[vendors.draw()],
+                    self.rng.sample(category_ids, self.rng.choice((1, 1, 2))),
+                    round(expected_views * popularity.share(i) * self.rng.uniform(0.8, 1.2)),
+                ))
+            with transaction.atomic():
+                inventories = Inventory.objects.bulk_create([
+                    Inventory(current_stock=stock, safety_stock_level=int(stock * 0.2),
+                              reorder_point=int(stock * 0.1))
+                    for _, _, stock, _, _, _, _ in rows])
+                discount_rows = [row for row in rows if row[3]]
+                discounts = iter(Discount.objects.bulk_create([
+                    Discount(discount_type=self.rng.choice(Discount.DiscountType.values),
+                             discount_value=self.rng.choice((5, 10, 15, 20)),
+                             start_date=self.end - timedelta(days=7),
+                             end_date=self.end + timedelta(days=self.rng.randint(1, 60)))
+                    for _ in discount_rows]))
+                products = Product.objects.bulk_create([
+                    Product(name=name, description=f'This is the description for {name}.',
+                            price=price, inventory=inventory,
+                            discount=next(discounts) if discounted else None,
+                            user_id=vendor_id, total_views=views)
+                    for (name, price, _, discounted, vendor_id, _, views), inventory
+                    in zip(rows, inventories)])
+                Through.objects.bulk_create([
+                    Through(product_id=product.id, category_id=category_id)
+                    for product, row in zip(products, rows) for category_id in row[5]])
+            product_ids.extend(product.id for product in products)
+            prices.extend(row[1] for row in rows)
+            owners.extend(row[4] for row in rows)
+        self.timed('products', self.scale.products, started)
+        return product_ids, prices, owners
+
+    # Activity
+
+    def create_orders(self, customer_ids, customers, products, product_ids, prices, owners, days):
+        started = time.perf_counter()
+        recent = self.end - timedelta(days=3)
+        for start, size in batched_range(self.scale.orders, self.batch_size):
+            orders, baskets = [], []
+            for _ in range(size):
+                order_date = self.random_moment(days)
+                # Basket sizes fall off geometrically: most orders have one line
+                lines = {}
+                while True:
+                    index = products.draw()
+                    lines[index] = lines.get(index, 0) + self.rng.choice((1, 1, 1, 2, 3))
+                    if len(lines) >= 8 or self.rng.random() < 0.55:
+                        break
+                if order_date > recent:
+                    status = 'Pending'
+                else:
+                    status = 'Canceled' if self.rng.random() < 0.04 else 'Completed'
+                orders.append(Order(
+                    order_date=order_date, status=status, user_id=customer_ids[customers.draw()],
+                    total_amount=sum(prices[index] * quantity for index, quantity in lines.items())))
+                baskets.append(lines)
+            with transaction.atomic():
+                orders = Order.objects.bulk_create(orders)
+                OrderDetails.objects.bulk_create([
+                    OrderDetails(order=order, product_id=product_ids[index],
+                                 quantity=quantity, price=prices[index])
+                    for order, lines in zip(orders, baskets)
+                    for index, quantity in lines.items()])
+                VendorOrder.objects.bulk_create([
+                    VendorOrder(vendor_id=vendor_id, order=order, status=order.status,
+                                order_date=order.order_date, total_amount=order.total_amount)
+                    for order, lines in zip(orders, baskets)
+                    for vendor_id in {owners[index] for index in lines}])
+        self.timed('orders', self.scale.orders, started)
+
+    def create_interactions(self, customer_ids, customers, products, product_ids, days):
+        started = time.perf_counter()
+        for start, size in batched_range(self.scale.interactions, self.batch_size):
+            UserInteraction.objects.bulk_create([
+                UserInteraction(
+                    user_id=customer_ids[customers.draw()],
+                    product_id=product_ids[products.draw()],
+                    interaction_type=self.rng.choices(INTERACTION_TYPES, INTERACTION_WEIGHTS)[0],
+                    timestamp=self.random_moment(days))
+                for _ in range(size)])
+        self.timed('interactions', self.scale.interactions, started)
+
+    def create_reviews(self, customer_ids, customers, products, product_ids):
+        started = time.perf_counter()
+        for start, size in batched_range(self.scale.reviews, self.batch_size):
+            reviews = []
+            # review_date is auto_now_add, so every review is dated now
+            for _ in range(size):
+                rating = self.rng.choices((1, 2, 3, 4, 5), (6, 6, 14, 30, 44))[0]
+                comment, sentiment = REVIEW_TEXT[rating]
+                reviews.append(ProductReview(
+                    rating=rating, comment=comment, sentiment=sentiment,
+                    user_id=customer_ids[customers.draw()],
+                    product_id=product_ids[products.draw()]))
+            ProductReview.objects.bulk_create(reviews)
+        self.timed('reviews', self.scale.reviews, started)
+
+    def run(self):
+        started = time.perf_counter()
+        scale = self.scale
+        self.log(f'Generating {scale.vendors} vendors, {scale.customers} customers, '
+                 f'{scale.products} products, {scale.orders} orders, '
+                 f'{scale.interactions} interactions and {scale.reviews} reviews.')
+        category_ids = self.create_categories()
+        vendor_ids = self.create_users('vendor', scale.vendors, is_vendor=True)
+        customer_ids = self.create_users('customer', scale.customers, is_vendor=False)
+
+        popularity = WeightedSampler(self.rng, power_law(self.rng, scale.products, 1.05))
+        customers = WeightedSampler(self.rng, power_law(self.rng, scale.customers, 0.7))
+        days = WeightedSampler(self.rng, seasonal_day_weights(self.days, self.end.date()))
+
+        product_ids, prices, owners = self.create_products(vendor_ids, category_ids, popularity)
+        self.create_orders(customer_ids, customers, popularity, product_ids, prices, owners, days)
+        self.create_interactions(customer_ids, customers, popularity, product_ids, days)
+        self.create_reviews(customer_ids, customers, popularity, product_ids)
+        self.log(f'Done in {time.perf_counter() - started:.1f}s.')
+
+
+def flush_synthetic_data():
+    """
+    Deletes everything a previous run generated. Inventories and discounts
+    are not owned by their products, so they are removed explicitly.
+    """
+    products = Product.objects.filter(user__username__startswith=USERNAME_PREFIX)
+    with transaction.atomic():
+        discount_ids = list(products.exclude(discount=None).values_list('discount_id', flat=True))
+        inventory_ids = list(products.values_list('inventory_id', flat=True))
+        Inventory.objects.filter(id__in=inventory_ids).delete()
+        Discount.objects.filter(id__in=discount_ids).delete()
+        User.objects.filter(username__startswith=USERNAME_PREFIX).delete()
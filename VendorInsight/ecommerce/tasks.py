@@ -0,0 +1,49 @@
+"""
+Background tasks run by `manage.py run_workers`. Views queue them with
+ecommerce.jobs.enqueue(name, *args). Keep this module cheap to import:
+the ML libraries are only imported inside the tasks that use them.
+"""
+from django.core.cache import cache
+from django.utils import timezone
+
+from .jobs import task
+from .models import ProductReview, User
+from .routers import read_replica
+
+# Kept well past ANALYTICS_REFRESH_AGE, so the page shows the previous
+# results while new ones are computed
+ANALYTICS_TIMEOUT = 7 * 86400
+ANALYTICS_REFRESH_AGE = 86400
+
+
+def vendor_analytics_key(vendor_id):
+    return f'analytics:vendor_{vendor_id}'
+
+
+@task
+def analyze_review_sentiment(review_id):
+    from .sentiment import analyze_and_update_review_sentiment
+
+    review = ProductReview.objects.filter(pk=review_id).first()
+    if review is not None:
+        analyze_and_update_review_sentiment(review)
+
+
+@task
+def refresh_vendor_analytics(vendor_id):
+    """
+    Recomputes the vendor's forecasts and customer segments into the cache,
+    after bringing the order facts the forecasts read up to date (only the
+    months that changed are rewritten).
+    """
+    from .forecasting import forecast_analytics
+    from .order_facts import export
+    from .segmentation import segment_customers
+
+    vendor = User.objects.get(pk=vendor_id)
+    with read_replica():
+        export()
+        analytics = forecast_analytics(vendor.products.all())
+        analytics['segments'] = segment_customers(vendor)
+    analytics['computed_at'] = timezone.now()
+    cache.set(vendor_analytics_key(vendor_id), analytics, timeout=ANALYTICS_TIMEOUT)
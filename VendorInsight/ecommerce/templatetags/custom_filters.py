@@ -9,3 +9,22 @@ def add_class(value, arg):
     Adds a CSS class to a form field.
     """
     return value.as_widget(attrs={'class': arg})
+
+
+@register.simple_tag(takes_context=True)
+def query_replace(context, *pairs, **kwargs):
+    """
+    Returns the current query string with the given parameters replaced,
+    so pagination links keep the active search, filter and sort. Parameter
+    names that are themselves variables can be passed as positional
+    name/value pairs. A value of None drops the parameter.
+    """
+    query = context['request'].GET.copy()
+    updates = dict(zip(pairs[::2], pairs[1::2]))
+    updates.update(kwargs)
+    for key, value in updates.items():
+        if value is None:
+            query.pop(key, None)
+        else:
+            query[key] = value
+    return query.urlencode()
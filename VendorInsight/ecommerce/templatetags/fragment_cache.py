@@ -0,0 +1,109 @@
+import hashlib
+import logging
+import time
+
+from django import template
+from django.core.cache import cache
+
+from ..catalog_versions import get_product_version, get_category_version
+
+register = template.Library()
+logger = logging.getLogger(__name__)
+
+# Fragments are keyed on a version, so they never go stale; the timeout only
+# bounds how long unused fragments occupy the cache.
+FRAGMENT_TIMEOUT = 60 * 60 * 24 * 7
+
+
+class VersionedCacheNode(template.Node):
+    def __init__(self, nodelist, name, version_func, target, vary_on):
+        self.nodelist = nodelist
+        self.name = name
+        self.version_func = version_func
+        self.target = target
+        self.vary_on = vary_on
+
+    def cache_key(self, context):
+        target = self.target.resolve(context) if self.target else None
+        version = self.version_func(target)
+        vary = ':'.join(str(var.resolve(context)) for var in self.vary_on)
+        digest = hashlib.md5(vary.encode(), usedforsecurity=False).hexdigest()
+        target_id = getattr(target, 'pk', '')
+        return f'fragment:{self.name}:{target_id}:{version}:{digest}'
+
+    def render(self, context):
+        key = self.cache_key(context)
+        cached = cache.get(key)
+        stats = fragment_stats(context)
+        if cached is not None:
+            html, render_time = cached
+            stats['hits'] += 1
+            stats['saved'] += render_time
+            logger.debug('Fragment %s hit, saved %.2fms',
+                         self.name, render_time * 1000)
+            return html
+
+        start = time.perf_counter()
+        html = self.nodelist.render(context)
+        render_time = time.perf_counter() - start
+        cache.set(key, (html, render_time), FRAGMENT_TIMEOUT)
+        stats['misses'] += 1
+        return html
+
+
+def fragment_stats(context):
+    """
+    Per-request fragment cache counters. `saved` is the render time (seconds)
+    recorded when each hit fragment was first rendered, i.e. the time the
+    hits avoided. Stored on the request so middleware and logging can read it.
+    """
+    request = context.get('request')
+    if request is None:
+        return context.render_context.setdefault(
+            'fragment_cache_stats', {'hits': 0, 'misses': 0, 'saved': 0.0})
+    if not hasattr(request, 'fragment_cache_stats'):
+        request.fragment_cache_stats = {'hits': 0, 'misses': 0, 'saved': 0.0}
+    return request.fragment_cache_stats
+
+
+def _parse(parser, token, end_tag, version_func, needs_target):
+    bits = token.split_contents()
+    tag_name = bits.pop(0)
+    if needs_target:
+        if len(bits) < 2:
+            raise template.TemplateSyntaxError(
+                f"'{tag_name}' takes a fragment name and a product")
+        name, target, vary_on = bits[0], parser.compile_filter(bits[1]), bits[2:]
+    else:
+        if not bits:
+            raise template.TemplateSyntaxError(
+                f"'{tag_name}' takes a fragment name")
+        name, target, vary_on = bits[0], None, bits[1:]
+    nodelist = parser.parse((end_tag,))
+    parser.delete_first_token()
+    return VersionedCacheNode(nodelist, name.strip('"\''), version_func, target,
+                              [parser.compile_filter(var) for var in vary_on])
+
+
+@register.tag('product_card_cache')
+def do_product_card_cache(parser, token):
+    """
+    Caches a product card until the product, its images or its discount change.
+
+        {% product_card_cache "home_card" product %}...{% endproduct_card_cache %}
+
+    Extra arguments after the product are added to the key.
+    """
+    return _parse(parser, token, 'endproduct_card_cache',
+                  lambda product: get_product_version(product.pk), True)
+
+
+@register.tag('category_cache')
+def do_category_cache(parser, token):
+    """
+    Caches a fragment until any category is added, changed or removed.
+
+        {% category_cache "sidebar" request.GET.category %}...{% endcategory_cache %}
+    """
+    return _parse(parser, token, 'endcategory_cache',
+                  lambda target: get_category_version(), False)
@@ -0,0 +1,36 @@
+from django import template
+from django.utils.html import format_html
+
+register = template.Library()
+
+# How wide each rendition is laid out, for the browser's srcset choice
+SIZES = {
+    'card': '(min-width: 768px) 33vw, 100vw',
+    'detail': '(min-width: 768px) 50vw, 100vw',
+}
+
+
+@register.simple_tag
+def product_picture(image, label='card', alt='', css_class=''):
+    """
+    Renders a <picture> for a ProductImage with a WebP srcset and a
+    JPEG/PNG fallback, preferring the `label` rendition as the default src.
+    Images without derivatives (not yet backfilled) use the original file.
+
+        {% product_picture product.primary_image "card" alt=product.name css_class="card-img-top" %}
+    """
+    if not image:
+        return format_html('<img src="" class="{}" alt="{}">', css_class, alt)
+    if not image.derivatives:
+        return format_html('<img src="{}" class="{}" alt="{}">',
+                           image.image.url, css_class, alt)
+    sizes = SIZES.get(label, '100vw')
+    # Cards are mostly below the fold; the detail image is the main content
+    loading = 'lazy' if label == 'card' else 'eager'
+    return format_html(
+        '<picture>'
+        '<source type="image/webp" srcset="{}" sizes="{}">'
+        '<img src="{}" srcset="{}" sizes="{}" class="{}" alt="{}" loading="{}" decoding="async">'
+        '</picture>',
+        image.srcset('webp'), sizes,
+        image.derivative_url(label), image.srcset(), sizes, css_class, alt, loading)
@@ -0,0 +1,113 @@
+import re
+from contextlib import contextmanager
+
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test.utils import CaptureQueriesContext
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class SequentialScan(AssertionError):
+    pass
+
+
+# Plan lines that read a whole table. A scan of a whole index, e.g. of a
+# partial one, is fine.
+_FULL_SCAN = {
+    'postgresql': re.compile(r'Seq Scan on (\w+)'),
+    'sqlite': re.compile(r'\bSCAN (?:TABLE )?(\w+)\b(?! USING)'),
+}
+
+
+@contextmanager
+def max_queries(budget, using=DEFAULT_DB_ALIAS):
+    """
+    Fails if the block runs more than `budget` queries. The captured queries
+    are listed in the error so the offending N+1 is easy to spot.
+
+        with max_queries(8):
+            client.get(reverse('home'))
+    """
+    with CaptureQueriesContext(connections[using]) as context:
+        yield context
+    executed = len(context.captured_queries)
+    if executed > budget:
+        queries = '\n'.join(
+            f'{i}. {query["sql"]}' for i, query in enumerate(context.captured_queries, start=1))
+        raise QueryBudgetExceeded(
+            f'{executed} queries executed, budget is {budget}:\n{queries}')
+
+
+class QueryBudgetMixin:
+    """
+    TestCase mixin for pinning a view to a fixed query count, e.g.
+
+        self.assertViewQueries(8, reverse('home'))
+        self.assertViewQueries(6, reverse('cart'), method='post',
+                               data={'action': 'clear_cart'})
+
+    Use it with a list of 1 and of many rows; both must stay inside the same
+    budget for the page to be free of per-row queries.
+    """
+
+    def assertViewQueries(self, budget, url, method='get', data=None, status_code=None, **extra):
+        with max_queries(budget):
+            response = getattr(self.client, method)(url, data or {}, **extra)
+        if status_code is not None:
+            self.assertEqual(response.status_code, status_code)
+        return response
+
+
+@contextmanager
+def _index_scans_preferred(connection):
+    # On a test-sized table Postgres picks a sequential scan whatever the
+    # indexes; with it discouraged, one only shows up when no index fits
+    if connection.vendor != 'postgresql':
+        yield
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('SET enable_seqscan = off')
+        try:
+            yield
+        finally:
+            cursor.execute('RESET enable_seqscan')
+
+
+def full_scans(queryset, tables=None):
+    """
+    The tables `queryset`'s EXPLAIN plan reads in full (only those in
+    `tables`, when given), and the plan. Returns (None, None) on backends
+    whose plans are not understood.
+    """
+    connection = connections[queryset.db]
+    pattern = _FULL_SCAN.get(connection.vendor)
+    if pattern is None:
+        return None, None
+    with _index_scans_preferred(connection):
+        plan = queryset.explain()
+    scanned = sorted({table for table in pattern.findall(plan)
+                      if tables is None or table in tables})
+    return scanned, plan
+
+
+class QueryPlanMixin:
+    """
+    TestCase mixin that fails when a query falls back to reading a whole
+    table, e.g. after an index is dropped or a filter stops matching one:
+
+        self.assertUsesIndexes(
+            Order.objects.filter(user=user).order_by('-order_date', '-id')[:20])
+
+    Seed some rows first so the plan is meaningful. Skips the test on
+    backends whose plans it cannot read.
+    """
+
+    def assertUsesIndexes(self, queryset, tables=None):
+        scanned, plan = full_scans(queryset, tables)
+        if scanned is None:
+            self.skipTest(f'Cannot read {connections[queryset.db].vendor} query plans')
+        if scanned:
+            raise SequentialScan(
+                f'Full scan of {", ".join(scanned)}:\n{plan}\n\n{queryset.query}')
@@ -1,3 +1,1503 @@
-from django.test import TestCase
+import asyncio
+import base64
+import csv
+import hashlib
+import json
+import importlib
+import importlib.util
+import io
+import os
+import posixpath
+import shutil
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from PIL import Image
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.db import OperationalError, connection, router, transaction
+from django.db.models import Count, F, Sum
+from django.http import HttpResponse
+from django.utils import timezone
+from django.core.cache import cache, caches
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.template import Context, Template
+from django.urls import reverse
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings, \
+    skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
+
+from . import async_views
+from .benchmarks import StorefrontURLConf
+from .cache_backends import TieredCache
+from .checkout import place_order, CheckoutError, OutOfStock
+from .routers import PIN_COOKIE, ReplicaPinningMiddleware, is_pinned, read_replica
+from .customer_features import refresh
+from .identity import ProfileBackend, is_vendor
+from .images import DERIVATIVE_DIR, IMMUTABLE_CACHE_CONTROL, serve_derivative
+from .importing import (VENDOR_USERNAME, AlreadyImported, BulkImporter, CopyImporter, DeltaImporter,
+                        StreamingCopyImporter, StreamingImporter, plan_chunks, read_chunk)
+from .ingestion import InteractionBuffer, interaction_buffer
+from .instrumentation import RequestProfilingMiddleware, fingerprint_sql, span
+from .jobs import Worker, claim, enqueue, queue_stats, recover_expired, task
+from .pagination import CursorPaginator
+from .profiling import OnDemandProfilerMiddleware, report
+from .models import User, UserProfile, Product, Inventory, Cart, CartItem, Order, OrderDetails, VendorOrder, \
+    ProductReview, UserInteraction, Job, Category, CustomerFeatures, ImportedRow, ProductImage, Wishlist, \
+    ImportChunk
+from .synthetic import USERNAME_PREFIX, SyntheticDataGenerator
+from .testing import QueryBudgetMixin, QueryPlanMixin, SequentialScan, max_queries
+from .vendor_orders import order_board, set_status
+
+
+def make_customer(username):
+    user = User.objects.create_user(username=username, password='password')
+    UserProfile.objects.create(user=user, gender='O', date_of_birth=date(1990, 1, 1))
+    return user
+
+
+def make_product(vendor, stock, name='Widget', price=10):
+    inventory = Inventory.objects.create(
+        current_stock=stock, safety_stock_level=0, reorder_point=0)
+    return Product.objects.create(name=name, description=name, price=price,
+                                  inventory=inventory, user=vendor)
+
+
+def fill_cart(user, product, quantity):
+    cart, _ = Cart.objects.get_or_create(user=user)
+    CartItem.objects.create(cart=cart, product=product, quantity=quantity)
+
+
+class BufferedEventsMixin:
+    """For tests of the pages that record views and interactions."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # The timed flush would write on its own connection, which does not
+        # see the test's rows
+        interaction_buffer.close()
+
+    def setUp(self):
+        super().setUp()
+        # Write the buffered events before the test's rows are rolled back
+        self.addCleanup(interaction_buffer.flush)
+
+
+EXPORT_COLUMNS = ['Row ID', 'Order ID', 'Order Date', 'Customer ID', 'Customer Name', 'City', 'State',
+                  'Country', 'Sub-Category', 'Product Name', 'Sales', 'Quantity', 'Average Price',
+                  'corrected_age', 'corrected_stock', 'corrected_gender']
+
+
+def export_row(row_id, customer='AS-10045', product='Fellowes Folders, Blue', order_date='2024-02-07',
+               quantity=3, price='21.25', category='Storage'):
+    """A row of the order export (Testing.csv layout), with only the columns the importers read."""
+    return {
+        'Row ID': str(row_id), 'Order ID': f'ES-{row_id}', 'Order Date': order_date,
+        'Customer ID': customer, 'Customer Name': 'Aaron Smayling', 'City': 'Leeds',
+        'State': 'England', 'Country': 'United Kingdom', 'Sub-Category': category,
+        'Product Name': product, 'Sales': str(float(price) * quantity), 'Quantity': str(quantity),
+        'Average Price': price, 'corrected_age': '28', 'corrected_stock': '500.0',
+        'corrected_gender': 'Female',
+    }
+
+
+def write_export(directory, rows, name='export.csv'):
+    path = os.path.join(directory, name)
+    with open(path, 'w', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=EXPORT_COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+    return path
+
+
+def make_importer(importer_class, path, **kwargs):
+    importer = importer_class(path, password_hash='!', **kwargs)
+    # Skips storing the placeholder image file
+    importer._placeholder = ('product_images/test.png', {})
+    return importer
+
+
+def import_row_by_row(path):
+    """The per-row import_data the bulk loaders replaced, less the images, as their reference."""
+    vendor, _ = User.objects.get_or_create(username=VENDOR_USERNAME)
+    UserProfile.objects.get_or_create(user=vendor, defaults={
+        'is_vendor': True, 'gender': 'M', 'date_of_birth': '1990-01-01'})
+    with open(path, newline='') as file:
+        rows = list(csv.DictReader(file))
+    time_diff = datetime.now().date() - max(
+        datetime.strptime(row['Order Date'], '%Y-%m-%d') for row in rows).date()
+    for row in rows:
+        name = row['Customer Name'].split()
+        customer, _ = User.objects.get_or_create(username=row['Customer ID'], defaults={
+            'first_name': name[0], 'last_name': name[1] if len(name) > 1 else ''})
+        UserProfile.objects.get_or_create(user=customer, defaults={
+            'is_vendor': False, 'gender': row['corrected_gender'][0],
+            'date_of_birth': date(date.today().year - int(float(row['corrected_age'])), 1, 1)})
+        category, _ = Category.objects.get_or_create(name=row['Sub-Category'])
+        views = int(float(row['Quantity']))
+        product, created = Product.objects.get_or_create(name=row['Product Name'], defaults={
+            'price': float(row['Average Price']), 'user': vendor, 'total_views': views,
+            'inventory': Inventory.objects.create(
+                current_stock=int(float(row['corrected_stock'])), safety_stock_level=0,
+                reorder_point=0)})
+        if not created:
+            product.total_views += views
+            product.save()
+        product.categories.add(category)
+        order = Order.objects.create(
+            order_date=timezone.make_aware(
+                datetime.strptime(row['Order Date'], '%Y-%m-%d') + time_diff),
+            total_amount=float(row['Sales']), status='Completed', user=customer)
+        OrderDetails.objects.create(quantity=views, price=float(row['Average Price']),
+                                    order=order, product=product)
+
+
+def import_snapshot():
+    """What an import of the order export produced, comparable across loaders."""
+    return {
+        'customers': sorted(User.objects.exclude(username=VENDOR_USERNAME).values_list(
+            'username', 'first_name', 'last_name', 'userprofile__gender')),
+        'products': sorted(Product.objects.values_list(
+            'name', 'price', 'total_views', 'inventory__current_stock', 'user__username')),
+        'categories': sorted(Product.categories.through.objects.values_list(
+            'product__name', 'category__name')),
+        'lines': sorted(OrderDetails.objects.values_list(
+            'order__user__username', 'order__order_date', 'order__total_amount',
+            'order__status', 'product__name', 'quantity', 'price')),
+        'vendor_orders': VendorOrder.objects.filter(vendor__username=VENDOR_USERNAME).count(),
+    }
+
+
+JOB_RUNS = []
+
+
+@task
+def record_job_run(value):
+    JOB_RUNS.append(value)
+
+
+@task
+def failing_job():
+    raise RuntimeError('boom')
+
+
+class CheckoutTests(TestCase):
+    def setUp(self):
+        self.vendor = make_customer('vendor')
+        self.customer = make_customer('customer')
+
+    def test_place_order_takes_stock_and_clears_cart(self):
+        product = make_product(self.vendor, stock=5)
+        fill_cart(self.customer, product, 3)
+
+        order = place_order(self.customer)
+
+        product.inventory.refresh_from_db()
+        self.assertEqual(product.inventory.current_stock, 2)
+        self.assertEqual(order.total_amount, 30)
+        self.assertEqual(order.orderdetails_set.get().quantity, 3)
+        self.assertFalse(CartItem.objects.filter(cart__user=self.customer).exists())
+
+    def test_out_of_stock_writes_nothing(self):
+        in_stock = make_product(self.vendor, stock=5, name='In stock')
+        short = make_product(self.vendor, stock=1, name='Short')
+        fill_cart(self.customer, in_stock, 2)
+        fill_cart(self.customer, short, 2)
+
+        with self.assertRaises(OutOfStock) as raised:
+            place_order(self.customer)
+
+        self.assertEqual(raised.exception.products, [short])
+        in_stock.inventory.refresh_from_db()
+        self.assertEqual(in_stock.inventory.current_stock, 5)
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(CartItem.objects.filter(cart__user=self.customer).count(), 2)
+
+    def test_empty_cart(self):
+        with self.assertRaises(CheckoutError):
+            place_order(self.customer)
+
+
+class VendorOrderBoardTests(TestCase):
+    def setUp(self):
+        self.vendor = make_customer('vendor')
+        self.other_vendor = make_customer('other')
+        self.customer = make_customer('customer')
+        self.product = make_product(self.vendor, stock=1000)
+        self.other_product = make_product(self.other_vendor, stock=1000)
+
+    def place(self, *products):
+        for product in products:
+            fill_cart(self.customer, product, 1)
+        return place_order(self.customer)
+
+    def test_checkout_links_each_vendor_once(self):
+        order = self.place(self.product, self.other_product)
+        self.assertEqual(
+            set(VendorOrder.objects.filter(order=order).values_list('vendor__username', flat=True)),
+            {'vendor', 'other'})
+
+    def test_board_pages_and_counts(self):
+        orders = [self.place(self.product) for _ in range(12)]
+        self.place(self.other_product)
+        set_status(self.vendor, [orders[0].id, orders[1].id], 'Pending', 'Completed')
+
+        with max_queries(4):
+            board = order_board(self.vendor, {}, per_page=5)
+
+        self.assertEqual(board['Pending']['count'], 10)
+        self.assertEqual(board['Completed']['count'], 2)
+        self.assertEqual(board['Canceled']['count'], 0)
+        pending = board['Pending']['page']
+        self.assertEqual([entry.order_id for entry in pending],
+                         [order.id for order in reversed(orders[2:])][:5])
+        self.assertTrue(pending.has_next())
+
+    def test_bulk_status_only_touches_own_pending_orders(self):
+        mine = self.place(self.product)
+        theirs = self.place(self.other_product)
+
+        changed = set_status(self.vendor, [mine.id, theirs.id], 'Pending', 'Canceled')
+
+        self.assertEqual(changed, 1)
+        mine.refresh_from_db()
+        theirs.refresh_from_db()
+        self.assertEqual(mine.status, 'Canceled')
+        self.assertEqual(theirs.status, 'Pending')
+        self.assertEqual(VendorOrder.objects.get(order=mine).status, 'Canceled')
+
+    def test_status_view_rejects_malformed_order_ids(self):
+        mine = self.place(self.product)
+        UserProfile.objects.filter(user=self.vendor).update(is_vendor=True)
+        self.client.force_login(self.vendor)
+        url = reverse('vendor_order_status')
+
+        for data in ({'action': 'bulk_complete', 'order_ids': [mine.id, 'x']},
+                     {'action': 'complete', 'order_id': 'x'},
+                     {'action': 'complete'}):
+            with self.subTest(data=data):
+                self.assertEqual(self.client.post(url, data).status_code, 400)
+        mine.refresh_from_db()
+        self.assertEqual(mine.status, 'Pending')
+
+        response = self.client.post(url, {'action': 'bulk_complete', 'order_ids': [mine.id]})
+        self.assertEqual(response.status_code, 200)
+        mine.refresh_from_db()
+        self.assertEqual(mine.status, 'Completed')
+
+
+class CustomerFeaturesTests(TestCase):
+    def setUp(self):
+        self.vendor = make_customer('vendor')
+        self.customer = make_customer('customer')
+        self.lamp = make_product(self.vendor, stock=1000, name='Lamp', price=10)
+        self.chair = make_product(self.vendor, stock=1000, name='Chair', price=25)
+        self.lighting = Category.objects.create(name='Lighting')
+        self.furniture = Category.objects.create(name='Furniture')
+        self.lamp.categories.add(self.lighting)
+        self.chair.categories.add(self.furniture)
+
+    def place(self, *lines):
+        for product, quantity in lines:
+            fill_cart(self.customer, product, quantity)
+        with self.captureOnCommitCallbacks(execute=True):
+            return place_order(self.customer)
+
+    def features(self):
+        return CustomerFeatures.objects.get(vendor=self.vendor, customer=self.customer)
+
+    def test_checkout_and_cancellation_update_the_features(self):
+        first = self.place((self.lamp, 2), (self.chair, 1))
+        self.place((self.lamp, 1))
+        features = self.features()
+        self.assertEqual((features.order_count, features.quantity, features.total_spent),
+                         (2, 4, 55))
+        self.assertEqual(features.top_category, self.lighting)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            set_status(self.vendor, [first.id], 'Pending', 'Canceled')
+        features = self.features()
+        self.assertEqual((features.order_count, features.total_spent), (1, 10))
+
+    def test_deleting_orders_refreshes_once_per_transaction(self):
+        orders = [self.place((self.lamp, 1)) for _ in range(4)]
+        other = make_customer('other')
+        fill_cart(other, self.chair, 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            place_order(other)
+
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            Order.objects.filter(id__in=[order.id for order in orders[1:]]).delete()
+            other.delete()
+        self.assertEqual(len(callbacks), 1)
+        features = self.features()
+        self.assertEqual((features.order_count, features.quantity), (1, 1))
+        self.assertFalse(CustomerFeatures.objects.filter(customer_id=other.id).exists())
+
+        # The next transaction starts a batch of its own
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            orders[0].delete()
+        self.assertEqual(len(callbacks), 1)
+        self.assertFalse(CustomerFeatures.objects.filter(customer=self.customer).exists())
+
+    def test_migration_backfills_the_features(self):
+        self.place((self.lamp, 2))
+        expected = list(CustomerFeatures.objects.values('vendor', 'customer', 'order_count', 'total_spent'))
+        CustomerFeatures.objects.all().delete()
+
+        migration = importlib.import_module('ecommerce.migrations.0013_backfill_customer_features')
+        migration.backfill_customer_features(None, None)
+        self.assertEqual(list(CustomerFeatures.objects.values(
+            'vendor', 'customer', 'order_count', 'total_spent')), expected)
+
+    @skipUnless(importlib.util.find_spec('sklearn'), 'scikit-learn is not installed')
+    def test_segments_are_empty_below_four_customers(self):
+        from .segmentation import segment_customers
+
+        empty = {'data': [], 'clusters': [], 'cluster_averages': []}
+        self.assertEqual(segment_customers(self.vendor), empty)
+        self.place((self.lamp, 1))
+        self.assertEqual(segment_customers(self.vendor), empty)
+
+    def test_rebuild_matches_incremental_updates(self):
+        self.place((self.chair, 3))
+        self.place((self.lamp, 1), (self.chair, 1))
+        incremental = list(CustomerFeatures.objects.values(
+            'vendor', 'customer', 'order_count', 'quantity', 'total_spent',
+            'first_order_date', 'last_order_date', 'top_category'))
+
+        with self.assertNumQueries(7):
+            refresh()
+        self.assertEqual(list(CustomerFeatures.objects.values(
+            'vendor', 'customer', 'order_count', 'quantity', 'total_spent',
+            'first_order_date', 'last_order_date', 'top_category')), incremental)
+
+
+class OrderHistoryTests(TestCase):
+    def test_with_lines_is_a_fixed_number_of_queries(self):
+        vendor = make_customer('vendor')
+        customer = make_customer('customer')
+        products = [make_product(vendor, stock=100, name=f'P{i}', price=i + 1) for i in range(3)]
+        for _ in range(15):
+            for product in products:
+                fill_cart(customer, product, 2)
+            place_order(customer)
+
+        with max_queries(2):
+            orders = list(Order.objects.filter(user=customer).with_lines()[:10])
+            names = [detail.product.name for order in orders for detail in order.orderdetails_set.all()]
+
+        self.assertEqual(len(names), 30)
+        self.assertEqual(orders[0].item_count, 6)
+        self.assertEqual(orders[0].lines_total, 12)
+
+
+class BulkImportTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        # Repeat customers and products, a product in two categories and a
+        # one-word customer name
+        self.path = write_export(self.directory, [
+            export_row(1),
+            export_row(2, customer='BB-20000', quantity=1),
+            export_row(3, product='SanDisk Keypad', order_date='2024-01-20', price='44.00',
+                       category='Accessories'),
+            export_row(4, customer='BB-20000', product='SanDisk Keypad', quantity=2,
+                       price='44.00', category='Phones'),
+            dict(export_row(5, customer='CC-30000', quantity=4), **{'Customer Name': 'Cher'}),
+        ])
+
+    def expected(self):
+        with transaction.atomic():
+            import_row_by_row(self.path)
+            snapshot = import_snapshot()
+            transaction.set_rollback(True)
+        return snapshot
+
+    def test_matches_the_row_by_row_import(self):
+        expected = self.expected()
+        self.assertEqual(len(expected['lines']), 5)
+        self.assertEqual(make_importer(BulkImporter, self.path, batch_size=2).run(), 5)
+        self.assertEqual(import_snapshot(), dict(expected, vendor_orders=5))
+
+    def test_copy_loaders_match_the_row_by_row_import(self):
+        # Loads through COPY on PostgreSQL and through bulk_create elsewhere
+        expected = self.expected()
+        for importer_class, options in ((CopyImporter, {}),
+                                        (StreamingCopyImporter, {'chunk_size': 2})):
+            with self.subTest(importer=importer_class.__name__), transaction.atomic():
+                make_importer(importer_class, self.path, batch_size=2, **options).run()
+                self.assertEqual(import_snapshot(), dict(expected, vendor_orders=5))
+                transaction.set_rollback(True)
+
+    def test_reimport_adds_orders_and_views_to_existing_rows(self):
+        make_importer(BulkImporter, self.path).run()
+        make_importer(BulkImporter, self.path).run()
+        self.assertEqual(User.objects.count(), 4)
+        self.assertEqual(Product.objects.count(), 2)
+        self.assertEqual(Order.objects.count(), 10)
+        self.assertEqual(Product.objects.get(name='SanDisk Keypad').total_views, 2 * (3 + 2))
+
+
+class ChunkRecorder(StreamingImporter):
+    """Records the chunks it loads and fails on the chunk numbered `fail_at`."""
+
+    def __init__(self, path, fail_at=None, **kwargs):
+        super().__init__(path, **kwargs)
+        self.fail_at = fail_at
+        self.loaded = []
+
+    def load_chunk(self, source, fieldnames, chunk, time_diff):
+        if chunk.index == self.fail_at:
+            raise RuntimeError(f'chunk {chunk.index} failed')
+        self.loaded.append(chunk.index)
+        return super().load_chunk(source, fieldnames, chunk, time_diff)
+
+
+class StreamingImportTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        # Quoted newlines (one line inside a record ends in a quote), quoted
+        # commas and a doubled quote
+        self.path = write_export(self.directory, [
+            export_row(1, product='Binder,\n"Heavy" Duty'),
+            export_row(2, customer='BB-20000', order_date='2024-03-02'),
+            export_row(3, product='Lamp\n"'),
+            export_row(4, customer='BB-20000', product='Binder,\n"Heavy" Duty', quantity=2),
+            export_row(5, product='Plain Lamp'),
+        ])
+
+    def test_plan_chunks_splits_between_records(self):
+        fieldnames, chunks, max_order_date = plan_chunks(self.path, 2)
+
+        self.assertEqual([chunk.rows for chunk in chunks], [2, 2, 1])
+        self.assertEqual(max_order_date, datetime(2024, 3, 2))
+        rows = [read_chunk(self.path, fieldnames, chunk) for chunk in chunks]
+        self.assertEqual([[row['Row ID'] for row in chunk] for chunk in rows],
+                         [['1', '2'], ['3', '4'], ['5']])
+        self.assertEqual(rows[0][0]['Product Name'], 'Binder,\n"Heavy" Duty')
+        self.assertEqual(rows[1][0]['Product Name'], 'Lamp\n"')
+
+    def test_resume_skips_committed_chunks(self):
+        with transaction.atomic():
+            import_row_by_row(self.path)
+            expected = import_snapshot()
+            transaction.set_rollback(True)
+
+        failing = make_importer(ChunkRecorder, self.path, fail_at=1, chunk_size=2)
+        with self.assertRaises(RuntimeError):
+            failing.run()
+        self.assertEqual(ImportChunk.objects.count(), 1)
+        self.assertEqual(Order.objects.count(), 2)
+
+        resumed = make_importer(ChunkRecorder, self.path, chunk_size=2)
+        self.assertEqual(resumed.run(), 3)
+        self.assertEqual(resumed.loaded, [1, 2])
+        self.assertEqual(import_snapshot(), dict(expected, vendor_orders=5))
+
+        # Everything is recorded; a third run loads nothing
+        self.assertEqual(make_importer(ChunkRecorder, self.path, chunk_size=2).run(), 0)
+
+
+class DeltaImportTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.rows = [export_row(1), export_row(2, customer='BB-20000', quantity=1),
+                     export_row(3, product='SanDisk Keypad', order_date='2024-01-20', price='44.00')]
+
+    def delta(self, rows, name='export.csv'):
+        return make_importer(DeltaImporter, write_export(self.directory, rows, name)).run()
+
+    def test_counts_inserted_updated_and_skipped_rows(self):
+        self.assertEqual(self.delta(self.rows), (3, 0, 0))
+        self.assertEqual(self.delta(self.rows), (0, 0, 3))
+
+        changed = dict(self.rows[0], Quantity='5', Sales='106.25')
+        self.assertEqual(self.delta([changed] + self.rows[1:] + [export_row(4, quantity=2)]),
+                         (1, 1, 2))
+
+        self.assertEqual(Order.objects.count(), 4)
+        self.assertEqual(ImportedRow.objects.count(), 4)
+        folders = Product.objects.get(name='Fellowes Folders, Blue')
+        self.assertEqual(folders.total_views, 5 + 1 + 2)
+        self.assertEqual(OrderDetails.objects.get(
+            order=ImportedRow.objects.get(row_key='1').order).quantity, 5)
+
+    def test_later_imports_keep_the_first_date_shift(self):
+        self.delta(self.rows)
+        first = ImportedRow.objects.get(row_key='1').order.order_date
+        shift = timezone.localtime(first).date() - date(2024, 2, 7)
+
+        # A newer row would move the whole file's shift; the ledger keeps the old one
+        changed = dict(self.rows[2], Quantity='2', Sales='88.0')
+        self.delta(self.rows[:2] + [changed, export_row(4, order_date='2024-03-01')])
+
+        def loaded_date(row_key):
+            return timezone.localtime(ImportedRow.objects.get(row_key=row_key).order.order_date).date()
+        self.assertEqual(loaded_date('3'), date(2024, 1, 20) + shift)
+        self.assertEqual(loaded_date('4'), date(2024, 3, 1) + shift)
+
+    def test_refuses_rows_loaded_by_a_plain_import(self):
+        path = write_export(self.directory, self.rows)
+        make_importer(BulkImporter, path).run()
+
+        with self.assertRaises(AlreadyImported):
+            make_importer(DeltaImporter, path).run()
+        self.assertEqual(Order.objects.count(), 3)
+
+
+class CheckoutConcurrencyTests(TransactionTestCase):
+    """
+    Many customers race for the same few units. Needs a database with real
+    row locking (PostgreSQL); SQLite serialises writers anyway.
+    """
+    customers = 40
+    stock = 7
+
+    @skipUnlessDBFeature('has_select_for_update')
+    def test_no_oversell_under_parallel_checkout(self):
+        vendor = make_customer('vendor')
+        product = make_product(vendor, stock=self.stock)
+        users = [make_customer(f'customer{i}') for i in range(self.customers)]
+        for user in users:
+            fill_cart(user, product, 1)
+
+        barrier = threading.Barrier(len(users))
+        results = []
+
+        def checkout(user):
+            try:
+                barrier.wait()
+                place_order(user)
+                results.append('ok')
+            except OutOfStock:
+                results.append('short')
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=checkout, args=(user,)) for user in users]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        product.inventory.refresh_from_db()
+        self.assertEqual(results.count('ok'), self.stock)
+        self.assertEqual(results.count('short'), self.customers - self.stock)
+        self.assertEqual(product.inventory.current_stock, 0)
+        self.assertEqual(OrderDetails.objects.filter(product=product).count(), self.stock)
+
+
+class ReplicaRoutingTests(TransactionTestCase):
+    # TestCase would wrap every test in a transaction, which keeps all reads
+    # on the primary
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        if 'replica' not in settings.DATABASES:
+            self.skipTest('No replica database configured')
+
+    def request(self, view, cookies=None):
+        request = RequestFactory().get('/')
+        request.COOKIES.update(cookies or {})
+        return ReplicaPinningMiddleware(view)(request)
+
+    def test_only_designated_reads_use_the_replica(self):
+        seen = {}
+
+        def view(request):
+            seen['outside'] = router.db_for_read(Product)
+            with read_replica():
+                seen['inside'] = router.db_for_read(Product)
+            return HttpResponse()
+
+        response = self.request(view)
+        self.assertEqual(seen, {'outside': 'default', 'inside': 'replica'})
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+
+    def test_write_pins_request_and_sets_cookie(self):
+        seen = {}
+
+        def view(request):
+            make_customer('writer')
+            with read_replica():
+                seen['after_write'] = router.db_for_read(Product)
+            return HttpResponse()
+
+        response = self.request(view)
+        self.assertEqual(seen['after_write'], 'default')
+        self.assertIn(PIN_COOKIE, response.cookies)
+
+        # The next request of the same user is still pinned, the next
+        # request of anyone else is not
+        def read_view(request):
+            with read_replica():
+                seen['pinned'] = is_pinned()
+            return HttpResponse()
+
+        self.request(read_view, cookies={PIN_COOKIE: '1'})
+        self.assertTrue(seen['pinned'])
+        self.request(read_view)
+        self.assertFalse(seen['pinned'])
+
+    def test_open_transaction_reads_the_primary(self):
+        with transaction.atomic(), read_replica():
+            self.assertEqual(router.db_for_read(Product), 'default')
+
+    def test_write_in_a_gathered_task_pins_the_async_request(self):
+        seen = {}
+
+        async def view(request):
+            # gather() runs each coroutine in a copy of the request's context
+            await asyncio.gather(sync_to_async(make_customer)('async-writer'))
+            seen['pinned'] = is_pinned()
+            return HttpResponse()
+
+        middleware = ReplicaPinningMiddleware(view)
+        response = async_to_sync(middleware)(RequestFactory().get('/'))
+        self.assertTrue(seen['pinned'])
+        self.assertIn(PIN_COOKIE, response.cookies)
+
+
+# The timed flush runs on the flusher thread's own connection, which only
+# sees committed rows
+@override_settings(DATABASE_ROUTERS=[])
+class InteractionBufferTests(TransactionTestCase):
+
+    def setUp(self):
+        self.customer = make_customer('customer')
+        self.product = make_product(make_customer('vendor'), stock=1)
+
+    def make_buffer(self, **options):
+        buffer = InteractionBuffer(**{'flush_size': 100, 'flush_interval': 3600, **options})
+        self.addCleanup(buffer.close)
+        return buffer
+
+    def record(self, buffer, views, product=None):
+        product = product or self.product
+        for _ in range(views):
+            buffer.record_view(product.id)
+            buffer.record_interaction(self.customer.id, product.id, 'view')
+
+    def written(self, product=None):
+        product = product or self.product
+        product.refresh_from_db()
+        return UserInteraction.objects.filter(product=product).count(), product.total_views
+
+    def test_flushes_when_full(self):
+        buffer = self.make_buffer(flush_size=6)
+        self.record(buffer, 2)
+        self.assertEqual(self.written(), (0, 0))
+        self.record(buffer, 1)
+        self.assertEqual(self.written(), (3, 3))
+
+    def test_flushes_after_interval(self):
+        buffer = self.make_buffer(flush_interval=0.05)
+        # One event, so the first timed flush cannot catch half of them
+        buffer.record_interaction(self.customer.id, self.product.id, 'view')
+        self.assertTrue(buffer.flushed.wait(5))
+        self.assertEqual(self.written(), (1, 0))
+
+    def test_close_stops_the_flusher_and_flushes(self):
+        buffer = self.make_buffer(flush_interval=0.05)
+        buffer.record_view(self.product.id)
+        self.assertEqual(buffer.close(), (0, 1))
+        self.assertFalse(buffer._flusher.is_alive())
+        buffer.record_view(self.product.id)
+        self.assertFalse(buffer._flusher.is_alive())
+        self.assertEqual(self.written(), (0, 1))
+
+    def test_failed_flush_keeps_newest_events(self):
+        buffer = self.make_buffer(max_size=3)
+        with mock.patch.object(UserInteraction.objects, 'bulk_create',
+                               side_effect=OperationalError('database is locked')), \
+                self.assertLogs('ecommerce.ingestion') as logs:
+            self.record(buffer, 2)
+            self.assertEqual(buffer.flush(), (0, 0))
+            self.record(buffer, 2)
+            self.assertEqual(buffer.flush(), (0, 0))
+        self.assertIn('dropped the 1 oldest interactions', logs.output[-1])
+        self.assertEqual(buffer.flush(), (3, 1))
+        self.assertEqual(self.written(), (3, 4))
+        self.assertEqual(buffer.flush(), (0, 0))
+
+    def test_drops_only_events_of_deleted_rows(self):
+        buffer = self.make_buffer()
+        other = make_product(self.product.user, stock=1, name='Other')
+        self.record(buffer, 2)
+        self.record(buffer, 1, product=other)
+        buffer.record_interaction(make_customer('gone').id, other.id, 'wishlist')
+        Product.objects.filter(pk=self.product.pk).delete()
+        User.objects.filter(username='gone').delete()
+
+        with self.assertLogs('ecommerce.ingestion', 'WARNING') as logs:
+            self.assertEqual(buffer.flush(), (1, 1))
+        self.assertIn('Dropped 3 interactions and 2 product views', logs.output[0])
+        self.assertEqual(self.written(other), (1, 1))
+        self.assertEqual(buffer.flush(), (0, 0))
+
+
+# One connection, so the recommender's reads are counted (and see the test's rows)
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+                   DATABASE_ROUTERS=[])
+class PageQueryTests(BufferedEventsMixin, QueryBudgetMixin, TestCase):
+    """The pages run as many queries for one row as for many (with cold fragment caches)."""
+
+    def setUp(self):
+        super().setUp()
+        self.vendor = make_customer('vendor')
+        UserProfile.objects.filter(user=self.vendor).update(is_vendor=True)
+        self.customer = make_customer('customer')
+        self.neighbour = make_customer('neighbour')
+        self.category = Category.objects.create(name='Storage', description='Storage')
+        self.wishlist = Wishlist.objects.create(user=self.customer)
+        # The product shown by product_detail; the rows are recommended next to it
+        self.product = self.make_card_product('Shown')
+        self.rows = 0
+
+    def make_card_product(self, name):
+        product = make_product(self.vendor, stock=10, name=name)
+        product.categories.add(self.category)
+        ProductImage.objects.bulk_create([
+            ProductImage(product=product, image='product_images/test.png')])
+        return product
+
+    def add_rows(self, count):
+        """Products in the customer's cart and wishlist, each with a review of the shown product."""
+        for _ in range(count):
+            self.rows += 1
+            product = self.make_card_product(f'Product {self.rows}')
+            fill_cart(self.customer, product, 1)
+            self.wishlist.products.add(product)
+            ProductReview.objects.create(product=self.product, user=self.neighbour, rating=4,
+                                         comment='Does the job.')
+            UserInteraction.objects.bulk_create([
+                UserInteraction(user=user, product=product, interaction_type='view')
+                for user in (self.customer, self.neighbour)])
+
+    def assertPageQueries(self, budget, user, url):
+        self.client.force_login(user)
+        for count in (1, 11):
+            self.add_rows(count)
+            cache.clear()
+            self.assertViewQueries(budget, url, status_code=200)
+
+    def test_home(self):
+        self.assertPageQueries(11, self.customer, reverse('home'))
+
+    def test_product_detail(self):
+        self.assertPageQueries(10, self.customer, reverse('product_detail', args=[self.product.pk]))
+
+    def test_cart(self):
+        self.assertPageQueries(4, self.customer, reverse('cart'))
+
+    def test_wishlist(self):
+        self.assertPageQueries(5, self.customer, reverse('wishlist'))
+
+    def test_vendor_products(self):
+        self.assertPageQueries(7, self.vendor, reverse('vendor_products'))
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+                   DATABASE_ROUTERS=[])
+class FragmentCacheTests(TestCase):
+    """Cached product cards and category options on the home page."""
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(make_customer('customer'))
+        vendor = make_customer('vendor')
+        self.lamp = make_product(vendor, stock=1, name='Lamp')
+        self.chair = make_product(vendor, stock=1, name='Chair')
+        Category.objects.create(name='Lighting')
+
+    def home(self):
+        response = self.client.get(reverse('home'))
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode(), response.wsgi_request.fragment_cache_stats
+
+    def test_unchanged_fragments_are_served_from_cache(self):
+        html, first = self.home()
+        self.assertIn('Lamp', html)
+        # Two cards and the category options
+        self.assertEqual((first['hits'], first['misses']), (0, 3))
+
+        # update() sends no signal, so the cached card is served unchanged
+        Product.objects.filter(pk=self.lamp.pk).update(name='Desk lamp')
+        html, second = self.home()
+        self.assertEqual((second['hits'], second['misses']), (3, 0))
+        self.assertGreater(second['saved'], 0.0)
+        self.assertIn('Lamp', html)
+        self.assertNotIn('Desk lamp', html)
+
+    def test_product_change_re_renders_its_card(self):
+        self.home()
+        self.lamp.name = 'Desk lamp'
+        self.lamp.save()
+        html, stats = self.home()
+        self.assertIn('Desk lamp', html)
+        self.assertEqual(stats, {'hits': 2, 'misses': 1, 'saved': stats['saved']})
+
+        # total_views is not on the card; saving it keeps the cached card
+        self.lamp.total_views = 5
+        self.lamp.save(update_fields=['total_views'])
+        html, stats = self.home()
+        self.assertEqual((stats['hits'], stats['misses']), (3, 0))
+
+    def test_category_change_re_renders_the_options(self):
+        self.home()
+        Category.objects.create(name='Furniture')
+        html, stats = self.home()
+        self.assertIn('<option value="Furniture"', html)
+        self.assertEqual((stats['hits'], stats['misses']), (2, 1))
+
+
+# The recommender reads through read_replica() on a pool thread, which only
+# sees committed rows
+@override_settings(ROOT_URLCONF=StorefrontURLConf(async_views))
+class AsyncStorefrontTests(BufferedEventsMixin, TransactionTestCase):
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        super().setUp()
+        vendor = make_customer('vendor')
+        self.customer = make_customer('customer')
+        self.product = make_product(vendor, stock=5, name='Reading lamp')
+        self.async_client.force_login(self.customer)
+
+    async def get(self, name, *args):
+        response = await self.async_client.get(reverse(name, args=args))
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode()
+
+    async def test_home(self):
+        self.assertIn('Reading lamp', await self.get('home'))
+
+    async def test_login_required(self):
+        response = await self.async_client_class().get(reverse('cart'))
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response.url.startswith(reverse('login')))
+
+    async def test_product_detail_and_review(self):
+        self.assertIn('Reading lamp', await self.get('product_detail', self.product.pk))
+        self.assertEqual(await sync_to_async(interaction_buffer.flush)(), (1, 1))
+
+        response = await self.async_client.post(
+            reverse('product_detail', args=[self.product.pk]), {'rating': 5, 'comment': 'Bright.'})
+        self.assertEqual(response.status_code, 302)
+        review = await ProductReview.objects.aget(product=self.product)
+        self.assertTrue(await Job.objects.filter(dedupe_key=f'review_sentiment:{review.pk}').aexists())
+        response = await self.async_client.get(reverse('product_detail', args=[self.product.pk + 100]))
+        self.assertEqual(response.status_code, 404)
+
+    async def test_cart_and_checkout(self):
+        await sync_to_async(fill_cart)(self.customer, self.product, 2)
+        self.assertIn('Reading lamp', await self.get('cart'))
+
+        response = await self.async_client.post(reverse('cart'), {'action': 'place_order'})
+        self.assertRedirects(response, reverse('home'), fetch_redirect_response=False)
+        order = await Order.objects.aget(user=self.customer)
+        self.assertEqual(order.status, 'Pending')
+        self.assertFalse(await CartItem.objects.filter(cart__user=self.customer).aexists())
+
+    async def test_wishlist(self):
+        wishlist = await Wishlist.objects.acreate(user=self.customer)
+        await sync_to_async(wishlist.products.add)(self.product)
+        self.assertIn('Reading lamp', await self.get('wishlist'))
+
+        response = await self.async_client.post(reverse('wishlist'), {'product_id': self.product.pk})
+        self.assertRedirects(response, reverse('wishlist'), fetch_redirect_response=False)
+        self.assertNotIn('Reading lamp', await self.get('wishlist'))
+
+
+def raw_cursor(payload):
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip('=')
+
+
+class CursorPaginatorTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        vendor = make_customer('vendor')
+        # Runs of equal prices, so pages have to break ties on the id
+        for index in range(23):
+            make_product(vendor, stock=1, name=f'P{index}', price=(index * 7) % 5 + 1)
+
+    def walk(self, paginator, token=None, forward=True):
+        """The ids of every page from `token` on, following next (or previous) tokens."""
+        pages = []
+        while True:
+            page = paginator.get_page(token)
+            pages.append([product.id for product in page])
+            token = page.next_token if forward else page.previous_token
+            if token is None:
+                return pages
+
+    def test_token_round_trip(self):
+        paginator = CursorPaginator(Product.objects.all(), 5, ('-price', 'id'))
+        token = paginator.encode_cursor([Decimal('3.50'), 7], 'p')
+        self.assertEqual(paginator.decode_cursor(token), ('p', [Decimal('3.50'), 7]))
+
+        when = datetime(2024, 5, 1, 12, 30, tzinfo=dt_timezone.utc)
+        paginator = CursorPaginator(Order.objects.all(), 5, ('-order_date', '-id'))
+        self.assertEqual(paginator.decode_cursor(paginator.encode_cursor([when, 3], 'n')),
+                         ('n', [when, 3]))
+
+    def test_pages_forward_and_backward_with_mixed_orderings(self):
+        for ordering in (('-price', 'id'), ('price', '-id')):
+            with self.subTest(ordering=ordering):
+                expected = list(Product.objects.order_by(*ordering).values_list('id', flat=True))
+                paginator = CursorPaginator(Product.objects.all(), 5, ordering)
+
+                pages = self.walk(paginator)
+                self.assertEqual([len(page) for page in pages], [5, 5, 5, 5, 3])
+                self.assertEqual(sum(pages, []), expected)
+
+                last = paginator.get_page(paginator.encode_cursor(
+                    list(Product.objects.filter(pk=expected[-6]).values_list(
+                        *paginator.fields).get()), 'n'))
+                self.assertEqual([product.id for product in last], expected[-5:])
+                backward = self.walk(paginator, last.previous_token, forward=False)
+                self.assertEqual(sum(reversed(backward), []), expected[:-5])
+
+    def test_lists_page_like_querysets(self):
+        rows = [{'product_id': index, 'stock': index % 3} for index in range(12)]
+        paginator = CursorPaginator(rows, 5, ('-stock', 'product_id'))
+        first = paginator.get_page()
+        second = paginator.get_page(first.next_token)
+        self.assertEqual([row['product_id'] for row in second], [4, 7, 10, 0, 3])
+        self.assertEqual(list(paginator.get_page(second.previous_token)), list(first))
+
+    def test_invalid_tokens_give_the_first_page(self):
+        paginator = CursorPaginator(Product.objects.all(), 5, ('-price', 'id'))
+        first = [product.id for product in paginator.get_page()]
+        tokens = [
+            'not a token', '!!!', raw_cursor([]), raw_cursor('n'),
+            raw_cursor({'o': ['id'], 'd': 'n', 'k': [1]}),
+            raw_cursor({'o': ['-price', 'id'], 'd': 'x', 'k': ['1', 1]}),
+            raw_cursor({'o': ['-price', 'id'], 'd': 'n', 'k': ['cheap', 1]}),
+            raw_cursor({'o': ['-price', 'id'], 'd': 'n', 'k': [None, 1]}),
+            raw_cursor({'o': ['-price', 'id'], 'd': 'n', 'k': [[1], {'id': 1}]}),
+            raw_cursor({'o': 5, 'd': 'n', 'k': ['1', 1]}),
+        ]
+        for token in tokens:
+            with self.subTest(token=token):
+                self.assertEqual([product.id for product in paginator.get_page(token)], first)
+
+        rows = [{'product_id': index} for index in range(12)]
+        paginator = CursorPaginator(rows, 5, ('product_id',))
+        page = paginator.get_page(raw_cursor({'o': ['product_id'], 'd': 'n', 'k': ['abc']}))
+        self.assertEqual([row['product_id'] for row in page], [0, 1, 2, 3, 4])
+
+    def test_invalid_token_in_a_page_url(self):
+        customer = make_customer('customer')
+        self.client.force_login(customer)
+        token = raw_cursor({'o': ['-order_date', '-id'], 'd': 'n', 'k': [['2024'], 1]})
+        response = self.client.get(reverse('order_history'), {'cursor': token})
+        self.assertEqual(response.status_code, 200)
+
+    def test_count_is_capped(self):
+        paginator = CursorPaginator(Product.objects.all(), 5, ('id',), count_cap=10)
+        with max_queries(1) as context:
+            self.assertEqual(paginator.count, 10)
+        self.assertIn('LIMIT', context.captured_queries[0]['sql'])
+        self.assertTrue(paginator.count_is_capped)
+
+        paginator = CursorPaginator(Product.objects.all(), 5, ('id',), count_cap=100)
+        self.assertEqual(paginator.count, 23)
+        self.assertFalse(paginator.count_is_capped)
+
+
+TIERED_CACHES = {
+    'default': {'BACKEND': 'ecommerce.cache_backends.TieredCache', 'LOCATION': 'tiered-default',
+                'OPTIONS': {'SHARED': 'shared'}},
+    'shared': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+               'LOCATION': 'tiered-shared'},
+}
+
+
+@override_settings(CACHES=TIERED_CACHES)
+class TieredCacheTests(TestCase):
+    def setUp(self):
+        caches['shared'].clear()
+        self.addCleanup(caches['shared'].clear)
+
+    def tiered(self, process='a', **options):
+        """A TieredCache as one process would have it; each `process` gets its own local tier."""
+        cache = TieredCache(f'{self.id()}:{process}', {'OPTIONS': {'SHARED': 'shared', **options}})
+        cache.clear()
+        return cache
+
+    def test_local_tier_evicts_the_least_recently_used_key(self):
+        cache = self.tiered(LOCAL_MAX_ENTRIES=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        cache.reset_stats()
+
+        self.assertEqual([cache.get(key) for key in ('a', 'c', 'b')], [1, 3, 2])
+        stats = cache.stats()
+        self.assertEqual(stats['a']['local_hits'], 1)
+        self.assertEqual(stats['b']['shared_hits'], 1)
+        self.assertEqual(stats['c']['local_hits'], 1)
+
+    def test_local_entries_expire_after_local_timeout(self):
+        cache = self.tiered(LOCAL_TIMEOUT=0.05)
+        cache.set('key', 'value')
+        cache.get('key')
+        time.sleep(0.1)
+        cache.get('key')
+
+        stats = cache.stats()['key']
+        self.assertEqual((stats['local_hits'], stats['shared_hits'], stats['misses']), (1, 1, 0))
+
+    def test_other_processes_see_writes_and_deletes_after_local_timeout(self):
+        writer = self.tiered('writer', LOCAL_TIMEOUT=0.05)
+        reader = self.tiered('reader', LOCAL_TIMEOUT=0.05)
+        writer.set('key', 'old')
+        self.assertEqual(reader.get('key'), 'old')
+
+        writer.set('key', 'new')
+        self.assertEqual(reader.get('key'), 'old')
+        time.sleep(0.1)
+        self.assertEqual(reader.get('key'), 'new')
+
+        writer.delete('key')
+        self.assertIsNone(writer.get('key'))
+        time.sleep(0.1)
+        self.assertIsNone(reader.get('key'))
+
+    def test_cache_stats_reports_hits_per_key_prefix(self):
+        cache = caches['default']
+        cache.clear()
+        cache.reset_stats()
+        cache.set('fragment:home_card:12', 'card')
+        cache.get('fragment:home_card:12')
+        cache.get('fragment:home_card:13')
+        staff = make_customer('staff')
+        User.objects.filter(pk=staff.pk).update(is_staff=True)
+        self.client.force_login(staff)
+
+        stats = self.client.get(reverse('cache_stats')).json()['fragment:home_card']
+        self.assertEqual((stats['local_hits'], stats['shared_hits'], stats['misses']), (1, 0, 1))
+        self.assertEqual(stats['hit_rate'], 0.5)
+
+
+def image_file(name='lamp.jpg', size=(1000, 500), mode='RGB'):
+    data = io.BytesIO()
+    Image.new(mode, size, 'orange').save(data, 'PNG' if name.endswith('.png') else 'JPEG')
+    return SimpleUploadedFile(name, data.getvalue())
+
+
+class ProductImageTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        media = override_settings(MEDIA_ROOT=media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.product = make_product(make_customer('vendor'), stock=1, name='Lamp')
+
+    def add_image(self, **options):
+        image = ProductImage.objects.create(product=self.product, image=image_file(**options))
+        image.refresh_from_db()
+        return image
+
+    def derivative_files(self):
+        return sorted(os.listdir(os.path.join(settings.MEDIA_ROOT, DERIVATIVE_DIR)))
+
+    def render_picture(self, image):
+        return Template('{% load product_images %}'
+                        '{% product_picture image "card" alt="Lamp" css_class="card-img-top" %}'
+                        ).render(Context({'image': image}))
+
+    def test_saving_an_image_builds_hashed_derivatives(self):
+        image = self.add_image()
+        stem = posixpath.splitext(posixpath.basename(image.image.name))[0]
+
+        self.assertEqual({label: derivative['width'] for label, derivative in image.derivatives.items()},
+                         {'card': 400, 'detail': 1000})
+        for label, derivative in image.derivatives.items():
+            for fmt, extension in (('webp', 'webp'), ('fallback', 'jpg')):
+                with default_storage.open(derivative[fmt], 'rb') as derivative_file:
+                    data = derivative_file.read()
+                digest = hashlib.sha256(data).hexdigest()[:12]
+                self.assertEqual(derivative[fmt], f'{DERIVATIVE_DIR}{stem}.{label}.{digest}.{extension}')
+                self.assertEqual(Image.open(io.BytesIO(data)).width, derivative['width'])
+        self.assertEqual(len(self.derivative_files()), 4)
+
+    def test_transparent_images_fall_back_to_png(self):
+        image = self.add_image(name='logo.png', size=(300, 300), mode='RGBA')
+        self.assertTrue(image.derivatives['card']['fallback'].endswith('.png'))
+        # Never upscaled, so both sizes are 300px wide and srcset lists the width once
+        self.assertEqual(image.derivatives['card']['width'], image.derivatives['detail']['width'])
+        self.assertEqual(image.srcset(), f"{settings.MEDIA_URL}{image.derivatives['detail']['fallback']} 300w")
+
+    def test_urls_and_picture_tag(self):
+        image = self.add_image()
+        card, detail = image.derivatives['card'], image.derivatives['detail']
+        self.assertEqual(image.derivative_url('card'), settings.MEDIA_URL + card['fallback'])
+        self.assertEqual(image.derivative_url('detail', 'webp'), settings.MEDIA_URL + detail['webp'])
+        webp_srcset = f"{settings.MEDIA_URL}{card['webp']} 400w, {settings.MEDIA_URL}{detail['webp']} 1000w"
+        self.assertEqual(image.srcset('webp'), webp_srcset)
+
+        html = self.render_picture(image)
+        self.assertIn(f'<source type="image/webp" srcset="{webp_srcset}"', html)
+        self.assertIn(f'<img src="{image.derivative_url("card")}" srcset="{image.srcset()}"', html)
+        self.assertIn('loading="lazy"', html)
+
+    def test_picture_tag_falls_back_to_the_original(self):
+        image = self.add_image()
+        ProductImage.objects.filter(pk=image.pk).update(derivatives={})
+        image.refresh_from_db()
+
+        self.assertEqual(image.derivative_url('card'), image.image.url)
+        self.assertHTMLEqual(self.render_picture(image),
+                             f'<img src="{image.image.url}" class="card-img-top" alt="Lamp">')
+        self.assertHTMLEqual(self.render_picture(None), '<img src="" class="card-img-top" alt="Lamp">')
+
+    def test_backfill_is_idempotent(self):
+        for index in range(2):
+            self.add_image(name=f'lamp{index}.jpg')
+        ProductImage.objects.update(derivatives={})
+        shutil.rmtree(os.path.join(settings.MEDIA_ROOT, DERIVATIVE_DIR))
+
+        def backfill(*args):
+            out = io.StringIO()
+            call_command('generate_image_derivatives', *args, stdout=out)
+            return out.getvalue().strip()
+
+        self.assertEqual(backfill(), 'Built derivatives for 2 images (0 failed).')
+        derivatives = dict(ProductImage.objects.values_list('id', 'derivatives'))
+        files = self.derivative_files()
+        self.assertEqual(len(files), 8)
+
+        self.assertEqual(backfill(), 'Built derivatives for 0 images (0 failed).')
+        self.assertEqual(backfill('--all'), 'Built derivatives for 2 images (0 failed).')
+        self.assertEqual(dict(ProductImage.objects.values_list('id', 'derivatives')), derivatives)
+        self.assertEqual(self.derivative_files(), files)
+
+    def test_derivatives_are_served_as_immutable(self):
+        name = self.add_image().derivatives['card']['webp']
+        response = serve_derivative(RequestFactory().get('/'), name[len(DERIVATIVE_DIR):],
+                                    document_root=os.path.join(settings.MEDIA_ROOT, DERIVATIVE_DIR))
+        # Not response.close(): its request_finished signal would close the test's connection
+        response.file_to_stream.close()
+        self.assertEqual(response['Cache-Control'], IMMUTABLE_CACHE_CONTROL)
+
+
+class GenerateDataTests(TestCase):
+    def test_refuses_to_generate_over_an_existing_dataset(self):
+        make_customer(f'{USERNAME_PREFIX}customer0000000')
+
+        with self.assertRaises(CommandError):
+            call_command('generate_data', '--scale', 'XS', stdout=io.StringIO())
+        self.assertEqual(User.objects.count(), 1)
+        self.assertFalse(Category.objects.exists())
+
+
+class QueryPlanTests(QueryPlanMixin, TestCase):
+    """The hot queries of the storefront and vendor pages stay on indexes."""
+
+    @classmethod
+    def setUpTestData(cls):
+        SyntheticDataGenerator('XS', seed=7).run()
+        cls.vendor = User.objects.filter(userprofile__is_vendor=True).order_by('id').first()
+        cls.customer = User.objects.filter(
+            username__startswith=f'{USERNAME_PREFIX}customer').order_by('id').first()
+        cls.product = Product.objects.filter(user=cls.vendor).order_by('id').first()
+        cls.since = timezone.now() - timedelta(days=30)
+
+    def test_order_history(self):
+        self.assertUsesIndexes(
+            Order.objects.filter(user=self.customer).order_by('-order_date', '-id')[:20])
+
+    def test_pending_orders(self):
+        self.assertUsesIndexes(Order.objects.filter(status='Pending').order_by('-order_date')[:50])
+
+    def test_vendor_sales_over_time(self):
+        self.assertUsesIndexes(OrderDetails.objects.filter(
+            product__user=self.vendor, order__order_date__gte=self.since,
+        ).values('order__order_date').annotate(total_sales=Sum(F('price') * F('quantity'))))
+
+    def test_product_sales(self):
+        self.assertUsesIndexes(OrderDetails.objects.filter(product=self.product))
+
+    def test_product_reviews(self):
+        self.assertUsesIndexes(
+            ProductReview.objects.filter(product=self.product).select_related('user'))
+
+    def test_vendor_sentiment_counts(self):
+        self.assertUsesIndexes(ProductReview.objects.filter(
+            product__user=self.vendor).values('sentiment').annotate(total=Count('sentiment')))
+
+    def test_user_interactions(self):
+        self.assertUsesIndexes(
+            UserInteraction.objects.filter(user=self.customer).order_by('-timestamp')[:50])
+        self.assertUsesIndexes(UserInteraction.objects.filter(
+            product=self.product, interaction_type='view', timestamp__gte=self.since))
+
+    def test_unindexed_filter_is_reported(self):
+        with self.assertRaises(SequentialScan):
+            self.assertUsesIndexes(ProductReview.objects.filter(comment__startswith='Broke'))
+
+
+@override_settings(REQUEST_PROFILE_SAMPLE_RATE=1, DATABASE_ROUTERS=[])
+class RequestProfilingTests(TestCase):
+    def setUp(self):
+        # A clock that only moves when a view says so
+        self.now = 0.0
+        clock = mock.patch('ecommerce.instrumentation.time.perf_counter', lambda: self.now)
+        clock.start()
+        self.addCleanup(clock.stop)
+
+    def view(self, request):
+        User.objects.filter(id__in=[1, 2, 3]).exists()
+        with span('outer'):
+            # Nested spans of the same name count once
+            with span('outer'):
+                self.now += 1.0
+            with span('inner'):
+                self.now += 2.0
+        request.fragment_cache_stats = {'hits': 1, 'misses': 0, 'saved': 0.5}
+        return HttpResponse('ok')
+
+    def test_fingerprint_collapses_literals_and_in_lists(self):
+        statements = [
+            "SELECT * FROM product WHERE name = 'O''Brien' AND id IN (1, 2, 3) AND price > 2.5",
+            "SELECT * FROM product WHERE name = 'Lamp' AND id IN (%s) AND price > %s",
+            "SELECT  *  FROM product\nWHERE name = %s AND id IN (%s, %s) AND price > 10",
+        ]
+        self.assertEqual({fingerprint_sql(sql) for sql in statements},
+                         {'SELECT * FROM product WHERE name = ? AND id IN (...) AND price > ?'})
+
+    def test_server_timing_and_log_line(self):
+        middleware = RequestProfilingMiddleware(self.view)
+        with self.assertLogs('ecommerce.requests', 'INFO') as logs:
+            response = middleware(RequestFactory().get('/profiled/'))
+
+        self.assertEqual(response['Server-Timing'],
+                         'sql;dur=0.0;desc="1 queries", inner;dur=2000.0, '
+                         'outer;dur=3000.0, total;dur=3000.0')
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual({key: record[key] for key in ('method', 'path', 'status', 'queries', 'ms')},
+                         {'method': 'GET', 'path': '/profiled/', 'status': 200, 'queries': 1,
+                          'ms': 3000.0})
+        self.assertEqual(record['spans_ms'], {'inner': 2000.0, 'outer': 3000.0})
+        self.assertEqual(record['fragment_cache'], {'hits': 1, 'misses': 0, 'saved': 0.5})
+        [query] = record['slow_queries']
+        self.assertEqual(query['count'], 1)
+        self.assertIn('IN (...)', query['sql'])
+        self.assertGreater(record['rss_mb'], 0)
+
+    @override_settings(REQUEST_PROFILE_SAMPLE_RATE=0)
+    def test_unsampled_requests_are_not_profiled(self):
+        middleware = RequestProfilingMiddleware(self.view)
+        # The view's spans run without a profile to add to
+        with self.assertNoLogs('ecommerce.requests'):
+            response = middleware(RequestFactory().get('/profiled/'))
+        self.assertEqual(response.content, b'ok')
+        self.assertNotIn('Server-Timing', response)
+
+
+class OnDemandProfilerTests(TestCase):
+    def setUp(self):
+        self.staff = make_customer('staff')
+        self.staff.is_staff = True
+        self.staff.save()
+        profile_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, profile_dir)
+        overrides = override_settings(PROFILE_DIR=profile_dir, PROFILER_MAX_PER_HOUR=2)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        cache.clear()
+
+    def request(self, user, **params):
+        def slow_view(request):
+            sorted(str(i) for i in range(20000))
+            return HttpResponse()
+
+        request = RequestFactory().get('/', params)
+        request.user = user
+        return OnDemandProfilerMiddleware(slow_view)(request)
+
+    def test_staff_request_is_saved_and_reported(self):
+        response = self.request(self.staff, _profile='cprofile')
+        self.assertIn('slow_view', report(response['X-Profile-Id']))
+        self.assertEqual(response['X-Profile-Url'],
+                         f"/profiles/{response['X-Profile-Id']}/")
+
+    def test_only_staff_within_the_rate_limit(self):
+        self.assertNotIn('X-Profile-Id', self.request(make_customer('customer'), _profile='1'))
+        self.assertIn('X-Profile-Id', self.request(self.staff, _profile='sample'))
+        self.assertIn('X-Profile-Id', self.request(self.staff, _profile='cprofile'))
+        response = self.request(self.staff, _profile='cprofile')
+        self.assertNotIn('X-Profile-Id', response)
+        self.assertEqual(response['X-Profile'], 'rate-limited')
+
+
+class IdentityTests(TestCase):
+    def setUp(self):
+        self.user = make_customer('shopper')
+
+    def test_session_user_loads_with_its_profile(self):
+        with self.assertNumQueries(1):
+            user = ProfileBackend().get_user(self.user.pk)
+            self.assertFalse(user.userprofile.is_vendor)
+            self.assertFalse(is_vendor(user))
+
+    def test_vendor_role_is_loaded_once_per_user(self):
+        user = User.objects.get(pk=self.user.pk)
+        with self.assertNumQueries(1):
+            self.assertFalse(is_vendor(user))
+        with self.assertNumQueries(0):
+            self.assertFalse(is_vendor(user))
+
+        profile = self.user.userprofile
+        profile.is_vendor = True
+        profile.save()
+        self.assertTrue(is_vendor(User.objects.get(pk=self.user.pk)))
+
+    @override_settings(CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+        'shared': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'shared'},
+    }, DATABASE_ROUTERS=[])
+    def test_cached_sessions_take_the_session_query_off_requests(self):
+        def request_queries():
+            # A new client, as the session middleware picks its engine up once
+            client = self.client_class()
+            client.force_login(self.user)
+            client.get(reverse('cart'))
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(client.get(reverse('cart')).status_code, 200)
+            return len(queries)
+
+        database_sessions = request_queries()
+        with self.settings(SESSION_ENGINE='django.contrib.sessions.backends.cached_db',
+                           SESSION_CACHE_ALIAS='shared'):
+            self.assertEqual(request_queries(), database_sessions - 1)
+
+
+class JobQueueTests(TestCase):
+    def setUp(self):
+        JOB_RUNS.clear()
+
+    def test_dedupe_key_keeps_one_active_job(self):
+        first = enqueue('record_job_run', 1, dedupe_key='run:1')
+        self.assertEqual(enqueue('record_job_run', 1, dedupe_key='run:1').pk, first.pk)
+
+        Worker(burst=True).run()
+        self.assertEqual(JOB_RUNS, [1])
+        # Once the job is done, the key can be queued again
+        self.assertNotEqual(enqueue('record_job_run', 1, dedupe_key='run:1').pk, first.pk)
+
+    def test_higher_priority_runs_first_and_runtime_is_recorded(self):
+        enqueue('record_job_run', 'low')
+        enqueue('record_job_run', 'high', priority=5)
+        enqueue('record_job_run', 'later', priority=9, delay=3600)
+
+        self.assertEqual(Worker(burst=True).run(), 2)
+        self.assertEqual(JOB_RUNS, ['high', 'low'])
+        self.assertFalse(Job.objects.filter(status=Job.Status.SUCCEEDED, runtime=None).exists())
+        stats = queue_stats()
+        self.assertEqual(stats['queued'], 1)
+        self.assertEqual(stats['finished']['record_job_run']['succeeded']['count'], 2)
+
+    def test_failed_job_is_retried_after_a_backoff_then_failed(self):
+        job = enqueue('failing_job', max_attempts=2)
+
+        Worker(burst=True).run()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.Status.QUEUED, 1))
+        self.assertGreater(job.run_after, timezone.now())
+        self.assertIn('RuntimeError: boom', job.last_error)
+
+        Job.objects.filter(pk=job.pk).update(run_after=timezone.now())
+        Worker(burst=True).run()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.Status.FAILED, 2))
+
+    def test_expired_lease_is_requeued(self):
+        job = enqueue('record_job_run', 1)
+        self.assertEqual(claim('dead-worker', lease=60).pk, job.pk)
+        self.assertIsNone(claim('other-worker', lease=60))
+
+        Job.objects.filter(pk=job.pk).update(lease_expires=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(recover_expired(), (1, 0))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.Status.QUEUED, 1))
+
+    def test_vendor_analytics_queues_one_refresh_and_returns(self):
+        vendor = make_customer('vendor')
+        UserProfile.objects.filter(user=vendor).update(is_vendor=True)
+        self.client.force_login(vendor)
+        cache.clear()
+
+        for _ in range(2):
+            response = self.client.get(reverse('vendor_analytics'))
+            self.assertTrue(response.context['analytics_pending'])
+        self.assertEqual(Job.objects.filter(task='refresh_vendor_analytics',
+                                            args=[vendor.pk]).count(), 1)
+
+
+@skipUnless(importlib.util.find_spec('pyarrow') and importlib.util.find_spec('pandas'),
+            'pyarrow and pandas are not installed')
+class OrderFactsTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        vendor = make_customer('vendor')
+        self.customer = make_customer('customer')
+        self.product = make_product(vendor, stock=1000)
+        self.orders = []
+        for order_date in (date(2024, 1, 15), date(2024, 2, 10), date(2024, 2, 20)):
+            fill_cart(self.customer, self.product, 2)
+            order = place_order(self.customer)
+            Order.objects.filter(pk=order.pk).update(order_date=datetime.combine(
+                order_date, datetime.min.time(), tzinfo=dt_timezone.utc))
+            self.orders.append(order)
+
+    def test_export_only_rewrites_changed_months(self):
+        from .order_facts import export, read_facts
+
+        self.assertEqual(export(self.directory), (2, 0, 0))
+        self.assertEqual(export(self.directory), (0, 0, 2))
+
+        Order.objects.filter(pk=self.orders[0].pk).update(status='Canceled')
+        self.assertEqual(export(self.directory), (1, 0, 1))
+
+        table = read_facts(['order_id', 'status', 'quantity'], directory=self.directory)
+        rows = sorted(zip(*(table.column(name).to_pylist() for name in table.column_names)))
+        self.assertEqual(rows, [(self.orders[0].pk, 'Canceled', 2),
+                                (self.orders[1].pk, 'Pending', 2),
+                                (self.orders[2].pk, 'Pending', 2)])
+
+    @skipUnless(importlib.util.find_spec('pmdarima') and importlib.util.find_spec('xgboost')
+                and importlib.util.find_spec('sklearn'), 'the forecasting libraries are not installed')
+    def test_refreshing_analytics_exports_new_orders(self):
+        from .order_facts import export, read_facts
+        from .tasks import refresh_vendor_analytics
+
+        export(self.directory)
+        # Enough customers for the segmentation's four clusters
+        self.product.categories.add(Category.objects.create(name='Storage', description='Storage'))
+        for index in range(4):
+            customer = make_customer(f'buyer{index}')
+            fill_cart(customer, self.product, index + 1)
+            order = place_order(customer)
+        refresh()
+
+        with override_settings(ORDER_FACTS_DIR=self.directory):
+            refresh_vendor_analytics(self.product.user_id)
+        table = read_facts(['order_id'], directory=self.directory)
+        self.assertIn(order.pk, table.column('order_id').to_pylist())
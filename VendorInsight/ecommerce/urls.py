@@ -1,26 +1,42 @@
+from django.conf import settings
 from django.urls import path
-from .views import register, home, vendor_home, add_product, CustomLoginView, product_detail, add_to_cart, add_to_wishlist, cart, vendor_analytics, vendor_products, wishlist, profile, order_history, vendor_order_status
+from . import views, async_views
+from .views import register, vendor_home, add_product, CustomLoginView, add_to_cart, add_to_wishlist, vendor_analytics, vendor_products, profile, order_history, vendor_order_status, cache_stats, job_stats, profile_report
 from django.contrib.auth.views import LogoutView
 
-urlpatterns = [
-    path('register/', register, name='register'),
-    path('', home, name='home'),
-]
 
-urlpatterns += [
-    path('accounts/login/', CustomLoginView.as_view(), name='login'),
-    path('logout/', LogoutView.as_view(), name='logout'),
-    path('vendor/home/', vendor_home, name='vendor_home'),
-    path('vendor/add_product/', add_product, name='add_product'),
-    path('vendor/analytics/', vendor_analytics, name='vendor_analytics'),
-    path('product/<int:product_id>/', product_detail, name='product_detail'),
-    path('add_to_cart/<int:product_id>/', add_to_cart, name='add_to_cart'),
-    path('add_to_wishlist/<int:product_id>/',
-         add_to_wishlist, name='add_to_wishlist'),
-    path('cart/', cart, name='cart'),
-    path('vendor/products/', vendor_products, name='vendor_products'),
-    path('wishlist/', wishlist, name='wishlist'),
-    path('profile/', profile, name='profile'),
-    path('history/', order_history, name='order_history'),
-    path('vendor/order-status/', vendor_order_status, name='vendor_order_status'),
-]
+def build_urlpatterns(storefront):
+    """
+    The ecommerce URLs, with home, product_detail, cart and wishlist taken
+    from `storefront` (views or async_views).
+    """
+    urlpatterns = [
+        path('register/', register, name='register'),
+        path('', storefront.home, name='home'),
+    ]
+
+    urlpatterns += [
+        path('accounts/login/', CustomLoginView.as_view(), name='login'),
+        path('logout/', LogoutView.as_view(), name='logout'),
+        path('vendor/home/', vendor_home, name='vendor_home'),
+        path('vendor/add_product/', add_product, name='add_product'),
+        path('vendor/analytics/', vendor_analytics, name='vendor_analytics'),
+        path('product/<int:product_id>/', storefront.product_detail, name='product_detail'),
+        path('add_to_cart/<int:product_id>/', add_to_cart, name='add_to_cart'),
+        path('add_to_wishlist/<int:product_id>/',
+             add_to_wishlist, name='add_to_wishlist'),
+        path('cart/', storefront.cart, name='cart'),
+        path('vendor/products/', vendor_products, name='vendor_products'),
+        path('wishlist/', storefront.wishlist, name='wishlist'),
+        path('profile/', profile, name='profile'),
+        path('history/', order_history, name='order_history'),
+        path('vendor/order-status/', vendor_order_status, name='vendor_order_status'),
+        path('cache-stats/', cache_stats, name='cache_stats'),
+        path('job-stats/', job_stats, name='job_stats'),
+        path('profiles/<slug:profile_id>/', profile_report, name='profile_report'),
+    ]
+    return urlpatterns
+
+
+urlpatterns = build_urlpatterns(
+    async_views if getattr(settings, 'ASYNC_STOREFRONT', False) else views)
@@ -0,0 +1,92 @@
+from django.db import connection, transaction
+from django.db.models import Count
+
+from .customer_features import EXCLUDED_STATUS, refresh_orders_on_commit
+from .models import Order, OrderDetails, VendorOrder
+from .pagination import CursorPaginator
+
+ORDER_STATUSES = ('Completed', 'Pending', 'Canceled')
+BOARD_ORDERING = ('-order_date', '-order_id')
+
+
+def link_vendor_orders(order_ids):
+    """
+    Creates the missing VendorOrder rows for the given orders from their
+    order lines. Safe to call repeatedly.
+    """
+    pairs = OrderDetails.objects.filter(order_id__in=order_ids).values_list(
+        'product__user_id', 'order_id', 'order__status', 'order__order_date',
+        'order__total_amount').distinct()
+    VendorOrder.objects.bulk_create([
+        VendorOrder(vendor_id=vendor_id, order_id=order_id, status=status,
+                    order_date=order_date, total_amount=total_amount)
+        for vendor_id, order_id, status, order_date, total_amount in pairs
+    ], batch_size=1000, ignore_conflicts=True)
+
+
+def sync_vendor_orders(order):
+    VendorOrder.objects.filter(order=order).update(
+        status=order.status, order_date=order.order_date,
+        total_amount=order.total_amount)
+
+
+def set_status(vendor, order_ids, from_status, to_status):
+    """
+    Moves the vendor's orders in `order_ids` that are currently `from_status`
+    to `to_status` with one UPDATE on Order and one on VendorOrder. Returns
+    the number of orders changed.
+    """
+    with transaction.atomic():
+        owned = VendorOrder.objects.filter(
+            vendor=vendor, status=from_status, order_id__in=order_ids
+        ).values('order_id')
+        changed = Order.objects.filter(
+            id__in=owned, status=from_status).update(status=to_status)
+        # Every vendor with a line in these orders sees the new status
+        VendorOrder.objects.filter(
+            order_id__in=order_ids, order__status=to_status
+        ).exclude(status=to_status).update(status=to_status)
+        if changed and EXCLUDED_STATUS in (from_status, to_status):
+            refresh_orders_on_commit(order_ids)
+    return changed
+
+
+def order_board(vendor, tokens, per_page=10):
+    """
+    Builds the vendor order board: one cursor page per status plus the
+    number of orders in each status.
+
+    `tokens` maps a status to its cursor token. Where the database allows
+    LIMIT inside UNION (PostgreSQL) the three pages are fetched with a single
+    statement; otherwise one indexed query per status is issued. The counts
+    are one grouped query.
+    """
+    paginators, querysets, states = {}, {}, {}
+    for status in ORDER_STATUSES:
+        paginator = CursorPaginator(
+            VendorOrder.objects.filter(vendor=vendor, status=status),
+            per_page, BOARD_ORDERING)
+        querysets[status], states[status] = paginator.page_queryset(tokens.get(status))
+        paginators[status] = paginator
+
+    rows = {status: [] for status in ORDER_STATUSES}
+    if connection.features.supports_slicing_ordering_in_compound:
+        first, *rest = querysets.values()
+        for entry in first.union(*rest, all=True):
+            rows[entry.status].append(entry)
+        # UNION does not keep each part's order
+        for status, (forward, _) in states.items():
+            rows[status].sort(key=paginators[status].sort_key, reverse=not forward)
+    else:
+        for status, queryset in querysets.items():
+            rows[status] = list(queryset)
+
+    counts = dict(VendorOrder.objects.filter(vendor=vendor).values_list(
+        'status').annotate(total=Count('id')).order_by())
+    return {
+        status: {
+            'page': paginators[status].build_page(rows[status], states[status]),
+            'count': counts.get(status, 0),
+        }
+        for status in ORDER_STATUSES
+    }
@@ -1,37 +1,34 @@
-from django.shortcuts import render,  redirect, get_object_or_404
+from django.shortcuts import redirect, get_object_or_404
 from django.contrib.auth import login, authenticate
 from django.contrib.auth.decorators import login_required
 from .forms import UserRegisterForm, ProductForm, ReviewForm, SalesFilterForm, UserUpdateForm, ProfileUpdateForm
 from django.contrib import messages
-from .models import UserProfile, Product, Category, ProductReview, Cart, CartItem, Wishlist, Order, OrderDetails, User, Discount, UserInteraction
-from django.http import HttpResponseForbidden
+from .models import Product, Category, ProductReview, Cart, CartItem, Wishlist, Order, OrderDetails, Discount
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, \
+    JsonResponse
+from django.contrib.admin.views.decorators import staff_member_required
 from django.db.models import Q, Sum, F
 from django.contrib.auth.views import LoginView
 from django.utils.decorators import method_decorator
 from django.utils import timezone
 from datetime import timedelta
-from django.core.paginator import Paginator
+from .pagination import CursorPaginator
+from .ingestion import record_view, record_interaction
+from .checkout import place_order, CheckoutError
+from .vendor_orders import order_board, set_status
+from .routers import read_replica
+from .identity import is_vendor
+from .instrumentation import render
+from .profiling import load_profile, profile_path, report
+from .jobs import enqueue, queue_stats
+from .tasks import vendor_analytics_key, ANALYTICS_REFRESH_AGE
 from decimal import InvalidOperation
-from .recommendation_engine import recommend_products, recommend_products_collaborative
 from django.core.exceptions import ValidationError
 from django import forms
 from django.contrib.auth.forms import PasswordChangeForm
 from django.contrib.auth import update_session_auth_hash
-import pandas as pd
-import numpy as np
-from pmdarima import auto_arima
-from sklearn.preprocessing import StandardScaler, OneHotEncoder
-from sklearn.compose import ColumnTransformer
-from sklearn.cluster import KMeans
-from xgboost import XGBRegressor
 from django.db.models import Count
 from django.core.cache import cache
-from sklearn.decomposition import PCA
-
-
-from transformers import pipeline
-classifier = pipeline("text-classification",
-                      model='bhadresh-savani/distilbert-base-uncased-emotion', return_all_scores=False)
 
 
 def logout_required(function):
@@ -73,20 +70,15 @@ class CustomLoginView(LoginView):
 
 def vendor_required(func):
     def check_vendor(request, *args, **kwargs):
-        try:
-            user_profile = request.user.userprofile
-            if user_profile.is_vendor:
-                return func(request, *args, **kwargs)
-            else:
-                return HttpResponseForbidden()
-        except UserProfile.DoesNotExist:
-            return HttpResponseForbidden()
+        if is_vendor(request.user):
+            return func(request, *args, **kwargs)
+        return HttpResponseForbidden()
     return check_vendor
 
 
 @login_required  # This is a decorator that will redirect to the login page if the user is not logged in
 def home(request):
-    products = Product.objects.all()
+    products = Product.objects.with_card_data()
     categories = Category.objects.all()
 
     # Search
@@ -102,20 +94,22 @@ def home(request):
     if category_query:
         products = products.filter(categories__name=category_query)
 
-    # Sort
+    # Sort (the trailing id keeps the cursor position unique)
     sort_by = request.GET.get('sort_by', '')
-    if sort_by:
-        if sort_by == 'price_asc':
-            products = products.order_by('price')
-        elif sort_by == 'price_desc':
-            products = products.order_by('-price')
+    if sort_by == 'price_asc':
+        ordering = ('price', 'id')
+    elif sort_by == 'price_desc':
+        ordering = ('-price', '-id')
+    else:
+        ordering = ('id',)
 
+    # The recommender and its sklearn/numpy stack load on first use
+    from .recommendation_engine import recommend_products_collaborative
     recommended_products = recommend_products_collaborative(request.user.id, 5)
 
     # Pagination
-    paginator = Paginator(products, 9)  # Show 9 products per page
-    page = request.GET.get('page')
-    products = paginator.get_page(page)
+    paginator = CursorPaginator(products, 9, ordering)  # Show 9 products per page
+    products = paginator.get_page(request.GET.get('cursor'))
 
     context = {
         'products': products,
@@ -139,20 +133,12 @@ def add_product(request):
     return render(request, 'ecommerce/add_product.html', {'form': form})
 
 
-def analyze_and_update_review_sentiment(review):
-    # Perform sentiment analysis
-    prediction = classifier(review.comment)
-    # Assuming the highest score sentiment is what we want
-    review.sentiment = prediction[0]['label']
-    review.save()
-
-
 @login_required
 def product_detail(request, product_id):
-    product = get_object_or_404(Product, pk=product_id)
-    reviews = ProductReview.objects.filter(product=product)
-
-    product = get_object_or_404(Product, pk=product_id)
+    product = get_object_or_404(
+        Product.objects.with_card_data(), pk=product_id)
+    reviews = ProductReview.objects.filter(
+        product=product).select_related('user')
 
     if request.method == 'POST':
         review_form = ReviewForm(request.POST)
@@ -162,19 +148,20 @@ def product_detail(request, product_id):
             new_review.user = request.user
             new_review.save()
 
-            # Call the analyze_and_update_review_sentiment function here
-            analyze_and_update_review_sentiment(new_review)
+            # Classified by a worker (see tasks.py); the review shows
+            # without a sentiment until then
+            enqueue('analyze_review_sentiment', new_review.id, priority=10,
+                    dedupe_key=f'review_sentiment:{new_review.id}')
 
             messages.success(request, 'Review added successfully!')
             return redirect('product_detail', product_id=product.id)
     else:
         review_form = ReviewForm()
 
-    product.total_views += 1
-    product.save()
-    UserInteraction.objects.create(
-        user=request.user, product=product, interaction_type='view')
-    recommended_products = recommend_products(product_id, 5)
+    # Buffered; the view count and interaction are written in bulk later
+    record_view(request.user, product)
+    from .recommendation_engine import recommend_products
+    recommended_products = recommend_products(product_id, num_recommendations=5)
 
     context = {
         'product': product,
@@ -199,12 +186,9 @@ def add_to_cart(request, product_id):
     else:
         cart_item.quantity += quantity
     cart_item.save()
-    UserInteraction.objects.create(
-        user=request.user, product=product, interaction_type='purchase')
-
-    product.inventory.current_stock -= quantity
-    product.inventory.save()
+    record_interaction(request.user, product, 'purchase')
 
+    # Stock is taken atomically at checkout, see checkout.place_order
     messages.success(request, 'Product added to cart!')
     return redirect('product_detail', product_id=product.id)
 
@@ -214,8 +198,7 @@ def add_to_wishlist(request, product_id):
     product = get_object_or_404(Product, pk=product_id)
     wishlist, _ = Wishlist.objects.get_or_create(user=request.user)
     wishlist.products.add(product)
-    UserInteraction.objects.create(
-        user=request.user, product=product, interaction_type='wishlist')
+    record_interaction(request.user, product, 'wishlist')
     messages.success(request, 'Product added to wishlist!')
     return redirect('product_detail', product_id=product.id)
 
@@ -223,23 +206,18 @@ def add_to_wishlist(request, product_id):
 @login_required
 def cart(request):
     cart = Cart.objects.filter(user=request.user).first()
-    cart_items = CartItem.objects.filter(cart=cart)
+    cart_items = CartItem.objects.filter(cart=cart).select_related('product')
     total_price = sum(item.product.price *
                       item.quantity for item in cart_items)
 
     if request.method == 'POST':
         action = request.POST.get('action')
         if action == 'place_order':
-            # Process the order
-            order = Order.objects.create(
-                user=request.user,
-                total_amount=total_price,
-                order_date=timezone.now(),  # Set the current date and time as the order date
-                status='Pending')  # Set the initial status of the order
-            for item in cart_items:
-                OrderDetails.objects.create(
-                    order=order, product=item.product, quantity=item.quantity, price=item.product.price)
-            cart_items.delete()
+            try:
+                place_order(request.user)
+            except CheckoutError as e:
+                messages.error(request, str(e))
+                return redirect('cart')
             messages.success(request, 'Order placed successfully!')
             return redirect('home')
         elif action == 'remove_item':
@@ -286,6 +264,7 @@ def calculate_vendor_stats(vendor):
 
 @login_required
 @vendor_required
+@read_replica()
 def vendor_home(request):
     vendor = request.user
     stats = calculate_vendor_stats(vendor)
@@ -341,153 +320,41 @@ def vendor_home(request):
 
 @login_required
 @vendor_required
+@read_replica()
 def vendor_analytics(request):
     vendor = request.user
-    products = vendor.products.all()
-
-    # Customer segmentation using K-means
-    customer_orders = Order.objects.filter(orderdetails__product__user=vendor).values('user').annotate(
-        total_spent=Sum(F('orderdetails__price') *
-                        F('orderdetails__quantity')),
-        order_count=Count('id')
-    )
 
-    customer_data = []
-    for order in customer_orders:
-        user = User.objects.get(id=order['user'])
-        age = (timezone.now().date() -
-               user.userprofile.date_of_birth).days // 365
-        most_ordered_category = OrderDetails.objects.filter(order__user=user).values(
-            'product__categories__name').annotate(count=Count('id')).order_by('-count').first()['product__categories__name']
-        customer_data.append({
-            'user_id': user.id,
-            'age': age,
-            'total_order_amount': order['total_spent'],
-            'order_frequency': order['order_count'],
-            'gender': user.userprofile.gender,
-            'most_ordered_category': most_ordered_category
-        })
-
-    features_df = pd.DataFrame(customer_data)
-    preprocessor = ColumnTransformer(
-        transformers=[
-            ('num', StandardScaler(), [
-             'age', 'total_order_amount', 'order_frequency']),
-            ('cat', OneHotEncoder(), ['gender', 'most_ordered_category'])
-        ])
-    X_processed = preprocessor.fit_transform(features_df)
-    X_processed = X_processed.toarray()  # Convert sparse matrix to dense matrix
-
-    kmeans = KMeans(n_clusters=4, random_state=42)
-    clusters = kmeans.fit_predict(X_processed)
-    features_df['cluster'] = clusters
-
-    # Perform PCA for 2D visualization
-    pca = PCA(n_components=3)
-    X_pca = pca.fit_transform(X_processed)
-    features_df['pca_x'] = X_pca[:, 0]
-    features_df['pca_y'] = X_pca[:, 1]
-
-    cluster_averages = features_df.groupby('cluster').agg({
-        'age': 'mean',
-        'total_order_amount': 'mean',
-        'order_frequency': 'mean',
-        'gender': lambda x: x.mode()[0],
-        'most_ordered_category': lambda x: x.mode()[0]
-    }).reset_index()
-
-    cache_key = f'vendor_analytics_{request.user.id}'
-
-    analytics_data = cache.get(cache_key)
-
-    if analytics_data is None:
-        # Sales prediction using ARIMA
-        categories = Category.objects.all()
-        category_sales_predictions = {}
-
-        for category in categories:
-            order_details = OrderDetails.objects.filter(
-                product__categories=category)
-            sales_data = pd.DataFrame(list(order_details.values(
-                'order__order_date', 'price', 'quantity')))
-            sales_data['order__order_date'] = pd.to_datetime(
-                sales_data['order__order_date'])
-            sales_data['sales'] = sales_data['price'] * sales_data['quantity']
-            ts_data = sales_data.groupby(pd.Grouper(key='order__order_date', freq='D'))[
-                'sales'].sum()
-
-            ts_data_log = np.log(ts_data.astype(float) + 1)
-            model = auto_arima(ts_data_log, seasonal=True,
-                               m=12, suppress_warnings=True)
-
-            last_date = ts_data.index[-1]
-            future_dates_sales = pd.date_range(
-                start=last_date + pd.Timedelta(days=1), periods=30, freq='D')
-            future_predictions_sales = np.exp(
-                model.predict(n_periods=len(future_dates_sales)))
-
-            category_sales_predictions[category.name] = {
-                'dates': future_dates_sales.strftime('%Y-%m-%d').tolist(),
-                'predictions': future_predictions_sales.tolist()
-            }
-
-        # Inventory prediction using XGBoost
-        inventory_data = []
-        for product in products:
-            daily_sales = pd.DataFrame(list(OrderDetails.objects.filter(
-                product=product).values('order__order_date', 'quantity')))
-            daily_sales['order__order_date'] = pd.to_datetime(
-                daily_sales['order__order_date'])
-            daily_sales['day_of_week'] = daily_sales['order__order_date'].dt.dayofweek
-            daily_sales['month'] = daily_sales['order__order_date'].dt.month
-
-            X = daily_sales[['day_of_week', 'month']]
-            y = daily_sales['quantity']
-
-            xgb_model = XGBRegressor(objective='reg:squarederror',
-                                     n_estimators=100, learning_rate=0.1, random_state=42)
-            xgb_model.fit(X, y)
-
-            future_dates = pd.date_range(start=daily_sales['order__order_date'].max(
-            ) + pd.Timedelta(days=1), periods=7, freq='D')
-            future_data = pd.DataFrame({
-                'day_of_week': future_dates.dayofweek,
-                'month': future_dates.month
-            })
-            future_predictions = xgb_model.predict(future_data)
-            future_predictions = [
-                int(np.ceil(prediction)) + 1 for prediction in future_predictions]
-
-            inventory_data.append({
-                'product_id': product.id,
-                'product_name': product.name,
-                'current_stock': product.inventory.current_stock,
-                'safety_stock_level': product.inventory.safety_stock_level,
-                'reorder_point': product.inventory.reorder_point,
-                'future_predictions': future_predictions,
-            })
-
-            analytics_data = {
-                'inventory_data': inventory_data,
-                'category_sales_predictions': category_sales_predictions,
-            }
-
-            cache.set(cache_key, analytics_data, timeout=86400)
+    # Forecasts and segments are computed by a worker (see tasks.py); the
+    # page shows the last results, if any, while they are refreshed
+    analytics = cache.get(vendor_analytics_key(vendor.id))
+    if analytics is None or (timezone.now() - analytics['computed_at']
+                             ).total_seconds() > ANALYTICS_REFRESH_AGE:
+        enqueue('refresh_vendor_analytics', vendor.id, priority=5,
+                dedupe_key=f'vendor_analytics:{vendor.id}')
+    if analytics is None:
+        analytics = {
+            'inventory_data': [],
+            'category_sales_predictions': {},
+            'segments': {'data': [], 'clusters': [], 'cluster_averages': []},
+        }
+    segments = analytics['segments']
 
     # Show 10 products per page
-    paginator = Paginator(analytics_data['inventory_data'], 10)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    paginator = CursorPaginator(
+        analytics['inventory_data'], 10, ('product_id',))
+    page_obj = paginator.get_page(request.GET.get('cursor'))
 
     context = {
         'customer_segmentation': {
-            'data': features_df[['pca_x', 'pca_y', 'cluster']].to_dict(orient='records'),
-            'clusters': features_df['cluster'].unique().tolist()
+            'data': segments['data'],
+            'clusters': segments['clusters'],
         },
-        'inventory_data': analytics_data['inventory_data'],
-        'category_sales_predictions': analytics_data['category_sales_predictions'],
-        'cluster_averages': cluster_averages.to_dict(orient='records'),
+        'inventory_data': analytics['inventory_data'],
+        'category_sales_predictions': analytics['category_sales_predictions'],
+        'cluster_averages': segments['cluster_averages'],
         'page_obj': page_obj,
+        'analytics_pending': 'computed_at' not in analytics,
+        'analytics_computed_at': analytics.get('computed_at'),
     }
 
     # Aggregate sentiment data for each product
@@ -529,7 +396,8 @@ class PriceField(forms.DecimalField):
 @vendor_required
 def vendor_products(request):
     vendor = request.user
-    products = Product.objects.filter(user=vendor)
+    products = Product.objects.filter(user=vendor).with_card_data(
+    ).prefetch_related('categories')
     categories = Category.objects.all()
     discount_types = Discount.DiscountType.choices
 
@@ -621,9 +489,9 @@ def vendor_products(request):
             product.save()
             messages.success(request, 'Product updated successfully!')
 
-    paginator = Paginator(products, 10)  # Show 10 products per page
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    # Show 10 products per page
+    paginator = CursorPaginator(products, 10, ('id',))
+    page_obj = paginator.get_page(request.GET.get('cursor'))
 
     context = {
         'page_obj': page_obj,
@@ -636,7 +504,7 @@ def vendor_products(request):
 @login_required
 def wishlist(request):
     wishlist = Wishlist.objects.filter(user=request.user).first()
-    wishlist_products = wishlist.products.all() if wishlist else []
+    wishlist_products = wishlist.products.with_card_data() if wishlist else []
 
     if request.method == 'POST':
         product_id = request.POST.get('product_id')
@@ -685,10 +553,12 @@ def profile(request):
 
 @login_required
 def order_history(request):
-    orders = Order.objects.filter(user=request.user).order_by('-order_date')
+    orders = Order.objects.filter(user=request.user).with_lines()
+    paginator = CursorPaginator(orders, 20, ('-order_date', '-id'))
+    page_obj = paginator.get_page(request.GET.get('cursor'))
 
     context = {
-        'orders': orders,
+        'orders': page_obj,
     }
 
     return render(request, 'ecommerce/order_history.html', context)
@@ -698,43 +568,87 @@ def order_history(request):
 @vendor_required
 def vendor_order_status(request):
     vendor = request.user
-    completed_orders = Order.objects.filter(
-        orderdetails__product__user=vendor, status='Completed').distinct().order_by('-order_date')
-    pending_orders = Order.objects.filter(
-        orderdetails__product__user=vendor, status='Pending').distinct().order_by('-order_date')
-    canceled_orders = Order.objects.filter(
-        orderdetails__product__user=vendor, status='Canceled').distinct().order_by('-order_date')
 
     if request.method == 'POST':
-        order_id = request.POST.get('order_id')
         action = request.POST.get('action')
-        order = get_object_or_404(
-            Order, id=order_id, orderdetails__product__user=vendor)
-
-        if action == 'complete':
-            order.status = 'Completed'
-            order.save()
-            messages.success(request, 'Order marked as completed!')
-        elif action == 'cancel':
-            order.status = 'Canceled'
-            order.save()
-            messages.success(request, 'Order canceled!')
-        elif action == 'delete':
-            order.delete()
-            messages.success(request, 'Order deleted!')
-
-    paginator_completed = Paginator(completed_orders, 10)
-    paginator_pending = Paginator(pending_orders, 10)
-    paginator_canceled = Paginator(canceled_orders, 10)
-
-    page_number = request.GET.get('page')
-    page_obj_completed = paginator_completed.get_page(page_number)
-    page_obj_pending = paginator_pending.get_page(page_number)
-    page_obj_canceled = paginator_canceled.get_page(page_number)
+        transitions = {
+            'complete': 'Completed',
+            'cancel': 'Canceled',
+            'bulk_complete': 'Completed',
+            'bulk_cancel': 'Canceled',
+        }
+
+        if action in ('bulk_complete', 'bulk_cancel'):
+            try:
+                order_ids = [int(order_id) for order_id in request.POST.getlist('order_ids')]
+            except ValueError:
+                return HttpResponseBadRequest('Order ids must be integers.')
+            changed = set_status(vendor, order_ids, 'Pending', transitions[action])
+            messages.success(
+                request, f'{changed} order(s) marked as {transitions[action].lower()}!')
+        else:
+            try:
+                order_id = int(request.POST.get('order_id', ''))
+            except ValueError:
+                return HttpResponseBadRequest('The order id must be an integer.')
+            order = get_object_or_404(Order, id=order_id, vendororder__vendor=vendor)
+
+            if action == 'complete':
+                set_status(vendor, [order.id], 'Pending', 'Completed')
+                messages.success(request, 'Order marked as completed!')
+            elif action == 'cancel':
+                set_status(vendor, [order.id], 'Pending', 'Canceled')
+                messages.success(request, 'Order canceled!')
+            elif action == 'delete':
+                order.delete()
+                messages.success(request, 'Order deleted!')
+
+    # Each list pages independently with its own cursor parameter
+    board = order_board(vendor, {
+        'Completed': request.GET.get('completed_cursor'),
+        'Pending': request.GET.get('pending_cursor'),
+        'Canceled': request.GET.get('canceled_cursor'),
+    })
 
     context = {
-        'page_obj_completed': page_obj_completed,
-        'page_obj_pending': page_obj_pending,
-        'page_obj_canceled': page_obj_canceled,
+        'page_obj_completed': board['Completed']['page'],
+        'page_obj_pending': board['Pending']['page'],
+        'page_obj_canceled': board['Canceled']['page'],
+        'completed_count': board['Completed']['count'],
+        'pending_count': board['Pending']['count'],
+        'canceled_count': board['Canceled']['count'],
     }
     return render(request, 'ecommerce/vendor_order_status.html', context)
+
+
+@staff_member_required
+def cache_stats(request):
+    """Hit rates and read latency per key prefix of this worker's cache."""
+    return JsonResponse(cache.stats() if hasattr(cache, 'stats') else {})
+
+
+@staff_member_required
+def job_stats(request):
+    """Background job queue depth, oldest wait and recent runtimes per task."""
+    return JsonResponse(queue_stats())
+
+
+@staff_member_required
+def profile_report(request, profile_id):
+    """
+    A request profile saved by OnDemandProfilerMiddleware: the top ?top=
+    functions as text, or with ?format=raw the .prof file (for snakeviz) or
+    folded stacks (for flamegraph.pl or speedscope).
+    """
+    meta = load_profile(profile_id)
+    if meta is None:
+        raise Http404('No such profile.')
+    if request.GET.get('format') == 'raw':
+        extension = 'prof' if meta['mode'] == 'cprofile' else 'folded'
+        return FileResponse(open(profile_path(profile_id, extension), 'rb'), as_attachment=True,
+                            filename=f'{profile_id}.{extension}')
+    try:
+        limit = int(request.GET.get('top', 30))
+    except ValueError:
+        limit = 30
+    return HttpResponse(report(profile_id, limit), content_type='text/plain; charset=utf-8')